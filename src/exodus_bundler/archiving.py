@@ -0,0 +1,1227 @@
+# -*- coding: utf-8 -*-
+"""Utilities for writing out the archived and compressed contents of bundles."""
+import base64
+import filecmp
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import stat
+import struct
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zlib
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from subprocess import PIPE
+from subprocess import Popen
+
+from exodus_bundler.copying import copy_file
+from exodus_bundler.errors import InvalidManifestError
+from exodus_bundler.errors import MissingFileError
+from exodus_bundler.errors import UnsupportedCompressionError
+from exodus_bundler.launchers import find_executable
+
+
+# These are all optional, and we'll fall back to external commands when they're unavailable.
+try:
+    import lzma
+except ImportError:
+    lzma = None
+try:
+    # This is available in the standard library starting with Python 3.14.
+    from compression import zstd
+except ImportError:
+    zstd = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Python 2 only provides the older name for this function.
+encodebytes = getattr(base64, 'encodebytes', None) or getattr(base64, 'encodestring')
+
+# Preset dictionaries for compression objects were only added in Python 3.3.
+zdict_supported = sys.version_info >= (3, 3)
+
+# Delta bundles list the paths that should be deleted from the installed bundle in this file.
+removals_filename = '.exodus-removals'
+
+# Every bundle's archive contains an index of its contents with this name, immediately following
+# the root directory, so that it can be read without decompressing the rest of the archive.
+index_filename = '.exodus-index.json'
+
+# The files in the "blobs" format are compressed this many bytes at a time, and at most this much of
+# each compressed blob is held in memory before it's spooled to a temporary file.
+blob_chunk_size = 1024 * 1024
+blob_spool_size = 1024 * 1024
+
+
+class Base64Writer(object):
+    """A write-only file-like object that base64 encodes data into another file incrementally.
+
+    The output is split into lines of 76 characters so that it can be embedded in shell scripts,
+    and only a partial line is ever buffered in memory.
+
+    Attributes:
+        fileobj (file): The underlying file where the encoded data is written.
+    """
+    # This many bytes are encoded into each 76 character line.
+    line_size = 57
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.buffer = b''
+
+    def close(self):
+        """Encodes and writes out any remaining data, the underlying file is left open."""
+        if self.buffer:
+            self.fileobj.write(encodebytes(self.buffer))
+            self.buffer = b''
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        buffer = self.buffer + bytes(data)
+        complete_size = len(buffer) - (len(buffer) % self.line_size)
+        if complete_size:
+            self.fileobj.write(encodebytes(buffer[:complete_size]))
+        self.buffer = buffer[complete_size:]
+        return len(data)
+
+
+class TeeWriter(object):
+    """A write-only file-like object that duplicates everything written to it into several files.
+
+    This allows a single compressed stream to be shared between multiple outputs.
+
+    Attributes:
+        fileobjs (list): The underlying files where the data is written, in order.
+    """
+    def __init__(self, fileobjs):
+        self.fileobjs = list(fileobjs)
+
+    def flush(self):
+        for fileobj in self.fileobjs:
+            fileobj.flush()
+
+    def write(self, data):
+        for fileobj in self.fileobjs:
+            fileobj.write(data)
+        return len(data)
+
+
+class CompressedWriter(object):
+    """A write-only file-like object that compresses data into another file incrementally.
+
+    Attributes:
+        compressor: An object with `compress(data)` and `flush()` methods that return the
+            compressed output, like those returned by `zlib.compressobj()`.
+        fileobj (file): The underlying file where the compressed data is written.
+    """
+    def __init__(self, fileobj, compressor):
+        self.fileobj = fileobj
+        self.compressor = compressor
+        self.closed = False
+
+    def close(self):
+        """Writes out the end of the compressed stream, the underlying file is left open."""
+        if not self.closed:
+            self.fileobj.write(self.compressor.flush())
+            self.closed = True
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        compressed_data = self.compressor.compress(bytes(data))
+        if compressed_data:
+            self.fileobj.write(compressed_data)
+        return len(data)
+
+
+class DecompressingReader(object):
+    """A read-only file-like object that incrementally decompresses a stream of chunks.
+
+    Only as much of the input is consumed as is needed to satisfy each read, so the beginning of
+    a large archive can be read cheaply.
+
+    Attributes:
+        chunks (iterator): Yields the compressed data.
+        decompressor: An object with a `decompress(data)` method that returns the decompressed
+            output, like those returned by `zlib.decompressobj()`.
+    """
+    def __init__(self, chunks, decompressor):
+        self.chunks = iter(chunks)
+        self.decompressor = decompressor
+        self.buffer = b''
+        self.finished = False
+
+    def close(self):
+        close = getattr(self.decompressor, 'close', None)
+        if close is not None:
+            close()
+
+    def read(self, size=-1):
+        while not self.finished and (size < 0 or len(self.buffer) < size):
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.finished = True
+                flush = getattr(self.decompressor, 'flush', None)
+                self.buffer += flush() if flush is not None else b''
+            else:
+                self.buffer += self.decompressor.decompress(chunk)
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+class IdentityCompressor(object):
+    """A compressor (and decompressor) that passes data through unmodified."""
+    def compress(self, data):
+        return data
+
+    def decompress(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+class ParallelGzipCompressor(object):
+    """Compresses independent blocks concurrently into a single valid gzip stream.
+
+    This is the same approach that's used by `pigz`. The input is split into fixed size blocks,
+    and each block is deflated in a worker thread using the tail of the previous block as a preset
+    dictionary. All but the final block end with a sync flush, so that the raw deflate streams can
+    simply be concatenated and wrapped in a single gzip header and trailer. The result can be
+    decompressed by any standard gzip implementation.
+
+    Attributes:
+        block_size (int): The number of uncompressed bytes in each block.
+        jobs (int): The number of worker threads.
+        level (int): The compression level used for each block.
+    """
+    block_size = 128 * 1024
+    # The maximum window size of deflate, the last this many bytes of each block are used as the
+    # dictionary for the next one.
+    dictionary_size = 32 * 1024
+
+    def __init__(self, level=9, jobs=2):
+        self.level = level
+        self.jobs = jobs
+        self.buffer = b''
+        self.crc = 0
+        self.dictionary = b''
+        self.header_written = False
+        self.pending = deque()
+        self.pool = ThreadPool(jobs)
+        self.size = 0
+
+    def compress(self, data):
+        self.buffer += data
+        output = []
+        offset = 0
+        while len(self.buffer) - offset >= self.block_size:
+            output.append(self.submit(self.buffer[offset:offset + self.block_size], final=False))
+            offset += self.block_size
+        self.buffer = self.buffer[offset:]
+        return b''.join(output)
+
+    def compress_block(self, block, dictionary, final):
+        """Deflates a single block, this is called in the worker threads."""
+        if dictionary and zdict_supported:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                          zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY, dictionary)
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(block) + \
+            compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+    def flush(self):
+        output = [self.submit(self.buffer, final=True)]
+        self.buffer = b''
+        while self.pending:
+            output.append(self.pending.popleft().get())
+        self.pool.close()
+        self.pool.join()
+        output.append(struct.pack('<II', self.crc & 0xffffffff, self.size & 0xffffffff))
+        return b''.join(output)
+
+    def submit(self, block, final):
+        """Queues a block for compression and returns any output that's ready to be written."""
+        output = []
+        if not self.header_written:
+            # The magic number, deflate method, no flags, no timestamp, no extra flags, unknown OS.
+            output.append(b'\x1f\x8b\x08\x00' + struct.pack('<I', 0) + b'\x00\xff')
+            self.header_written = True
+        self.pending.append(self.pool.apply_async(
+            self.compress_block, (block, self.dictionary, final)))
+        self.dictionary = (self.dictionary + block)[-self.dictionary_size:]
+        self.crc = zlib.crc32(block, self.crc)
+        self.size += len(block)
+
+        # Limit the number of blocks in flight, and then collect any others that happen to be done.
+        while len(self.pending) > 2 * self.jobs:
+            output.append(self.pending.popleft().get())
+        while self.pending and self.pending[0].ready():
+            output.append(self.pending.popleft().get())
+        return b''.join(output)
+
+
+class ProcessCompressor(object):
+    """Adapts a command that compresses stdin to stdout to the `compress()`/`flush()` interface.
+
+    A background thread continuously reads the output of the process so that it can never block
+    on a full pipe while we're writing to it. Decompression commands are adapted in the same way,
+    using `decompress()` instead of `compress()`.
+    """
+    def __init__(self, args):
+        self.args = args
+        self.process = Popen(args, stdin=PIPE, stdout=PIPE)
+        self.chunks = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.read_output)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        """Stops the process early, discarding any further output."""
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+    def compress(self, data):
+        self.process.stdin.write(data)
+        return self.drain()
+
+    def decompress(self, data):
+        return self.compress(data)
+
+    def drain(self):
+        """Returns all of the output that has been read so far."""
+        with self.lock:
+            data, self.chunks = b''.join(self.chunks), []
+        return data
+
+    def flush(self):
+        self.process.stdin.close()
+        self.thread.join()
+        if self.process.wait() != 0:
+            raise UnsupportedCompressionError(
+                'The "%s" command exited with an error.' % ' '.join(self.args))
+        return self.drain()
+
+    def read_output(self):
+        for chunk in iter(lambda: self.process.stdout.read(64 * 1024), b''):
+            with self.lock:
+                self.chunks.append(chunk)
+
+
+class Codec(object):
+    """Base class representing a compression method for the bundle tarball.
+
+    The class level attributes can be overwritten in derived classes to customize the behavior.
+
+    Attributes:
+        decompressors (:obj:`list` of :obj:`tuple`): The `(probe, command)` pairs that the
+            installer will try in order on the target machine. The first command whose probe
+            succeeds will be used to decompress the bundle from stdin to stdout.
+        default_level (int): The compression level that is used if none is specified.
+        extension (str): The file extension used for tarballs with this compression.
+        name (str): The name used to select the codec from the command-line.
+        signature (bytes): The leading bytes of compressed data, used to detect the codec.
+    """
+    decompressors = []
+    default_level = None
+    extension = None
+    name = None
+    signature = None
+
+    def check_availability(self):
+        """Raises an `UnsupportedCompressionError` if the codec can't be used for compression."""
+        pass
+
+    def create_compressor(self, level=None, jobs=1):
+        """Constructs an object with `compress(data)` and `flush()` methods for the codec.
+
+        Args:
+            level (int, optional): The compression level.
+            jobs (int, optional): The maximum number of threads that the compressor may use.
+        """
+        raise NotImplementedError()
+
+    def create_decompressor(self):
+        """Constructs an object with a `decompress(data)` method for the codec."""
+        raise NotImplementedError()
+
+    def open(self, fileobj, level=None, jobs=1):
+        """Returns a `CompressedWriter` that compresses data into `fileobj` using this codec."""
+        if level is None:
+            level = self.default_level
+        return CompressedWriter(fileobj, self.create_compressor(level, jobs=jobs))
+
+    def shell_decompressor(self):
+        """Constructs a shell snippet that defines a `decompress` function for the installer.
+
+        The snippet exits with an informative error if none of the decompressors are available.
+        """
+        lines = []
+        for index, (probe, command) in enumerate(self.decompressors):
+            lines.append('%s %s > /dev/null 2>&1; then' % ('if' if index == 0 else 'elif', probe))
+            lines.append('    decompress() { %s; }' % command)
+        lines.append('else')
+        lines.append((
+            '    echo "A decompressor for the \\"%s\\" format was not found, please install it or '
+            'use a bundle created with a different \\"--compression\\" option." >&2'
+        ) % self.name)
+        lines.append('    exit 1')
+        lines.append('fi')
+        return '\n'.join(lines)
+
+
+class GzipCodec(Codec):
+    decompressors = [
+        ('command -v gzip', 'gzip -dc'),
+        ('busybox gzip --help', 'busybox gzip -dc'),
+        ('python3 -c "import gzip"',
+         'python3 -c "import gzip, shutil, sys; '
+         'shutil.copyfileobj(gzip.GzipFile(fileobj=sys.stdin.buffer), sys.stdout.buffer)"'),
+    ]
+    default_level = 9
+    extension = 'tgz'
+    name = 'gzip'
+    signature = b'\x1f\x8b'
+
+    def create_compressor(self, level=None, jobs=1):
+        if jobs > 1:
+            return ParallelGzipCompressor(level, jobs=jobs)
+        # The extra 16 in `wbits` produces a gzip header and trailer instead of a zlib one.
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def create_decompressor(self):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+class NoCompressionCodec(Codec):
+    decompressors = [
+        ('true', 'cat'),
+    ]
+    extension = 'tar'
+    name = 'none'
+
+    def create_compressor(self, level=None, jobs=1):
+        return IdentityCompressor()
+
+    def create_decompressor(self):
+        return IdentityCompressor()
+
+
+class XzCodec(Codec):
+    decompressors = [
+        ('command -v xz', 'xz -dc'),
+        ('command -v unxz', 'unxz -c'),
+        ('busybox xz --help', 'busybox xz -dc'),
+        ('python3 -c "import lzma"',
+         'python3 -c "import lzma, shutil, sys; '
+         'shutil.copyfileobj(lzma.open(sys.stdin.buffer), sys.stdout.buffer)"'),
+    ]
+    default_level = 6
+    extension = 'txz'
+    name = 'xz'
+    signature = b'\xfd7zXZ\x00'
+
+    def check_availability(self):
+        if lzma is None and not find_executable('xz'):
+            raise UnsupportedCompressionError(
+                'Neither the Python "lzma" module nor the "xz" command are available.')
+
+    def create_compressor(self, level=None, jobs=1):
+        self.check_availability()
+        if lzma is None:
+            return ProcessCompressor([find_executable('xz'), '-q', '-c', '-%d' % level])
+        return lzma.LZMACompressor(preset=level)
+
+    def create_decompressor(self):
+        self.check_availability()
+        if lzma is None:
+            return ProcessCompressor([find_executable('xz'), '-q', '-dc'])
+        return lzma.LZMADecompressor()
+
+
+class ZstdCodec(Codec):
+    decompressors = [
+        ('command -v zstd', 'zstd -dc'),
+        ('command -v unzstd', 'unzstd -c'),
+        ('python3 -c "import zstandard"',
+         'python3 -c "import sys, zstandard; '
+         'zstandard.ZstdDecompressor().copy_stream(sys.stdin.buffer, sys.stdout.buffer)"'),
+    ]
+    default_level = 3
+    extension = 'tar.zst'
+    name = 'zstd'
+    signature = b'\x28\xb5\x2f\xfd'
+
+    def check_availability(self):
+        if zstd is None and zstandard is None and not find_executable('zstd'):
+            raise UnsupportedCompressionError(
+                'Zstandard compression requires either the "zstandard" Python package or the '
+                '"zstd" command to be installed.')
+
+    def create_compressor(self, level=None, jobs=1):
+        self.check_availability()
+        if zstd is not None:
+            return zstd.ZstdCompressor(level=level)
+        if zstandard is not None:
+            return zstandard.ZstdCompressor(level=level).compressobj()
+        return ProcessCompressor([find_executable('zstd'), '-q', '-c', '-%d' % level])
+
+    def create_decompressor(self):
+        self.check_availability()
+        if zstd is not None:
+            return zstd.ZstdDecompressor()
+        if zstandard is not None:
+            return zstandard.ZstdDecompressor().decompressobj()
+        return ProcessCompressor([find_executable('zstd'), '-q', '-dc'])
+
+
+codecs = {
+    GzipCodec.name: GzipCodec(),
+    NoCompressionCodec.name: NoCompressionCodec(),
+    XzCodec.name: XzCodec(),
+    ZstdCodec.name: ZstdCodec(),
+}
+
+
+def detect_codec(head):
+    """Determines which codec was used to compress some data, based on its leading bytes.
+
+    Args:
+        head (bytes): The beginning of the compressed data.
+    Returns:
+        Codec: The matching codec, data without a known signature is assumed to be uncompressed.
+    """
+    for codec in codecs.values():
+        if codec.signature and head.startswith(codec.signature):
+            return codec
+    return codecs[NoCompressionCodec.name]
+
+
+def content_keys(source_path, mode, content_hash=None):
+    """Constructs the keys used to recognize files that have already been copied into a bundle.
+
+    Files are considered identical if they're the same inode, or if they have the same content hash,
+    and they also need to have the same permissions in order to be linked together.
+
+    Args:
+        source_path (str): The path to the original file.
+        mode (int): The permission bits of the original file.
+        content_hash (str, optional): The hash of the file's contents, if it's already known.
+    Returns:
+        :obj:`list` of :obj:`tuple`: The keys for the file.
+    """
+    st = os.stat(source_path)
+    keys = [('inode', st.st_dev, st.st_ino, mode)]
+    if content_hash:
+        keys.append(('hash', content_hash, mode))
+    return keys
+
+
+def file_hash(path):
+    """Computes the SHA-256 hash of a file's contents, in the same way as `File.hash`."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_manifest(filename):
+    """Loads a manifest that was written out by `write_manifest()`.
+
+    Args:
+        filename (str): The path to the manifest.
+    Returns:
+        dict: The entries of each member, keyed by their paths relative to the bundle's root.
+    """
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)['members']
+    except (IOError, OSError):
+        raise MissingFileError('The "%s" manifest could not be read.' % filename)
+    except (KeyError, TypeError, ValueError):
+        raise InvalidManifestError('The "%s" file is not a valid bundle manifest.' % filename)
+
+
+def encode_index(index):
+    """Serializes the index of a bundle's contents, see `Bundle.create_index()`.
+
+    Args:
+        index (dict): The index.
+    Returns:
+        bytes: The compact JSON encoding of the index.
+    """
+    return json.dumps(index, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def write_manifest(filename, manifest):
+    """Writes out a manifest of a bundle's members, which can be used to construct deltas later.
+
+    Each member is described by a list with its kind ("directory", "file", or "symlink"), followed
+    by the content hash and permissions of files, or the target of symlinks.
+
+    Args:
+        filename (str): The path where the manifest will be written.
+        manifest (dict): The entries of each member, see `TarballWriter.manifest`.
+    """
+    with open(filename, 'w') as f:
+        json.dump({'members': manifest}, f, indent=2, sort_keys=True, separators=(',', ': '))
+        f.write('\n')
+
+
+# The leading bytes of common compressed formats. Blobs starting with these are stored as-is, and
+# they're grouped together at the end of tarballs.
+compressed_signatures = [
+    b'\x1f\x8b',  # gzip
+    b'\x28\xb5\x2f\xfd',  # zstd
+    b'\x42\x5a\x68',  # bzip2
+    b'\x89PNG',  # png
+    b'\xfd7zXZ\x00',  # xz
+    b'\xff\xd8\xff',  # jpeg
+    b'PK\x03\x04',  # zip, jar, and friends
+]
+
+
+def classify_file(path):
+    """Determines the kind of a file's contents based on the first block of data.
+
+    Args:
+        path (str): The path to the file.
+    Returns:
+        str: One of "elf", "compressed", "text", or "binary".
+    """
+    with open(path, 'rb') as f:
+        head = f.read(1024)
+    if head.startswith(b'\x7fELF'):
+        return 'elf'
+    if any(head.startswith(signature) for signature in compressed_signatures):
+        return 'compressed'
+    if b'\x00' not in head:
+        return 'text'
+    return 'binary'
+
+
+# Members are grouped in this order so that similar data is close together in the compression
+# window, and so that the data which will compress the least is at the end.
+file_kinds = ['text', 'elf', 'binary', 'compressed']
+
+
+def member_sort_key(source_path, path):
+    """Constructs a key for sorting files by kind, then extension, then size.
+
+    Args:
+        source_path (str): The location of the file's contents.
+        path (str): The location of the file in the bundle.
+    Returns:
+        tuple: The sort key.
+    """
+    basename = os.path.basename(source_path)
+    # The version suffixes of shared libraries aren't really extensions.
+    if re.search(r'\.so(?:\.|$)', basename):
+        extension = '.so'
+    else:
+        extension = os.path.splitext(basename)[1]
+    return (file_kinds.index(classify_file(source_path)), extension,
+            os.path.getsize(source_path), path)
+
+
+def add_directory(tar, directory, arcname='exodus', member_order='type', reproducible=False):
+    """Adds the contents of a directory to a tarball, like `tar.add()` does recursively.
+
+    Unlike `tar.add()`, this never looks up the names of the owners, which can be slow with
+    network-backed user databases. Files with multiple links are stored as hard links after the
+    first one. The bundle's index (see `index_filename`) always immediately follows the root.
+
+    Args:
+        tar (tarfile.TarFile): The open tarball.
+        directory (str): The directory to add.
+        arcname (str, optional): The name of the directory within the archive.
+        member_order (str, optional): Either "type" to add the directories and symlinks before
+            grouping the files with `member_sort_key()`, or "none" for the sorted filesystem order.
+        reproducible (bool, optional): Whether to normalize the metadata of the members, see
+            `normalize_member()`.
+    """
+    paths, directories, symlinks, files = [], [], [], []
+    for root, directory_names, filenames in os.walk(directory):
+        # Sorting in place also makes `os.walk()` descend in a deterministic order.
+        directory_names.sort()
+        paths.append(root)
+        directories.append(root)
+        for name in sorted(filenames) + directory_names:
+            path = os.path.join(root, name)
+            if os.path.islink(path):
+                # Symlinks to directories are included here because they won't be walked.
+                paths.append(path)
+                symlinks.append(path)
+            elif name in filenames:
+                paths.append(path)
+                files.append(path)
+    if member_order != 'none':
+        files.sort(key=lambda path: member_sort_key(path, path))
+        paths = directories + symlinks + files
+    index_path = os.path.join(directory, index_filename)
+    if index_path in paths:
+        paths.remove(index_path)
+        paths.insert(1, index_path)
+
+    hard_links = {}
+    for path in paths:
+        relative_path = os.path.relpath(path, directory)
+        info = tarfile.TarInfo(arcname if relative_path == '.' else
+                               os.path.join(arcname, relative_path))
+        st = os.lstat(path)
+        info.mode = stat.S_IMODE(st.st_mode)
+        info.mtime = st.st_mtime
+        info.uid, info.gid = st.st_uid, st.st_gid
+        fileobj = None
+        if stat.S_ISDIR(st.st_mode):
+            info.type = tarfile.DIRTYPE
+        elif stat.S_ISLNK(st.st_mode):
+            info.type = tarfile.SYMTYPE
+            info.linkname = os.readlink(path)
+        elif st.st_nlink > 1 and (st.st_dev, st.st_ino) in hard_links:
+            info.type = tarfile.LNKTYPE
+            info.linkname = hard_links[(st.st_dev, st.st_ino)]
+        else:
+            info.type = tarfile.REGTYPE
+            info.size = st.st_size
+            fileobj = open(path, 'rb')
+            if st.st_nlink > 1:
+                hard_links[(st.st_dev, st.st_ino)] = info.name
+        if reproducible:
+            normalize_member(info)
+        try:
+            tar.addfile(info, fileobj)
+        finally:
+            if fileobj:
+                fileobj.close()
+
+
+def normalize_member(info):
+    """Removes the details of the build environment from an archive member's metadata.
+
+    The modification times are set to `SOURCE_DATE_EPOCH` (or zero), the owner is set to root, and
+    directories are given fixed permissions so that they don't depend on the umask.
+
+    Args:
+        info (tarfile.TarInfo): The member's metadata, which is modified in place.
+    """
+    info.mtime = int(os.environ.get('SOURCE_DATE_EPOCH', 0))
+    info.uid = info.gid = 0
+    info.uname = info.gname = ''
+    if info.isdir():
+        info.mode = 0o755
+
+
+class DirectoryWriter(object):
+    """Writes the members of a bundle out as files on disk.
+
+    This and `TarballWriter` share the same interface, so that the layout of a bundle can either be
+    staged in a directory or streamed directly into an archive. All paths are absolute, and must be
+    located within `root`. Identical files are hard linked together within the directory, so that
+    they're stored as hard link members when it's archived.
+
+    When a manifest is tracked, the directory is instead reconciled with the members that were
+    written out previously. Anything that's unchanged from `base_manifest` is left in place, other
+    paths are replaced, and `prune()` removes whatever is no longer part of the bundle.
+
+    Attributes:
+        base_manifest (dict): The manifest of the members that are already in `root`, or `None`.
+        blob_store (BlobStore): A store that files are added to and then hard linked from, so that
+            they only need to be copied once across builds (or `None`).
+        manifest (dict): The manifest of the bundle's members, keyed by their paths relative to
+            `root`, or `None` if it isn't being tracked.
+        root (str): The root directory of the bundle.
+    """
+    def __init__(self, root='/', manifest=False, base_manifest=None, blob_store=None):
+        self.root = root
+        self.blob_store = blob_store
+        self.copies = {}
+        self.base_manifest = base_manifest
+        self.manifest = {} if manifest or base_manifest is not None else None
+
+    def copy(self, source_path, path, content_hash=None):
+        """Copies the contents and permissions of a file on disk to `path`.
+
+        Args:
+            source_path (str): The file to copy.
+            path (str): The destination of the copy.
+            content_hash (str, optional): The hash of the file's contents, if it's already known.
+        """
+        self.makedirs(os.path.dirname(path))
+        mode = stat.S_IMODE(os.stat(source_path).st_mode)
+        keys = content_keys(source_path, mode, content_hash=content_hash)
+        if not self.record(path, lambda: ['file', content_hash or file_hash(source_path), mode]):
+            for key in keys:
+                self.copies.setdefault(key, path)
+            return
+        existing_path = next((self.copies[key] for key in keys if key in self.copies), None)
+        if existing_path is None and self.blob_store is not None and content_hash:
+            existing_path = self.blob_store.add(source_path, content_hash, mode)
+        linked = False
+        if existing_path:
+            try:
+                os.link(existing_path, path)
+                linked = True
+            except OSError:
+                # The blob store might be on a different filesystem, or the blob was just evicted.
+                pass
+        if not linked:
+            copy_file(source_path, path)
+        for key in keys:
+            self.copies.setdefault(key, path)
+
+    def exists(self, path):
+        if self.manifest is not None:
+            # Anything left over from before doesn't count until it's been reconciled.
+            return os.path.relpath(path, self.root) in self.manifest
+        return os.path.lexists(path)
+
+    def makedirs(self, path):
+        if self.manifest is not None and os.path.normpath(path) != os.path.normpath(self.root):
+            if os.path.relpath(path, self.root) in self.manifest:
+                return
+            self.makedirs(os.path.dirname(path))
+            self.record(path, lambda: ['directory'])
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def matches(self, source_path, path):
+        """Checks whether a previously copied file has the same contents as `source_path`."""
+        return filecmp.cmp(source_path, path)
+
+    def prune(self):
+        """Removes any paths from `base_manifest` that were no longer written out."""
+        if self.base_manifest is None:
+            return
+        # The contents of directories come before them in the reverse order.
+        for name in sorted(self.base_manifest, reverse=True):
+            if name in self.manifest:
+                continue
+            path = os.path.join(self.root, name)
+            if self.base_manifest[name][0] == 'directory':
+                try:
+                    os.rmdir(path)
+                except OSError:
+                    pass
+            elif os.path.lexists(path):
+                os.remove(path)
+
+    def readlink(self, path):
+        return os.readlink(path)
+
+    def record(self, path, entry):
+        """Adds a member to the manifest, and clears the way for it to be written out.
+
+        Args:
+            path (str): The path of the member.
+            entry (function): Returns the manifest entry for the member, this is only called when
+                the manifest is being tracked so that any file hashing can be avoided otherwise.
+        Returns:
+            bool: Whether the member needs to be written out, which is only not the case when it's
+                unchanged from `base_manifest` and still exists.
+        """
+        if self.manifest is None:
+            return True
+        name = os.path.relpath(path, self.root)
+        self.manifest[name] = entry = entry()
+        if not os.path.lexists(path):
+            return True
+        if self.base_manifest is not None and self.base_manifest.get(name) == entry:
+            return False
+        is_directory = os.path.isdir(path) and not os.path.islink(path)
+        if entry[0] == 'directory' and is_directory:
+            return True
+        # Files might be hard linked elsewhere, so they're replaced rather than overwritten.
+        if is_directory:
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+        return True
+
+    def symlink(self, target, path):
+        self.makedirs(os.path.dirname(path))
+        if self.record(path, lambda: ['symlink', target]):
+            os.symlink(target, path)
+
+    def write(self, path, content, mode):
+        """Writes out a file with the specified content and permissions."""
+        self.makedirs(os.path.dirname(path))
+        if self.record(path, lambda: ['file', hashlib.sha256(content).hexdigest(), mode]):
+            with open(path, 'wb') as f:
+                f.write(content)
+            os.chmod(path, mode)
+
+    def write_index(self, index):
+        """Writes out the index of the bundle's contents, see `index_filename`."""
+        self.write(os.path.join(self.root, index_filename), encode_index(index), 0o644)
+
+
+class TarballWriter(object):
+    """Writes the members of a bundle directly into an open tarball.
+
+    The file contents are read straight from their original locations, so nothing is ever staged
+    on disk. Paths are mapped to archive member names relative to `root`, which doesn't need to
+    actually exist. With the "type" member order, directories, symlinks, and launchers are added
+    immediately while copied files are held back until `close()` is called, so that they can be
+    added in the order given by `member_sort_key()`.
+
+    Attributes:
+        arcname (str): The name of the root directory within the archive.
+        member_order (str): Either "type" to group similar files, or "none" to add the files in
+            the order that they're copied.
+        reproducible (bool): Whether to normalize the metadata of the members, see
+            `normalize_member()`.
+        root (str): The absolute path that corresponds to `arcname`.
+        tar (tarfile.TarFile): The open tarball.
+        base_manifest (dict): The manifest of a previous version of the bundle, or `None`. Only
+            members that differ from it are added, along with a list of removals, see
+            `removals_filename`.
+        manifest (dict): The manifest of the bundle's members, keyed by their paths relative to
+            `root`, or `None` if it isn't being tracked.
+    """
+    def __init__(self, tar, root='/exodus', arcname='exodus', member_order='type',
+                 reproducible=False, manifest=False, base_manifest=None):
+        self.tar = tar
+        self.root = root
+        self.arcname = arcname
+        self.member_order = member_order
+        self.reproducible = reproducible
+        self.base_manifest = base_manifest
+        self.manifest = {} if manifest or base_manifest is not None else None
+        self.copies = {}
+        self.deferred_files = []
+        self.deferred_links = []
+        self.members = {}
+        self.mtime = time.time()
+        self.umask = os.umask(0)
+        os.umask(self.umask)
+        self.makedirs(root)
+
+    def add_member(self, path, type, mode, size=0, linkname='', fileobj=None):
+        info = tarfile.TarInfo(self.member_name(path))
+        info.type = type
+        info.mode = mode
+        info.size = size
+        info.linkname = linkname
+        info.mtime = self.mtime
+        info.uid, info.gid = os.getuid(), os.getgid()
+        if self.reproducible:
+            normalize_member(info)
+        self.tar.addfile(info, fileobj)
+
+    def add_file(self, source_path, path, mode):
+        """Adds a regular file member with the contents of `source_path`."""
+        with open(source_path, 'rb') as f:
+            self.add_member(path, tarfile.REGTYPE, mode, size=os.fstat(f.fileno()).st_size,
+                            fileobj=f)
+
+    def close(self):
+        """Adds any files that were held back, this must be called before closing the tarball."""
+        self.deferred_files.sort(key=lambda file: member_sort_key(file[0], file[1]))
+        for source_path, path, mode in self.deferred_files:
+            self.add_file(source_path, path, mode)
+        # The hard links can only be added after their targets.
+        for path, mode, existing_path in self.deferred_links:
+            self.add_member(path, tarfile.LNKTYPE, mode, linkname=self.member_name(existing_path))
+        self.deferred_files, self.deferred_links = [], []
+
+        # The data directory is shared between bundles, so nothing is ever removed from it.
+        if self.base_manifest is not None:
+            removals = sorted((name for name in self.base_manifest if name not in self.manifest and
+                               name.split('/')[0] != 'data'), reverse=True)
+            if removals:
+                content = ''.join('%s\n' % name for name in removals).encode('utf-8')
+                self.add_member(os.path.join(self.root, removals_filename), tarfile.REGTYPE,
+                                0o644, size=len(content), fileobj=io.BytesIO(content))
+
+    def copy(self, source_path, path, content_hash=None):
+        """Adds the contents and permissions of a file on disk as `path`.
+
+        Files that are identical to one that was already added are stored as hard link members.
+
+        Args:
+            source_path (str): The file to copy.
+            path (str): The destination of the copy.
+            content_hash (str, optional): The hash of the file's contents, if it's already known.
+        """
+        self.makedirs(os.path.dirname(path))
+        mode = stat.S_IMODE(os.stat(source_path).st_mode)
+        keys = content_keys(source_path, mode, content_hash=content_hash)
+        existing_path = next((self.copies[key] for key in keys if key in self.copies), None)
+        if not self.record(path, lambda: ['file', content_hash or file_hash(source_path), mode]):
+            # Unchanged files can still be linked to, they'll be found in the installed bundle.
+            pass
+        elif existing_path and self.member_order == 'none':
+            self.add_member(path, tarfile.LNKTYPE, mode, linkname=self.member_name(existing_path))
+        elif existing_path:
+            self.deferred_links.append((path, mode, existing_path))
+        elif self.member_order == 'none':
+            self.add_file(source_path, path, mode)
+        else:
+            self.deferred_files.append((source_path, path, mode))
+        for key in keys:
+            self.copies.setdefault(key, path)
+        self.members[os.path.normpath(path)] = ('file', source_path)
+
+    def exists(self, path):
+        return os.path.normpath(path) in self.members
+
+    def makedirs(self, path):
+        path = os.path.normpath(path)
+        if path in self.members:
+            return
+        if path != os.path.normpath(self.root):
+            self.makedirs(os.path.dirname(path))
+        if self.record(path, lambda: ['directory']):
+            self.add_member(path, tarfile.DIRTYPE, 0o777 & ~self.umask)
+        self.members[path] = ('directory', None)
+
+    def matches(self, source_path, path):
+        """Checks whether a previously copied file has the same contents as `source_path`."""
+        kind, original_source_path = self.members[os.path.normpath(path)]
+        return kind == 'file' and filecmp.cmp(source_path, original_source_path)
+
+    def member_name(self, path):
+        relative_path = os.path.relpath(path, self.root)
+        if relative_path == '.':
+            return self.arcname
+        return os.path.join(self.arcname, relative_path)
+
+    def readlink(self, path):
+        kind, target = self.members[os.path.normpath(path)]
+        if kind != 'symlink':
+            raise OSError('"%s" is not a symlink.' % path)
+        return target
+
+    def record(self, path, entry):
+        """Adds a member to the manifest, if it's being tracked.
+
+        Args:
+            path (str): The path of the member.
+            entry (function): Returns the manifest entry for the member, this is only called when
+                the manifest is being tracked so that any file hashing can be avoided otherwise.
+        Returns:
+            bool: Whether the member needs to be added to the archive, which is only not the case
+                when it's unchanged from `base_manifest`.
+        """
+        name = os.path.relpath(path, self.root)
+        if self.manifest is None or name == '.':
+            return True
+        self.manifest[name] = entry = entry()
+        return self.base_manifest is None or self.base_manifest.get(name) != entry
+
+    def symlink(self, target, path):
+        self.makedirs(os.path.dirname(path))
+        if self.record(path, lambda: ['symlink', target]):
+            self.add_member(path, tarfile.SYMTYPE, 0o777, linkname=target)
+        self.members[os.path.normpath(path)] = ('symlink', target)
+
+    def write(self, path, content, mode):
+        """Adds a file with the specified content and permissions."""
+        self.makedirs(os.path.dirname(path))
+        if self.record(path, lambda: ['file', hashlib.sha256(content).hexdigest(), mode]):
+            self.add_member(path, tarfile.REGTYPE, mode, size=len(content),
+                            fileobj=io.BytesIO(content))
+        self.members[os.path.normpath(path)] = ('content', None)
+
+    def write_index(self, index):
+        """Adds the index of the bundle's contents, see `index_filename`.
+
+        This must be called before any other members are added. The index describes the complete
+        bundle, so it's always included in delta bundles and it isn't part of the manifest.
+        """
+        content = encode_index(index)
+        self.add_member(os.path.join(self.root, index_filename), tarfile.REGTYPE, 0o644,
+                        size=len(content), fileobj=io.BytesIO(content))
+
+
+class BlobWriter(TarballWriter):
+    """Writes the files in the bundle's `data/` directory out as independently compressed blobs.
+
+    Everything else is added to the tarball like with `TarballWriter`, so that it contains the
+    directory structure, symlinks, and launchers. Members that are identical to a blob are stored
+    as hard links to it, and these will be extracted after the blobs.
+
+    Attributes:
+        blobs (:obj:`list` of :obj:`tuple`): The `(name, source_path, mode)` of each blob.
+    """
+    def __init__(self, tar, root='/exodus', arcname='exodus', member_order='type',
+                 reproducible=False, manifest=False, base_manifest=None):
+        super(BlobWriter, self).__init__(tar, root=root, arcname=arcname,
+                                         member_order=member_order, reproducible=reproducible,
+                                         manifest=manifest, base_manifest=base_manifest)
+        self.blobs = []
+        self.data_directory = os.path.join(os.path.normpath(root), 'data')
+
+    def add_file(self, source_path, path, mode):
+        if os.path.dirname(os.path.normpath(path)) != self.data_directory:
+            return super(BlobWriter, self).add_file(source_path, path, mode)
+        self.blobs.append((os.path.basename(path), source_path, mode))
+
+
+class CountingWriter(object):
+    """A write-only file-like object that keeps track of how much data was written to a file."""
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.offset = 0
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.offset += len(data)
+        return len(data)
+
+
+def compress_blob(source_path, compression, compression_level=None):
+    """Compresses the contents of a file in chunks, unless that doesn't make it any smaller.
+
+    Only `blob_spool_size` bytes of the compressed data are kept in memory, the rest is spooled to
+    a temporary file. The compression is abandoned as soon as it's larger than the original file.
+
+    Args:
+        source_path (str): The file to compress.
+        compression (str): The name of the compression codec to use.
+        compression_level (int, optional): The compression level, or `None` for the default.
+    Returns:
+        tuple: The `(encoding, blob)`, where `encoding` is either the name of the codec or `'raw'`
+            if the data is stored without compression. The `blob` is a file that's open for
+            reading the data from the beginning, and it must be closed by the caller.
+    """
+    source = open(source_path, 'rb')
+    try:
+        source_size = os.fstat(source.fileno()).st_size
+        chunk = source.read(blob_chunk_size)
+        if compression == 'none' or chunk.startswith(tuple(compressed_signatures)):
+            source.seek(0)
+            return 'raw', source
+
+        codec = codecs[compression]
+        compressor = codec.create_compressor(
+            codec.default_level if compression_level is None else compression_level)
+        blob = tempfile.SpooledTemporaryFile(max_size=blob_spool_size)
+        compressed_size = 0
+        while chunk and compressed_size < source_size:
+            data = compressor.compress(chunk)
+            blob.write(data)
+            compressed_size += len(data)
+            chunk = source.read(blob_chunk_size)
+        data = compressor.flush()
+        blob.write(data)
+        compressed_size += len(data)
+        if chunk or compressed_size >= source_size:
+            blob.close()
+            source.seek(0)
+            return 'raw', source
+    except:  # noqa: E722
+        source.close()
+        raise
+    source.close()
+    blob.seek(0)
+    return compression, blob
+
+
+def write_blobs(fileobj, create_members, compression='gzip', compression_level=None, jobs=1,
+                member_order='type', reproducible=False, manifest=False, base_manifest=None):
+    """Writes a bundle payload made up of a metadata tarball and independently compressed blobs.
+
+    The payload consists of the compressed metadata tarball, followed by each of the blobs, and
+    finally an index. Each line of the index contains the offset, size, encoding, permissions, and
+    name of either a blob or the metadata tarball (named "metadata"). The last 32 bytes of the
+    payload are an "exodus-index" line containing the size of the index.
+
+    Args:
+        fileobj (file): The file where the payload will be written, it is left open.
+        create_members (function): A function that will be called with a `BlobWriter` in order to
+            add the members to the bundle.
+        compression (str, optional): The name of the compression codec to use.
+        compression_level (int, optional): The compression level, or `None` for the default.
+        jobs (int, optional): The maximum number of threads to use for compression.
+        member_order (str, optional): The order of the members within the metadata tarball.
+        reproducible (bool, optional): Whether to normalize the metadata tarball's members.
+        manifest (bool, optional): Whether to track the manifest of the bundle's members.
+        base_manifest (dict, optional): The manifest of a previous version of the bundle, only
+            members that differ from it will be included.
+    """
+    output = CountingWriter(fileobj)
+    index = []
+
+    # The metadata tarball comes first, and the blobs are collected while it's being written.
+    compressed_file = codecs[compression].open(output, level=compression_level, jobs=jobs)
+    with tarfile.open(fileobj=compressed_file, mode='w|') as tar:
+        writer = BlobWriter(tar, member_order=member_order, reproducible=reproducible,
+                            manifest=manifest, base_manifest=base_manifest)
+        create_members(writer)
+        writer.close()
+    compressed_file.close()
+    index.append((0, output.offset, compression, 0o644, 'metadata'))
+
+    # Compress the blobs concurrently, while limiting how many compressed blobs are pending.
+    pool = ThreadPool(max(jobs, 1))
+    pending = deque()
+    try:
+        def write_next():
+            name, mode, result = pending.popleft()
+            encoding, blob = result.get()
+            offset = output.offset
+            try:
+                shutil.copyfileobj(blob, output, blob_chunk_size)
+            finally:
+                blob.close()
+            index.append((offset, output.offset - offset, encoding, mode, name))
+
+        for name, source_path, mode in writer.blobs:
+            pending.append((name, mode, pool.apply_async(
+                compress_blob, (source_path, compression, compression_level))))
+            while len(pending) > 2 * jobs:
+                write_next()
+        while pending:
+            write_next()
+    finally:
+        pool.close()
+        pool.join()
+        # Any blobs that weren't written out because of an error still need to be closed.
+        for name, mode, result in pending:
+            if result.successful():
+                result.get()[1].close()
+
+    index_content = ''.join('%d %d %s %o %s\n' % entry for entry in index).encode('utf-8')
+    output.write(index_content)
+    output.write(('exodus-index %18d\n' % len(index_content)).encode('utf-8'))
+
+
+def write_tarball(fileobj, add_members, compression='gzip', compression_level=None, jobs=1):
+    """Streams a compressed tarball into a file.
+
+    Args:
+        fileobj (file): The file where the compressed tarball will be written, it is left open.
+        add_members (function): A function that will be called with the open `tarfile.TarFile` in
+            order to add the members to the archive.
+        compression (str, optional): The name of the compression codec to use.
+        compression_level (int, optional): The compression level, or `None` for the default.
+        jobs (int, optional): The maximum number of threads to use for compression.
+    """
+    compressed_file = codecs[compression].open(fileobj, level=compression_level, jobs=jobs)
+    with tarfile.open(fileobj=compressed_file, mode='w|') as tar:
+        add_members(tar)
+    compressed_file.close()
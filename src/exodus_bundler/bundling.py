@@ -1,30 +1,56 @@
 # -*- coding: utf-8 -*-
-import base64
-import filecmp
 import hashlib
-import io
 import logging
 import os
 import re
 import shutil
 import stat
-import struct
 import sys
 import tarfile
 import tempfile
+import time
 from collections import defaultdict
 from subprocess import PIPE
 from subprocess import Popen
 
+from exodus_bundler.archiving import Base64Writer
+from exodus_bundler.archiving import DirectoryWriter
+from exodus_bundler.archiving import TarballWriter
+from exodus_bundler.archiving import TeeWriter
+from exodus_bundler.archiving import add_directory
+from exodus_bundler.archiving import codecs
+from exodus_bundler.archiving import index_filename
+from exodus_bundler.archiving import normalize_member
+from exodus_bundler.archiving import read_manifest
+from exodus_bundler.archiving import removals_filename
+from exodus_bundler.archiving import write_blobs
+from exodus_bundler.archiving import write_manifest
+from exodus_bundler.archiving import write_tarball
+from exodus_bundler.caching import BlobStore
+from exodus_bundler.caching import DependencyCache
 from exodus_bundler.dependency_detection import detect_dependencies
+from exodus_bundler.dependency_resolution import CachedResolver
+from exodus_bundler.dependency_resolution import LddResolver
+from exodus_bundler.dependency_resolution import resolvers
+from exodus_bundler.elf_parsing import PT_INTERP
+from exodus_bundler.elf_parsing import read_elf_header
 from exodus_bundler.errors import DependencyDetectionError
+from exodus_bundler.errors import IncompatibleOptionsError
+from exodus_bundler.errors import InvalidBundleError
 from exodus_bundler.errors import InvalidElfBinaryError
+from exodus_bundler.errors import InvalidManifestError
+from exodus_bundler.errors import MergeConflictError
 from exodus_bundler.errors import MissingFileError
 from exodus_bundler.errors import UnexpectedDirectoryError
-from exodus_bundler.errors import UnsupportedArchitectureError
+from exodus_bundler.inspection import merge_indexes
+from exodus_bundler.inspection import open_archive
+from exodus_bundler.inspection import read_blobs
+from exodus_bundler.inspection import read_index
 from exodus_bundler.launchers import CompilerNotFoundError
 from exodus_bundler.launchers import construct_bash_launcher
 from exodus_bundler.launchers import construct_binary_launcher
+from exodus_bundler.profiling import TargetProfile
+from exodus_bundler.stripping import Stripper
 from exodus_bundler.templating import render_template
 from exodus_bundler.templating import render_template_file
 
@@ -32,122 +58,290 @@ from exodus_bundler.templating import render_template_file
 logger = logging.getLogger(__name__)
 
 
-def bytes_to_int(bytes, byteorder='big'):
-    """Simple helper function to convert byte strings into integers."""
-    endian = {'big': '>', 'little': '<'}[byteorder]
-    chars = struct.unpack(endian + ('B' * len(bytes)), bytes)
-    if byteorder == 'big':
-        chars = chars[::-1]
-    return sum(int(char) * 256 ** i for (i, char) in enumerate(chars))
-
-
 def create_bundle(executables, output, tarball=False, rename=[], chroot=None, add=[],
-                  no_symlink=[], shell_launchers=False, detect=False):
+                  no_symlink=[], shell_launchers=False, detect=False, resolver='ldd',
+                  cache_dir=None, jobs=1, compression='gzip', compression_level=None,
+                  direct=False, staging_dir=None, bundle_format='tar', member_order='type',
+                  reproducible=False, manifest=None, base_manifest=None, build_dir=None,
+                  blob_store=None, strip='none', debug_output=None, target_profile=None):
     """Handles the creation of the full bundle."""
     # Initialize these ahead of time so they're always available for error handling.
-    output_filename, output_file, root_directory = None, None, None
+    outputs, root_directory, strip_root = [], None, None
     try:
-
-        # Create a temporary unpackaged bundle for the executables.
-        root_directory = create_unpackaged_bundle(
-            executables, rename=rename, chroot=chroot, add=add, no_symlink=no_symlink,
-            shell_launchers=shell_launchers, detect=detect,
-        )
-
-        # Populate the filename template.
-        output_filename = render_template(output,
-            executables=('-'.join(os.path.basename(executable) for executable in executables)),
-            extension=('tgz' if tarball else 'sh'),
-        )
-
-        # Store a gzipped tarball of the bundle in memory.
-        tar_stream = io.BytesIO()
-        with tarfile.open(fileobj=tar_stream, mode='w:gz') as tar:
-            tar.add(root_directory, arcname='exodus')
-
-        # Configure the appropriate output mechanism.
-        if output_filename == '-':
-            output_file = getattr(sys.stdout, 'buffer', sys.stdout)
+        if debug_output and strip == 'none':
+            raise IncompatibleOptionsError(
+                'A debug bundle can only be written out when stripping the binaries.')
+
+        # Fail early, before doing any real work, if the compression method is unavailable.
+        codecs[compression].check_availability()
+        decompressor = codecs[compression].shell_decompressor()
+
+        # Populate the filename templates and determine the type of each output.
+        executables_name = '-'.join(os.path.basename(executable) for executable in executables)
+        outputs = create_outputs(output, executables_name, tarball=tarball,
+                                 compression=compression)
+        if bundle_format == 'blobs' and any(bundle_output.tarball for bundle_output in outputs):
+            raise IncompatibleOptionsError(
+                'The "blobs" format requires an installation script, it can\'t be written out '
+                'as a tarball.')
+
+        # Delta bundles only include the members that differ from a previous version.
+        base_manifest_members = read_manifest(base_manifest) if base_manifest else None
+
+        # The stripped copies are staged temporarily, unless they're kept in the build directory.
+        strip_directory, debug_directory = None, None
+        if strip != 'none':
+            strip_root = tempfile.mkdtemp(prefix='exodus-strip-', dir=staging_dir)
+            strip_directory = os.path.join(strip_root, 'stripped')
+            if debug_output:
+                debug_directory = os.path.join(strip_root, 'debug')
+
+        # The writers keep track of the manifests, so these require writing the members directly.
+        writers = []
+        if direct or bundle_format == 'blobs' or manifest or base_manifest:
+            # The files will be read from their original locations while writing the tarball.
+            bundle = Bundle(chroot=chroot, resolver=resolver, cache_directory=cache_dir,
+                            jobs=jobs, blob_store_directory=blob_store, strip=strip,
+                            strip_directory=strip_directory, debug_directory=debug_directory,
+                            target_profile=target_profile)
+            populate_bundle(bundle, executables, rename=rename, add=add, no_symlink=no_symlink,
+                            detect=detect)
+
+            def create_members(writer):
+                writers.append(writer)
+                bundle.create_bundle(shell_launchers=shell_launchers, writer=writer)
+
+            def add_members(tar):
+                writer = TarballWriter(tar, member_order=member_order, reproducible=reproducible,
+                                       manifest=bool(manifest), base_manifest=base_manifest_members)
+                create_members(writer)
+                writer.close()
         else:
-            output_file = open(output_filename, 'wb')
-
-        # Construct the installation script and write it out.
-        if not tarball:
-            if output_filename == '-':
-                base64_encoded_tarball = base64.b64encode(tar_stream.getvalue()).decode('utf-8')
-                script_content = render_template_file('install-bundle-noninteractive.sh',
-                    base64_encoded_tarball=base64_encoded_tarball)
-                output_file.write(script_content.encode('utf-8'))
-            else:
-                output_file.write(render_template_file('install-bundle.sh').encode('utf-8'))
-                output_file.write(tar_stream.getvalue())
+            # Create a temporary unpackaged bundle for the executables.
+            root_directory = create_unpackaged_bundle(
+                executables, rename=rename, chroot=chroot, add=add, no_symlink=no_symlink,
+                shell_launchers=shell_launchers, detect=detect, resolver=resolver,
+                cache_dir=cache_dir, jobs=jobs, staging_dir=staging_dir, build_dir=build_dir,
+                blob_store=blob_store, strip=strip, strip_dir=strip_directory,
+                debug_dir=debug_directory, target_profile=target_profile,
+            )
+
+            def add_members(tar):
+                add_directory(tar, root_directory, arcname='exodus', member_order=member_order,
+                              reproducible=reproducible)
+
+        # The heavy lifting of archiving and compressing the bundle happens exactly once, and the
+        # resulting stream is shared by all of the outputs. Memory usage stays constant
+        # regardless of the bundle size because it's streamed directly into each output.
+        stream = open_outputs(outputs, bundle_format=bundle_format, decompressor=decompressor)
+        if bundle_format == 'blobs':
+            write_blobs(stream, create_members, compression=compression,
+                        compression_level=compression_level, jobs=jobs,
+                        member_order=member_order, reproducible=reproducible,
+                        manifest=bool(manifest), base_manifest=base_manifest_members)
         else:
-            # Or just write out the tarball.
-            output_file.write(tar_stream.getvalue())
-
-        # Write out the success message.
-        logger.info('Successfully created "%s".' % output_filename)
+            write_tarball(stream, add_members, compression=compression,
+                          compression_level=compression_level, jobs=jobs)
+        if manifest:
+            write_manifest(manifest, writers[0].manifest)
+
+        # The debugging information is only needed when debugging, so it's written out separately
+        # as a tarball that can be extracted into a debugger's global debug directory.
+        if debug_output:
+            [debug_bundle_output] = create_outputs(debug_output, executables_name, tarball=True,
+                                                   compression=compression)
+            outputs.append(debug_bundle_output)
+
+            def add_debug_members(tar):
+                add_directory(tar, debug_directory, arcname='exodus-debug',
+                              reproducible=reproducible)
+            write_tarball(open_outputs([debug_bundle_output]), add_debug_members,
+                          compression=compression, compression_level=compression_level,
+                          jobs=jobs)
+
+        # Write out anything that follows the payload, and the success messages.
+        for bundle_output in outputs:
+            bundle_output.finish()
+            logger.info('Successfully created "%s".' % bundle_output.filename)
         return True
     except:  # noqa: E722
+        # Don't leave any partially written bundles behind.
+        for bundle_output in outputs:
+            bundle_output.remove()
         raise
     finally:
-        if root_directory:
+        # The persistent build directory is kept around so that it can be reused next time.
+        if root_directory and not build_dir:
             shutil.rmtree(root_directory)
-        if output_file and output_filename:
-            output_file.close()
-            if not tarball and output_filename not in ['-', '/dev/null']:
-                st = os.stat(output_filename)
-                os.chmod(output_filename, st.st_mode | stat.S_IEXEC)
+        if strip_root:
+            shutil.rmtree(strip_root)
+        for bundle_output in outputs:
+            bundle_output.close()
+
+
+def create_outputs(output, executables_name, tarball=False, compression='gzip'):
+    """Constructs the destinations where a bundle will be written out.
+
+    The filename templates are populated, and outputs with the tarball extension are written out
+    as tarballs even without the `tarball` option. Duplicate filenames are only written once.
+
+    Args:
+        output (str): The output filename template, or a list of them.
+        executables_name (str): The value of the `{{executables}}` template variable.
+        tarball (bool, optional): Whether to write out tarballs instead of installation scripts.
+        compression (str, optional): The name of the compression codec that will be used.
+    Returns:
+        :obj:`list` of :obj:`BundleOutput`: The outputs, they still need to be opened.
+    """
+    outputs = []
+    output_filenames = [output] if not isinstance(output, (list, tuple)) else output
+    extension = codecs[compression].extension
+    for output_filename in output_filenames:
+        output_filename = render_template(output_filename, executables=executables_name,
+                                          extension=(extension if tarball else 'sh'))
+        if any(bundle_output.filename == output_filename for bundle_output in outputs):
+            continue
+        output_tarball = tarball or output_filename.endswith('.' + extension)
+        outputs.append(BundleOutput(output_filename, tarball=output_tarball))
+    return outputs
+
+
+def open_outputs(outputs, bundle_format='tar', decompressor=''):
+    """Opens each of the outputs, and writes out anything that precedes the compressed payload.
+
+    Args:
+        outputs (:obj:`list` of :obj:`BundleOutput`): The outputs to open.
+        bundle_format (str, optional): Either "tar" or "blobs", as in `create_bundle()`.
+        decompressor (str, optional): The shell code that defines the `decompress` function.
+    Returns:
+        file: A single stream where the payload should be written, it's shared by all outputs.
+    """
+    for bundle_output in outputs:
+        bundle_output.open(bundle_format=bundle_format, decompressor=decompressor)
+    streams = [bundle_output.stream for bundle_output in outputs]
+    return streams[0] if len(streams) == 1 else TeeWriter(streams)
+
+
+class BundleOutput(object):
+    """One of the destinations where a bundle is written out, along with its script envelope.
+
+    Attributes:
+        file (file): The opened output file, or `None` if it hasn't been opened yet.
+        filename (str): The path of the output file, or `'-'` for stdout.
+        footer (str): Any part of the installation script that follows the payload.
+        stream (file): The file-like object where the compressed payload should be written.
+        tarball (bool): Whether a bare tarball is written out instead of an installation script.
+    """
+    def __init__(self, filename, tarball=False):
+        self.filename = filename
+        self.tarball = tarball
+        self.file, self.stream, self.footer = None, None, None
+
+    def close(self):
+        """Closes the output file and makes installation scripts executable."""
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        if not self.tarball and self.filename not in ['-', '/dev/null']:
+            st = os.stat(self.filename)
+            os.chmod(self.filename, st.st_mode | stat.S_IEXEC)
+
+    def finish(self):
+        """Writes out anything that follows the compressed payload."""
+        if isinstance(self.stream, Base64Writer):
+            self.stream.close()
+        if self.footer:
+            self.file.write(self.footer.encode('utf-8'))
+
+    def open(self, bundle_format='tar', decompressor=''):
+        """Opens the output file and writes out anything that precedes the compressed payload.
+
+        Args:
+            bundle_format (str, optional): Either "tar" or "blobs", as in `create_bundle()`.
+            decompressor (str, optional): The shell code that defines the `decompress` function.
+        """
+        if self.filename == '-':
+            self.file = getattr(sys.stdout, 'buffer', sys.stdout)
+        else:
+            self.file = open(self.filename, 'wb')
+        self.stream = self.file
+        if self.tarball:
+            return
+
+        if bundle_format == 'blobs':
+            # The blobs need to be randomly accessible, so they're always appended to an
+            # installation script that must be saved to disk before being run.
+            template_filename = 'install-bundle-blobs.sh'
+        elif self.filename == '-':
+            # The non-interactive script embeds a base64 encoded tarball, which we'll stream
+            # in between the parts of the script before and after the placeholder.
+            script_content = render_template_file('install-bundle-noninteractive.sh',
+                                                  decompressor=decompressor)
+            script_header, self.footer = script_content.split('{{base64_encoded_tarball}}\n')
+            self.file.write(script_header.encode('utf-8'))
+            self.stream = Base64Writer(self.file)
+            return
+        else:
+            template_filename = 'install-bundle.sh'
+        self.file.write(render_installer(template_filename, decompressor=decompressor))
+
+    def remove(self):
+        """Closes and deletes a partially written output file."""
+        if self.file is None or self.filename in ['-', '/dev/null']:
+            return
+        self.file.close()
+        self.file = None
+        os.remove(self.filename)
+
+
+def render_installer(template_filename, **context):
+    """Renders an installation script that the payload will be appended to.
+
+    The `{{payload_offset}}` in the template is replaced with the one-based byte offset where the
+    payload begins, so that the script can seek straight to it rather than scanning itself for
+    a marker line.
+
+    Args:
+        template_filename (str): The filename of the installation script template.
+        **context: Any additional template variables.
+    Returns:
+        bytes: The encoded contents of the script.
+    """
+    # The length of the offset affects the offset itself, so this settles within a few iterations.
+    payload_offset = 0
+    while True:
+        script_content = render_template_file(template_filename,
+                                              payload_offset=str(payload_offset), **context)
+        script_content = script_content.encode('utf-8')
+        if payload_offset == len(script_content) + 1:
+            return script_content
+        payload_offset = len(script_content) + 1
 
 
 def create_unpackaged_bundle(executables, rename=[], chroot=None, add=[], no_symlink=[],
-                             shell_launchers=False, detect=False):
-    """Creates a temporary directory containing the unpackaged contents of the bundle."""
-    bundle = Bundle(chroot=chroot, working_directory=True)
+                             shell_launchers=False, detect=False, resolver='ldd',
+                             cache_dir=None, jobs=1, staging_dir=None, build_dir=None,
+                             blob_store=None, strip='none', strip_dir=None, debug_dir=None,
+                             target_profile=None):
+    """Creates a temporary directory containing the unpackaged contents of the bundle.
+
+    If `build_dir` is specified, then the bundle is instead staged persistently within it, and
+    only the differences from the previous build are written out.
+    """
+    bundle = Bundle(chroot=chroot, working_directory=not build_dir, resolver=resolver,
+                    cache_directory=cache_dir, jobs=jobs, staging_directory=staging_dir,
+                    build_directory=build_dir, blob_store_directory=blob_store, strip=strip,
+                    strip_directory=strip_dir, debug_directory=debug_dir,
+                    target_profile=target_profile)
     try:
-        # Sanitize the inputs.
-        assert len(executables), 'No executables were specified.'
-        assert len(executables) >= len(rename), \
-            'More renamed options were included than executables.'
-        # Pad the rename's with `True` so that `entry_point` can be specified.
-        entry_points = rename + [True for i in range(len(executables) - len(rename))]
-
-        # Populate the bundle with main executable files and their dependencies.
-        for (executable, entry_point) in zip(executables, entry_points):
-            file = bundle.add_file(executable, entry_point=entry_point)
-
-            # We'll only auto-detect dependencies for these entry points as well.
-            # If we did this later, it would practically bring in the whole system...
-            if detect:
-                dependency_paths = detect_dependencies(file.path)
-                if not dependency_paths:
-                    raise DependencyDetectionError(
-                        ('Automatic dependency detection failed. Either "%s" ' % file.path) +
-                        'is not tracked by your package manager, or your operating system '
-                        'is not currently compatible with the `--detect` option. If not, please '
-                        "create an issue at https://github.com/intoli/exodus and we'll try our "
-                        ' to add support for it in the future.',
-                    )
-
-                for path in dependency_paths:
-                    bundle.add_file(path)
-
-        # Add "additional files" specified with the `--add` option.
-        for filename in add:
-            bundle.add_file(filename)
-
-        # Mark the required files as `no_symlink=True`.
-        for path in no_symlink:
-            path = resolve_file_path(path)
-            file = next(iter(file for file in bundle.files if file.path == path), None)
-            if file:
-                file.no_symlink = True
-
+        populate_bundle(bundle, executables, rename=rename, add=add, no_symlink=no_symlink,
+                        detect=detect)
         bundle.create_bundle(shell_launchers=shell_launchers)
-
         return bundle.working_directory
     except:  # noqa: E722
-        bundle.delete_working_directory()
+        if not build_dir:
+            bundle.delete_working_directory()
         raise
 
 
@@ -162,24 +356,161 @@ def detect_elf_binary(filename):
     return first_four_bytes == b'\x7fELF'
 
 
-def parse_dependencies_from_ldd_output(content):
-    """Takes the output of `ldd` as a string or list of lines and parses the dependencies."""
-    if type(content) == str:
-        content = content.split('\n')
+def merge_bundles(bundles, output, tarball=False, compression='gzip', compression_level=None,
+                  jobs=1, reproducible=False):
+    """Combines existing bundles into a single bundle, without resolving any dependencies again.
 
-    dependencies = []
-    for line in content:
-        # This first one is a special case of invoking the linker as `ldd`.
-        if re.search(r'^\s*(/.*?)\s*=>\s*ldd\s*\(', line):
-            # We'll exclude this because it's the hardcoded INTERP path, and it would be
-            # impossible to get the full path from this command output.
-            continue
-        match = re.search(r'=>\s*(/.*?)\s*\(', line)
-        match = match or re.search(r'\s*(/.*?)\s*\(', line)
-        if match:
-            dependencies.append(match.group(1))
+    The `data/` files are deduplicated by their content hashes, while the `bundles/<hash>/` trees
+    and the `bin/` entry points are carried over as they are. Conflicting entry points are detected
+    up front using the bundles' indexes, and then each bundle is read in a single streaming pass.
+
+    Args:
+        bundles (:obj:`list` of :obj:`str`): The paths to the installation scripts or tarballs.
+        output (str): The output filename template, or a list of them, as in `create_bundle()`.
+        tarball (bool, optional): Whether to write out tarballs instead of installation scripts.
+        compression (str, optional): The name of the compression codec to use.
+        compression_level (int, optional): The compression level, or `None` for the default.
+        jobs (int, optional): The maximum number of threads to use for compression.
+        reproducible (bool, optional): Whether to normalize the metadata of the members.
+    """
+    outputs = []
+    try:
+        codecs[compression].check_availability()
+        decompressor = codecs[compression].shell_decompressor()
+        index = merge_indexes([read_index(filename) for filename in bundles], bundles)
+        outputs = create_outputs(output, '-'.join(sorted(index['entry_points'])),
+                                 tarball=tarball, compression=compression)
+
+        def add_members(tar):
+            writer = TarballWriter(tar, reproducible=reproducible)
+            writer.write_index(index)
+            kinds = {writer.arcname: 'directory'}
+            for filename in bundles:
+                copy_bundle_members(tar, filename, kinds, reproducible=reproducible)
+
+        stream = open_outputs(outputs, decompressor=decompressor)
+        write_tarball(stream, add_members, compression=compression,
+                      compression_level=compression_level, jobs=jobs)
+        for bundle_output in outputs:
+            bundle_output.finish()
+            logger.info('Successfully created "%s".' % bundle_output.filename)
+        return True
+    except:  # noqa: E722
+        # Don't leave any partially written bundles behind.
+        for bundle_output in outputs:
+            bundle_output.remove()
+        raise
+    finally:
+        for bundle_output in outputs:
+            bundle_output.close()
+
+
+def copy_bundle_members(tar, filename, kinds, reproducible=False):
+    """Adds the members of an existing bundle to a tarball, skipping any that were already added.
+
+    Members with the same name are expected to be identical, because the names of both the data
+    files and the bundle roots are content hashes. Only their kinds and permissions are compared,
+    in order to catch conflicting symlinks and data files that differ in their modes. The entry
+    points in `bin/` are the exception, these must have already been checked with
+    `merge_indexes()` and the first one is kept.
 
-    return dependencies
+    Args:
+        tar (tarfile.TarFile): The open tarball.
+        filename (str): The path to the bundle.
+        kinds (dict): The kind of each member that was already added, keyed by name. Directories
+            are "directory", symlinks are "symlink:<target>", files and hard links are
+            "file:<mode>", and everything else is "other". The dictionary is updated in place.
+        reproducible (bool, optional): Whether to normalize the metadata of the members.
+    """
+    bin_directory = os.path.join('exodus', 'bin')
+
+    def add_member(info, fileobj=None):
+        kind = 'other'
+        if info.isdir():
+            kind = 'directory'
+        elif info.issym():
+            kind = 'symlink:%s' % info.linkname
+        elif info.isreg() or info.islnk():
+            kind = 'file:%o' % stat.S_IMODE(info.mode)
+        if info.name in kinds:
+            if kinds[info.name] != kind and os.path.dirname(info.name) != bin_directory:
+                raise MergeConflictError('The "%s" member of "%s" conflicts with another '
+                                         'bundle.' % (info.name, filename))
+            return
+        kinds[info.name] = kind
+        if reproducible:
+            normalize_member(info)
+        tar.addfile(info, fileobj)
+
+    # The blobs of bundles in the "blobs" format are stored outside of the tarball. They're added
+    # first because the tarball can contain hard links to them.
+    umask = os.umask(0)
+    os.umask(umask)
+    data_directory = os.path.join('exodus', 'data')
+    for name, mode, size, fileobj in read_blobs(filename):
+        if data_directory not in kinds:
+            info = tarfile.TarInfo(data_directory)
+            info.type, info.mode, info.mtime = tarfile.DIRTYPE, 0o777 & ~umask, time.time()
+            add_member(info)
+        info = tarfile.TarInfo(os.path.join(data_directory, name))
+        info.mode, info.size, info.mtime = mode, size, time.time()
+        add_member(info, fileobj)
+
+    with open_archive(filename) as bundle_tar:
+        for info in bundle_tar:
+            relative_name = info.name.partition('/')[2]
+            if relative_name == removals_filename:
+                raise InvalidBundleError(
+                    'The "%s" bundle is a delta bundle, which can\'t be merged.' % filename)
+            if relative_name == index_filename:
+                continue
+            info.name = os.path.join('exodus', relative_name) if relative_name else 'exodus'
+            add_member(info, bundle_tar.extractfile(info) if info.isreg() else None)
+
+
+def populate_bundle(bundle, executables, rename=[], add=[], no_symlink=[], detect=False):
+    """Adds the executables, their dependencies, and any additional files to a bundle."""
+    # Sanitize the inputs.
+    assert len(executables), 'No executables were specified.'
+    assert len(executables) >= len(rename), \
+        'More renamed options were included than executables.'
+    # Pad the rename's with `True` so that `entry_point` can be specified.
+    entry_points = rename + [True for i in range(len(executables) - len(rename))]
+
+    # Populate the bundle with main executable files and their dependencies.
+    for (executable, entry_point) in zip(executables, entry_points):
+        file = bundle.add_file(executable, entry_point=entry_point)
+
+        # We'll only auto-detect dependencies for these entry points as well.
+        # If we did this later, it would practically bring in the whole system...
+        if detect:
+            dependency_paths = detect_dependencies(file.path)
+            if not dependency_paths:
+                raise DependencyDetectionError(
+                    ('Automatic dependency detection failed. Either "%s" ' % file.path) +
+                    'is not tracked by your package manager, or your operating system '
+                    'is not currently compatible with the `--detect` option. If not, please '
+                    "create an issue at https://github.com/intoli/exodus and we'll try our "
+                    ' to add support for it in the future.',
+                )
+
+            for path in dependency_paths:
+                bundle.add_file(path)
+
+    # Add "additional files" specified with the `--add` option.
+    for filename in add:
+        bundle.add_file(filename)
+
+    # Mark the required files as `no_symlink=True`.
+    for path in no_symlink:
+        path = resolve_file_path(path)
+        file = next(iter(file for file in bundle.files if file.path == path), None)
+        if file:
+            file.no_symlink = True
+
+    # Keep the dependency cache within its size limit now that we're done adding entries.
+    if bundle.cache:
+        bundle.cache.prune()
 
 
 def resolve_binary(binary):
@@ -240,13 +571,16 @@ class Elf(object):
 
     Attributes:
         bits (int): The number of bits for an ELF binary, either 32 or 64.
+        byteorder (str): The byte order of the binary, either 'little' or 'big'.
         chroot (str): The root directory used when invoking the linker (or `None`).
         file_factory (function): A function used to create new `File` instances.
         linker_file (File): The linker/interpreter specified in the program header.
+        machine (int): The `e_machine` architecture identifier from the ELF header.
         path (str): The path to the file.
+        resolver (Resolver): The resolver used to find the library dependencies.
         type (str): The binary type, one of 'relocatable', 'executable', 'shared', or 'core'.
     """
-    def __init__(self, path, chroot=None, file_factory=None):
+    def __init__(self, path, chroot=None, file_factory=None, resolver=None):
         """Constructs the `Elf` instance.
 
         Args:
@@ -254,100 +588,41 @@ class Elf(object):
             chroot (str, optional): If specified, all dependency and linker paths will be considered
                 relative to this directory (mainly useful for testing).
             file_factory (function, optional): A function to use when creating new `File` instances.
+            resolver (Resolver, optional): The resolver to use when finding dependencies. The
+                linker will be invoked in trace mode (like `ldd`) if this is omitted.
         """
         if not os.path.exists(path):
             raise MissingFileError('The "%s" file was not found.' % path)
         self.path = path
         self.chroot = chroot
         self.file_factory = file_factory or File
+        self.resolver = resolver or LddResolver()
 
         with open(path, 'rb') as f:
-            # Make sure that this is actually an ELF binary.
-            first_four_bytes = f.read(4)
-            if first_four_bytes != b'\x7fELF':
-                raise InvalidElfBinaryError('The "%s" file is not a binary ELF file.' % path)
-
-            # Determine whether this is a 32-bit or 64-bit file.
-            format_byte = f.read(1)
-            self.bits = {b'\x01': 32, b'\x02': 64}.get(format_byte)
-            if not self.bits:
-                raise UnsupportedArchitectureError(
-                    ('The "%s" file does not appear to be either 32 or 64 bits. ' % path) +
-                    'Other architectures are not currently supported, but you can open an '
-                    'issue at https://github.com/intoli/exodus stating your use-case and '
-                    'support might get extended in the future.',
-                )
-
-            # Determine whether it's big or little endian and construct an integer parsing function.
-            endian_byte = f.read(1)
-            byteorder = {b'\x01': 'little', b'\x02': 'big'}[endian_byte]
-            assert byteorder == 'little', 'Big endian is not supported right now.'
-            if not byteorder:
-                raise UnsupportedArchitectureError(
-                    ('The "%s" file does not appear to be little endian, ' % path) +
-                    'and big endian binaries are not currently supported. You can open an '
-                    'issue at https://github.com/intoli/exodus stating your use-case and '
-                    'support might get extended in the future.',
-                )
-
-            def hex(bytes):
-                return bytes_to_int(bytes, byteorder=byteorder)
-
-            # Determine the type of the binary.
-            f.seek(hex(b'\x10'))
-            e_type = hex(f.read(2))
-            self.type = {1: 'relocatable', 2: 'executable', 3: 'shared', 4: 'core'}[e_type]
-
-            # Find the program header offset.
-            e_phoff_start = {32: hex(b'\x1c'), 64: hex(b'\x20')}[self.bits]
-            e_phoff_length = {32: 4, 64: 8}[self.bits]
-            f.seek(e_phoff_start)
-            e_phoff = hex(f.read(e_phoff_length))
-
-            # Determine the size of a program header entry.
-            e_phentsize_start = {32: hex(b'\x2a'), 64: hex(b'\x36')}[self.bits]
-            f.seek(e_phentsize_start)
-            e_phentsize = hex(f.read(2))
-
-            # Determine the number of program header entries.
-            e_phnum_start = {32: hex(b'\x2c'), 64: hex(b'\x38')}[self.bits]
-            f.seek(e_phnum_start)
-            e_phnum = hex(f.read(2))
-
-            # Loop through each program header.
+            # This makes sure that it's actually an ELF binary and parses the program headers.
+            header = read_elf_header(f, path)
+            self.bits = header.bits
+            self.byteorder = header.byteorder
+            self.machine = header.machine
+            self.type = header.type
+
+            # A PT_INTERP program header corresponds to the linker.
             self.linker_file = None
-            for header_index in range(e_phnum):
-                header_start = e_phoff + header_index * e_phentsize
-                f.seek(header_start)
-                p_type = f.read(4)
-                # A p_type of \x03 corresponds to a PT_INTERP header (e.g. the linker).
-                if len(p_type) == 0:
-                    break
-                if not p_type == b'\x03\x00\x00\x00':
+            for program_header in header.program_headers:
+                if program_header.type != PT_INTERP:
                     continue
 
-                # Determine the offset for the segment.
-                p_offset_start = header_start + {32: hex(b'\04'), 64: hex(b'\x08')}[self.bits]
-                p_offset_length = {32: 4, 64: 8}[self.bits]
-                f.seek(p_offset_start)
-                p_offset = hex(f.read(p_offset_length))
-
-                # Determine the size of the segment.
-                p_filesz_start = header_start + {32: hex(b'\x10'), 64: hex(b'\x20')}[self.bits]
-                p_filesz_length = {32: 4, 64: 8}[self.bits]
-                f.seek(p_filesz_start)
-                p_filesz = hex(f.read(p_filesz_length))
-
                 # Read in the segment.
-                f.seek(p_offset)
-                segment = f.read(p_filesz)
+                f.seek(program_header.offset)
+                segment = f.read(program_header.filesz)
                 # It should be null-terminated (b'\x00' in Python 2, 0 in Python 3).
                 assert segment[-1] in [b'\x00', 0], 'The string should be null terminated.'
                 assert self.linker_file is None, 'More than one linker found.'
                 linker_path = segment[:-1].decode('ascii')
                 if chroot:
                     linker_path = os.path.join(chroot, os.path.relpath(linker_path, '/'))
-                self.linker_file = self.file_factory(linker_path, chroot=self.chroot)
+                self.linker_file = self.file_factory(linker_path, chroot=self.chroot,
+                                                     resolver=self.resolver)
 
     def __eq__(self, other):
         return isinstance(other, Elf) and self.path == self.path
@@ -360,51 +635,40 @@ class Elf(object):
         return '<Elf(path="%s")>' % self.path
 
     def find_direct_dependencies(self, linker_file=None):
-        """Runs the specified linker and returns a set of the dependencies as `File` instances."""
+        """Runs the specified linker and returns a set of the dependencies as `File` instances.
+
+        Note:
+            The results are stored in the resolver's `resolution_table`, so the same library will
+            only be traced once for each linker, even when it's shared by several entry points.
+        """
         linker_file = linker_file or self.linker_file
         if not linker_file:
             return set()
-        linker_path = linker_file.path
-        environment = {}
-        environment.update(os.environ)
-        environment['LD_TRACE_LOADED_OBJECTS'] = '1'
-        extra_ldd_arguments = []
-        if self.chroot:
-            ld_library_path = '/lib64:/usr/lib64:/lib/:/usr/lib:/lib32/:/usr/lib32/:'
-            ld_library_path += environment.get('LD_LIBRARY_PATH', '')
-            directories = []
-            for directory in ld_library_path.split(':'):
-                if os.path.isabs(directory):
-                    directory = os.path.join(self.chroot, os.path.relpath(directory, '/'))
-                directories.append(directory)
-            ld_library_path = ':'.join(directories)
-            environment['LD_LIBRARY_PATH'] = ld_library_path
-            # We only need to avoid including system dependencies if there's a chroot set.
-            extra_ldd_arguments += ['--inhibit-cache', '--inhibit-rpath', '']
-
-        process = Popen(['ldd'] + extra_ldd_arguments + [self.path],
-                        executable=linker_path, stdout=PIPE, stderr=PIPE, env=environment)
-        stdout, stderr = process.communicate()
-        combined_output = stdout.decode('utf-8').split('\n') + stderr.decode('utf-8').split('\n')
-        # Note that we're explicitly adding the linker because when we invoke it as `ldd` we can't
-        # extract the real path from the trace output. Even if it were here twice, it would be
-        # deduplicated though the use of a set.
-        filenames = parse_dependencies_from_ldd_output(combined_output) + [linker_path]
-        return set(self.file_factory(filename, chroot=self.chroot, library=True)
-                   for filename in filenames)
+
+        def resolve():
+            filenames = self.resolver.find_direct_dependencies(self, linker_file)
+            return frozenset(self.file_factory(filename, chroot=self.chroot, library=True,
+                                               resolver=self.resolver)
+                             for filename in filenames)
+
+        key = (self.path, linker_file.path)
+        return set(self.resolver.resolve_once(key, resolve))
 
     @stored_property
     def dependencies(self):
         """Run's the files' linker iteratively and returns a set of all library dependencies."""
+        def find_direct_dependencies(elf):
+            return elf.find_direct_dependencies(self.linker_file)
+
         all_dependencies = set()
         unprocessed_dependencies = set(self.direct_dependencies)
         while len(unprocessed_dependencies):
             all_dependencies |= unprocessed_dependencies
+            # Each frontier of the search is independent, so it can be resolved concurrently.
+            elves = [dependency.elf for dependency in unprocessed_dependencies if dependency.elf]
             new_dependencies = set()
-            for dependency in unprocessed_dependencies:
-                if dependency.elf:
-                    new_dependencies |= set(
-                        dependency.elf.find_direct_dependencies(self.linker_file))
+            for direct_dependencies in self.resolver.map(find_direct_dependencies, elves):
+                new_dependencies |= set(direct_dependencies)
             unprocessed_dependencies = new_dependencies - all_dependencies
         return all_dependencies
 
@@ -431,7 +695,8 @@ class File(object):
         path (str): The absolute normalized path to the file on disk.
     """
 
-    def __init__(self, path, entry_point=None, chroot=None, library=False, file_factory=None):
+    def __init__(self, path, entry_point=None, chroot=None, library=False, file_factory=None,
+                 resolver=None):
         """Constructor for the `File` class.
 
         Note:
@@ -444,6 +709,7 @@ class File(object):
             chroot (str, optional): If specified, all dependency and linker paths will be considered
                 relative to this directory (mainly useful for testing).
             file_factory (function, optional): A function to use when creating new `File` instances.
+            resolver (Resolver, optional): The resolver to use when finding dependencies.
         """
         # Find the full path to the file.
         self.path = resolve_file_path(path, search_environment_path=(entry_point is not None))
@@ -456,7 +722,7 @@ class File(object):
 
         # Parse an `Elf` object from the file.
         try:
-            self.elf = Elf(path, chroot=chroot, file_factory=file_factory)
+            self.elf = Elf(path, chroot=chroot, file_factory=file_factory, resolver=resolver)
         except InvalidElfBinaryError:
             self.elf = None
 
@@ -476,30 +742,29 @@ class File(object):
     def __repr__(self):
         return '<File(path="%s")>' % self.path
 
-    def copy(self, working_directory):
+    def copy(self, working_directory, writer=None):
         """Copies the file to a location based on its `destination` property.
 
         Args:
             working_directory (str): The root that the `destination` will be joined with.
+            writer (DirectoryWriter, optional): The writer used to create the bundle's members,
+                defaults to writing directly to disk.
         Returns:
             str: The normalized and absolute destination path.
         """
+        writer = writer or DirectoryWriter(working_directory)
         full_destination = os.path.join(working_directory, self.destination)
         full_destination = os.path.normpath(os.path.abspath(full_destination))
 
         # The filenames are based on content hashes, so there's no need to copy it twice.
-        if os.path.exists(full_destination):
+        if writer.exists(full_destination):
             return full_destination
 
-        parent_directory = os.path.dirname(full_destination)
-        if not os.path.exists(parent_directory):
-            os.makedirs(parent_directory)
-
-        shutil.copy(self.path, full_destination)
+        writer.copy(self.content_path, full_destination, content_hash=self.hash)
 
         return full_destination
 
-    def create_entry_point(self, working_directory, bundle_root):
+    def create_entry_point(self, working_directory, bundle_root, writer=None):
         """Creates a symlink in `bin/` to the executable or its launcher.
 
         Note:
@@ -507,17 +772,19 @@ class File(object):
         Args:
             working_directory (str): The root that the `destination` will be joined with.
             bundle_root (str): The root that `source` will be joined with.
+            writer (DirectoryWriter, optional): The writer used to create the bundle's members,
+                defaults to writing directly to disk.
         """
+        writer = writer or DirectoryWriter(working_directory)
         source_path = os.path.join(bundle_root, self.source)
         bin_directory = os.path.join(working_directory, 'bin')
-        if not os.path.exists(bin_directory):
-            os.makedirs(bin_directory)
         entry_point_path = os.path.join(bin_directory, self.entry_point)
         relative_destination_path = os.path.relpath(source_path, bin_directory)
-        os.symlink(relative_destination_path, entry_point_path)
+        writer.symlink(relative_destination_path, entry_point_path)
 
     def create_launcher(self, working_directory, bundle_root, linker_basename, symlink_basename,
-                        shell_launcher=False):
+                        shell_launcher=False, writer=None, launcher_cache_directory=None,
+                        provided_paths=()):
         """Creates a launcher at `source` for `destination`.
 
         Note:
@@ -529,51 +796,37 @@ class File(object):
             symlink_basename (str): The basename of the symlink to the actual executable.
             shell_launcher (bool, optional): Forces the use of shell script launcher instead of
                 attempting to compile first using musl or diet c.
+            writer (DirectoryWriter, optional): The writer used to create the bundle's members,
+                defaults to writing directly to disk.
+            launcher_cache_directory (str, optional): A directory where compiled launchers are
+                persistently stored, so that they're only recompiled when their inputs change.
+            provided_paths (:obj:`set` of :obj:`str`, optional): The paths of the dependencies
+                that are loaded from the target hosts instead of being bundled.
         Returns:
             str: The normalized and absolute path to the launcher.
         """
+        writer = writer or DirectoryWriter(working_directory)
         destination_path = os.path.join(working_directory, self.destination)
         source_path = os.path.join(bundle_root, self.source)
 
         # Create the symlink.
         source_parent = os.path.dirname(source_path)
-        if not os.path.exists(source_parent):
-            os.makedirs(source_parent)
         relative_destination_path = os.path.relpath(destination_path, source_parent)
         symlink_path = os.path.join(source_parent, symlink_basename)
-        os.symlink(relative_destination_path, symlink_path)
+        writer.symlink(relative_destination_path, symlink_path)
         executable = os.path.join('.', symlink_basename)
 
         # Copy over the linker.
         linker_path = os.path.join(source_parent, linker_basename)
-        if not os.path.exists(linker_path):
-            shutil.copy(self.elf.linker_file.path, linker_path)
+        if not writer.exists(linker_path):
+            writer.copy(self.elf.linker_file.content_path, linker_path,
+                        content_hash=self.elf.linker_file.hash)
         else:
-            assert filecmp.cmp(self.elf.linker_file.path, linker_path), \
+            assert writer.matches(self.elf.linker_file.content_path, linker_path), \
                 'The "%s" linker file already exists and has differing contents.' % linker_path
         linker = os.path.join('.', linker_basename)
-
-        # Construct the library path
-        original_file_parent = os.path.dirname(self.path)
-        library_paths = os.environ.get('LD_LIBRARY_PATH', '').split(':')
-        library_paths += ['/lib64', '/usr/lib64', '/lib', '/usr/lib', '/lib32', '/usr/lib32']
-        for dependency in self.elf.dependencies:
-            library_paths.append(os.path.dirname(dependency.path))
-        relative_library_paths = []
-        for directory in library_paths:
-            if not len(directory):
-                continue
-
-            # Get the actual absolute path for the library directory.
-            directory = os.path.normpath(os.path.abspath(directory))
-            if self.chroot:
-                directory = os.path.join(self.chroot, os.path.relpath(directory, '/'))
-
-            # Convert it into a path relative to the launcher/source.
-            relative_library_path = os.path.relpath(directory, original_file_parent)
-            if relative_library_path not in relative_library_paths:
-                relative_library_paths.append(relative_library_path)
-        library_path = ':'.join(relative_library_paths)
+        library_path = self.library_path(provided_paths)
+        system_library_path = self.system_library_path(provided_paths)
 
         # Determine whether this is a "full" linker (*e.g.* GNU linker).
         with open(self.elf.linker_file.path, 'rb') as f:
@@ -587,9 +840,8 @@ class File(object):
 
             launcher_content = construct_binary_launcher(
                 linker=linker, library_path=library_path, executable=executable,
-                full_linker=full_linker)
-            with open(source_path, 'wb') as f:
-                f.write(launcher_content)
+                full_linker=full_linker, cache_directory=launcher_cache_directory,
+                system_library_path=system_library_path)
         except CompilerNotFoundError:
             if not shell_launcher:
                 logger.warning((
@@ -598,37 +850,41 @@ class File(object):
                 ))
             launcher_content = construct_bash_launcher(
                 linker=linker, library_path=library_path, executable=executable,
-                full_linker=full_linker)
-            with open(source_path, 'w') as f:
-                f.write(launcher_content)
-        shutil.copymode(self.path, source_path)
+                full_linker=full_linker,
+                system_library_path=system_library_path).encode('utf-8')
+        writer.write(source_path, launcher_content, stat.S_IMODE(os.stat(self.path).st_mode))
 
         return os.path.normpath(os.path.abspath(source_path))
 
-    def symlink(self, working_directory, bundle_root):
+    def symlink(self, working_directory, bundle_root, writer=None):
         """Creates a relative symlink from the `source` to the `destination`.
 
         Args:
             working_directory (str): The root that `destination` will be joined with.
             bundle_root (str): The root that `source` will be joined with.
+            writer (DirectoryWriter, optional): The writer used to create the bundle's members,
+                defaults to writing directly to disk.
         Returns:
             str: The normalized and absolute path to the symlink.
         """
+        writer = writer or DirectoryWriter(working_directory)
         destination_path = os.path.join(working_directory, self.destination)
         source_path = os.path.join(bundle_root, self.source)
 
         source_parent = os.path.dirname(source_path)
-        if not os.path.exists(source_parent):
-            os.makedirs(source_parent)
         relative_destination_path = os.path.relpath(destination_path, source_parent)
-        if os.path.exists(source_path):
-            assert os.path.islink(source_path)
-            assert os.path.realpath(source_path) == relative_destination_path
+        if writer.exists(source_path):
+            assert writer.readlink(source_path) == relative_destination_path
         else:
-            os.symlink(relative_destination_path, source_path)
+            writer.symlink(relative_destination_path, source_path)
 
         return os.path.normpath(os.path.abspath(source_path))
 
+    @stored_property
+    def content_path(self):
+        """str: The path that the bundled contents are read from, a stripped copy or `path`."""
+        return self.path
+
     @stored_property
     def destination(self):
         """str: The relative path for the destination of the actual file contents."""
@@ -646,9 +902,40 @@ class File(object):
     @stored_property
     def hash(self):
         """str: Computes a hash based on the file content, useful for file deduplication."""
-        with open(self.path, 'rb') as f:
+        with open(self.content_path, 'rb') as f:
             return hashlib.sha256(f.read()).hexdigest()
 
+    def library_path(self, provided_paths=()):
+        """Determines the library search path for the launcher.
+
+        Args:
+            provided_paths (:obj:`set` of :obj:`str`, optional): The paths of the dependencies
+                that are loaded from the target hosts, these are left out of the search path.
+        Returns:
+            str: The search path, relative to the launcher's directory.
+        """
+        original_file_parent = os.path.dirname(self.path)
+        library_paths = os.environ.get('LD_LIBRARY_PATH', '').split(':')
+        library_paths += ['/lib64', '/usr/lib64', '/lib', '/usr/lib', '/lib32', '/usr/lib32']
+        for dependency in sorted(self.elf.dependencies, key=lambda dependency: dependency.path):
+            if dependency.path not in provided_paths:
+                library_paths.append(os.path.dirname(dependency.path))
+        relative_library_paths = []
+        for directory in library_paths:
+            if not len(directory):
+                continue
+
+            # Get the actual absolute path for the library directory.
+            directory = os.path.normpath(os.path.abspath(directory))
+            if self.chroot:
+                directory = os.path.join(self.chroot, os.path.relpath(directory, '/'))
+
+            # Convert it into a path relative to the launcher/source.
+            relative_library_path = os.path.relpath(directory, original_file_parent)
+            if relative_library_path not in relative_library_paths:
+                relative_library_paths.append(relative_library_path)
+        return ':'.join(relative_library_paths)
+
     @stored_property
     def requires_launcher(self):
         """bool: Whether a launcher is necessary for this file."""
@@ -681,17 +968,50 @@ class File(object):
         """str: The relative path for the source of the actual file contents."""
         return os.path.relpath(self.path, '/')
 
+    def system_library_path(self, provided_paths=()):
+        """Determines the library search path on the target hosts, this is searched after
+        `library_path()`.
+
+        Args:
+            provided_paths (:obj:`set` of :obj:`str`, optional): The paths of the dependencies
+                that are loaded from the target hosts.
+        Returns:
+            str: The absolute search path for the dependencies that are provided by the targets.
+        """
+        system_library_paths = []
+        for dependency in sorted(self.elf.dependencies, key=lambda dependency: dependency.path):
+            if dependency.path not in provided_paths:
+                continue
+            directory = os.path.dirname(dependency.path)
+            if self.chroot:
+                directory = os.path.join('/', os.path.relpath(directory, self.chroot))
+            if directory not in system_library_paths:
+                system_library_paths.append(directory)
+        return ':'.join(system_library_paths)
+
 
 class Bundle(object):
     """A collection of files to be included in a bundle and utilities for creating bundles.
 
     Attributes:
+        blob_store (BlobStore): The persistent store of file contents and hashes (or `None`).
+        build_directory (str): The persistent directory where the bundle is staged and reconciled
+            between runs (or `None`). The bundle itself is located in its `bundle/` subdirectory.
+        cache (DependencyCache): The persistent cache of library dependencies (or `None`).
         chroot (str): The root directory used when invoking the linker (or `None` for `/`).
         files (:obj:`set` of :obj:`File`): The files to be included in the bundle.
         linker_files (:obj:`set` of :obj:`File`): A list of observed linker files.
+        provided_paths (:obj:`set` of :obj:`str`): The paths of the dependencies that are loaded
+            from the target hosts instead of being bundled, see `target_profile`.
+        resolver (Resolver): The resolver used to find the library dependencies of files.
+        stripper (Stripper): Creates the stripped copies of ELF binaries (or `None`).
+        target_profile (TargetProfile): The libraries that are present on the target hosts, these
+            are left out of the bundle (or `None`).
         working_directory (str): The root directory where the bundles will be written and packaged.
     """
-    def __init__(self, working_directory=None, chroot=None):
+    def __init__(self, working_directory=None, chroot=None, resolver=None, cache_directory=None,
+                 jobs=1, staging_directory=None, build_directory=None, blob_store_directory=None,
+                 strip='none', strip_directory=None, debug_directory=None, target_profile=None):
         """Constructor for the `Bundle` class.
 
         Args:
@@ -700,10 +1020,36 @@ class Bundle(object):
                 `None`, some methods and properties will raise errors.
             chroot (str, optional): If specified, all absolute paths will be treated as being
                 relative to this root (mainly useful for testing).
+            resolver (str, optional): The name of the dependency resolver to use, either 'ldd' to
+                invoke the linker in trace mode or 'native' to parse the ELF files in-process.
+            cache_directory (str, optional): A directory where the library dependencies of each
+                ELF binary will be persistently cached between runs.
+            jobs (int, optional): The maximum number of libraries to resolve concurrently.
+            staging_directory (str, optional): The parent directory of the temporary working
+                directory, for example a tmpfs mount. Defaults to the system temporary directory.
+            build_directory (str, optional): A persistent directory where the bundle will be
+                staged instead of in `working_directory`. Later bundles created in the same
+                directory will only write out the members that changed.
+            blob_store_directory (str, optional): A directory where file contents and hashes will
+                be persistently stored, so that they can be reused by later builds.
+            strip (str, optional): Either 'none', 'debug' to remove only the debugging
+                information from ELF binaries, or 'all' to also remove their symbol tables.
+            strip_directory (str, optional): The directory where the stripped copies of files are
+                stored. This defaults to a subdirectory of `build_directory`, and is required
+                otherwise when stripping.
+            debug_directory (str, optional): A directory where the debugging information that's
+                removed from each binary will be saved, keyed by its build ID.
+            target_profile (str, optional): The path to a host profile of the target hosts, see
+                `create_host_profile()`. Any dependencies that are identical to the libraries on
+                the targets will be loaded from there instead of being bundled.
         """
         self.working_directory = working_directory
+        self.build_directory = build_directory and os.path.abspath(build_directory)
+        if self.build_directory:
+            self.working_directory = os.path.join(self.build_directory, 'bundle')
         if working_directory is True:
-            self.working_directory = tempfile.mkdtemp(prefix='exodus-bundle-')
+            self.working_directory = tempfile.mkdtemp(prefix='exodus-bundle-',
+                                                      dir=staging_directory)
             # The permissions on the `mkdtemp()` directory will be extremely restricted by default,
             # so we'll modify them to to reflect the current umask.
             umask = os.umask(0)
@@ -712,6 +1058,21 @@ class Bundle(object):
         self.chroot = chroot
         self.files = set()
         self.linker_files = set()
+        self.provided_paths = set()
+        self.resolver = resolvers[resolver or 'ldd'](jobs=jobs)
+        self.blob_store = BlobStore(blob_store_directory) if blob_store_directory else None
+        self.stripper = None
+        if strip != 'none':
+            if self.build_directory:
+                strip_directory = os.path.join(self.build_directory, 'stripped')
+            self.stripper = Stripper(strip, strip_directory, debug_directory=debug_directory)
+        self.target_profile = None
+        if target_profile:
+            self.target_profile = TargetProfile(target_profile, chroot=chroot)
+        self.cache = None
+        if cache_directory:
+            self.cache = DependencyCache(cache_directory)
+            self.resolver = CachedResolver(self.resolver, self.cache)
 
     def add_file(self, path, entry_point=None):
         """Adds an additional file to the bundle.
@@ -730,7 +1091,8 @@ class Bundle(object):
             The `File` that was added, or `None` if it was a directory that was added recursively.
         """
         try:
-            file = self.file_factory(path, entry_point=entry_point, chroot=self.chroot)
+            file = self.file_factory(path, entry_point=entry_point, chroot=self.chroot,
+                                     resolver=self.resolver)
         except UnexpectedDirectoryError:
             assert entry_point is None, "Directories can't have entry points."
             for root, directories, files in os.walk(path):
@@ -740,16 +1102,17 @@ class Bundle(object):
             return
 
         self.files.add(file)
+        self.provided_paths.discard(file.path)
         if file.elf:
             if file.elf.linker_file:
                 self.linker_files.add(file.elf.linker_file)
-                self.files |= file.elf.dependencies
+                self.add_dependencies(file)
             else:
                 # Manually set the linker if there isn't one in the program header,
                 # and we've only seen one in all of the files that have been added.
                 if len(self.linker_files) == 1:
                     [file.elf.linker_file] = self.linker_files
-                    self.files |= file.elf.dependencies
+                    self.add_dependencies(file)
                     # We definitely don't want a launcher for this file, so clear the linker.
                     file.elf.linker_file = None
                 else:
@@ -760,47 +1123,93 @@ class Bundle(object):
 
         return file
 
-    def create_bundle(self, shell_launchers=False):
+    def add_dependencies(self, file):
+        """Adds the library dependencies of an ELF binary, except for any provided by the targets.
+
+        The linkers are always bundled, because the launchers invoke them directly.
+
+        Args:
+            file (File): The ELF binary, its linker must already be known.
+        """
+        # Files that were explicitly added are bundled regardless of whether they're provided.
+        bundled_paths = set(bundled.path for bundled in self.files | self.linker_files)
+        for dependency in file.elf.dependencies:
+            if self.target_profile is not None and dependency.path not in bundled_paths and \
+                    self.target_profile.provides(dependency.path):
+                self.provided_paths.add(dependency.path)
+                logger.info('Using the target\'s copy of "%s".' % dependency.path)
+                continue
+            self.files.add(dependency)
+
+    def create_bundle(self, shell_launchers=False, writer=None):
         """Creates the unpackaged bundle in `working_directory`.
 
         Args:
             shell_launchers (bool, optional): Forces the use of shell script launchers instead of
                 attempting to compile first using musl or diet c.
+            writer (TarballWriter, optional): If specified, the bundle's members will be written
+                out using this instead of being created in `working_directory`. This allows adding
+                them directly to an archive without staging them on disk first.
         """
+        # This has to happen before anything relies on the hashes, including the bundle's root, and
+        # before the stripped copies of the files are pruned.
+        self.prepare_contents()
+
+        build_writer = None
+        if writer is None and self.build_directory:
+            # Reconcile the bundle with whatever was staged by the previous build.
+            writer = build_writer = self.open_build_directory()
+            working_directory, bundle_root = self.working_directory, self.bundle_root
+        elif writer is None:
+            writer = DirectoryWriter(self.working_directory, blob_store=self.blob_store)
+            working_directory, bundle_root = self.working_directory, self.bundle_root
+        else:
+            working_directory = writer.root
+            bundle_root = os.path.normpath(os.path.join(writer.root, 'bundles', self.hash))
+
+        # The index comes first, so that it can be read without extracting the rest of the bundle.
+        writer.write_index(self.create_index())
+
+        launcher_cache_directory = None
+        if self.build_directory:
+            launcher_cache_directory = os.path.join(self.build_directory, 'launchers')
+
         file_paths = set()
         files_needing_launchers = defaultdict(set)
-        for file in self.files:
+        # The files are sorted so that the resulting layout and member order are deterministic.
+        for file in sorted(self.files, key=lambda file: (file.path, file.entry_point or '')):
             # Store the file path to avoid collisions later.
-            file_path = os.path.join(self.bundle_root, file.source)
+            file_path = os.path.join(bundle_root, file.source)
             file_paths.add(file_path)
 
             # Create a symlink in `./bin/` if an entry point is specified.
             if file.entry_point:
-                file.create_entry_point(self.working_directory, self.bundle_root)
+                file.create_entry_point(working_directory, bundle_root, writer=writer)
 
             if file.no_symlink:
                 # We'll need to copy the actual file into the bundle subdirectory in this
                 # case so that it can locate resources using paths relative to the executable.
-                parent_directory = os.path.dirname(file_path)
-                if not os.path.exists(parent_directory):
-                    os.makedirs(parent_directory)
-                shutil.copy(file.path, file_path)
+                writer.copy(file.content_path, file_path, content_hash=file.hash)
                 continue
 
             # Copy over the actual file.
-            file.copy(self.working_directory)
+            file.copy(working_directory, writer=writer)
 
             if file.requires_launcher:
                 # These are kind of complicated, we'll just store the requirements for now.
                 directory_and_linker = (os.path.dirname(file_path), file.elf.linker_file)
                 files_needing_launchers[directory_and_linker].add(file)
             else:
-                file.symlink(working_directory=self.working_directory, bundle_root=self.bundle_root)
+                file.symlink(working_directory=working_directory, bundle_root=bundle_root,
+                             writer=writer)
 
         # Now we need to write out one unique copy of each linker in each directory where it's
         # required. This is necessary so that `readlink("/proc/self/exe")` will return the correct
         # directory when programs use that to construct relative paths to resources.
-        for ((directory, linker), executable_files) in files_needing_launchers.items():
+        directories_and_linkers = sorted(files_needing_launchers,
+                                         key=lambda key: (key[0], key[1].path))
+        for (directory, linker) in directories_and_linkers:
+            executable_files = files_needing_launchers[(directory, linker)]
             # First, we'll find a unique name for the linker in this directory and write it out.
             desired_linker_path = os.path.join(directory, 'linker-%s' % linker.hash)
             linker_path = desired_linker_path
@@ -809,13 +1218,11 @@ class Bundle(object):
                 linker_path = '%s-%d' % (desired_linker_path, iteration)
                 iteration += 1
             file_paths.add(linker_path)
-            linker_dirname, linker_basename = os.path.split(linker_path)
-            if not os.path.exists(linker_dirname):
-                os.makedirs(linker_dirname)
-            shutil.copy(linker.path, linker_path)
+            linker_basename = os.path.basename(linker_path)
+            writer.copy(linker.content_path, linker_path, content_hash=linker.hash)
 
             # Now we need to construct a launcher for each executable that depends on this linker.
-            for file in executable_files:
+            for file in sorted(executable_files, key=lambda file: file.path):
                 # We'll again attempt to find a unique available name, this time for the symlink
                 # to the executable.
                 file_basename = file.entry_point or os.path.basename(file.path)
@@ -827,16 +1234,59 @@ class Bundle(object):
                     iteration += 1
                 file_paths.add(symlink_path)
                 symlink_basename = os.path.basename(symlink_path)
-                file.create_launcher(self.working_directory, self.bundle_root,
+                file.create_launcher(working_directory, bundle_root,
                                      linker_basename, symlink_basename,
-                                     shell_launcher=shell_launchers)
+                                     shell_launcher=shell_launchers, writer=writer,
+                                     launcher_cache_directory=launcher_cache_directory,
+                                     provided_paths=self.provided_paths)
+
+        # Anything that's no longer part of the bundle is removed from the build directory, and the
+        # manifest is only written out once everything else has succeeded.
+        if build_writer is not None:
+            build_writer.prune()
+            if self.stripper is not None:
+                self.stripper.prune()
+            write_manifest(self.build_manifest_path, build_writer.manifest)
+
+    def create_index(self):
+        """Describes the contents of the bundle, so that it can be inspected without extracting it.
+
+        Returns:
+            dict: The entry points of the bundle mapped to their paths within it, the original path,
+                hash, and size of each file, and the path, linker, and library path of each
+                launcher. The paths within the bundle are relative to its root.
+        """
+        self.prepare_contents()
+        bundle_root = os.path.join('bundles', self.hash)
+        entry_points, files, launchers = {}, [], []
+        for file in sorted(self.files, key=lambda file: (file.path, file.entry_point or '')):
+            source_path = os.path.join(bundle_root, file.source)
+            if file.entry_point:
+                entry_points[file.entry_point] = source_path
+            files.append({'hash': file.hash, 'path': file.path,
+                          'size': os.path.getsize(file.content_path)})
+            if file.requires_launcher and not file.no_symlink:
+                launchers.append({
+                    'library_path': file.library_path(self.provided_paths),
+                    'linker': file.elf.linker_file.path,
+                    'path': source_path,
+                    'system_library_path': file.system_library_path(self.provided_paths),
+                })
+        return {
+            'bundle': self.hash,
+            'entry_points': entry_points,
+            'files': files,
+            'launchers': launchers,
+            'version': 1,
+        }
 
     def delete_working_directory(self):
         """Recursively deletes the working directory."""
         shutil.rmtree(self.working_directory)
         self.working_directory = None
 
-    def file_factory(self, path, entry_point=None, chroot=None, library=False, file_factory=None):
+    def file_factory(self, path, entry_point=None, chroot=None, library=False, file_factory=None,
+                     resolver=None):
         """Either creates a new `File`, or updates and returns one from `files`.
 
         This method can be used in place of `File.__init__()` when it is known that the `File`
@@ -862,7 +1312,46 @@ class Bundle(object):
                 "A file can't be both an entry point and a library."
             return file
 
-        return File(path, entry_point, chroot, library, file_factory)
+        return File(path, entry_point, chroot, library, file_factory, resolver)
+
+    def prepare_contents(self):
+        """Strips the ELF binaries, and loads any hashes that were computed by previous builds.
+
+        The linkers are left intact, both because they're copied alongside the launchers and
+        because debuggers rely on their symbols.
+        """
+        linker_paths = set(linker_file.path for linker_file in self.linker_files)
+        for file in self.files | self.linker_files:
+            if self.stripper is not None and 'content_path' not in file.__dict__ and file.elf \
+                    and file.path not in linker_paths and file.elf.type in ('executable', 'shared'):
+                file.content_path = self.stripper.strip(file.path)
+            if self.blob_store is not None and 'hash' not in file.__dict__:
+                file.hash = self.blob_store.hash(file.content_path)
+
+    def open_build_directory(self):
+        """Prepares `build_directory` to be reused, and returns a writer that reconciles it.
+
+        Returns:
+            DirectoryWriter: A writer that will only write out the members that changed.
+        """
+        try:
+            base_manifest = read_manifest(self.build_manifest_path)
+            # An interrupted build will leave the directory in an unknown state, so the manifest
+            # is removed until the build completes.
+            os.remove(self.build_manifest_path)
+        except (InvalidManifestError, MissingFileError):
+            base_manifest = None
+            if os.path.exists(self.working_directory):
+                shutil.rmtree(self.working_directory)
+        if not os.path.exists(self.working_directory):
+            os.makedirs(self.working_directory)
+        return DirectoryWriter(self.working_directory, manifest=True, base_manifest=base_manifest,
+                               blob_store=self.blob_store)
+
+    @property
+    def build_manifest_path(self):
+        """str: The manifest of the members that were staged in `build_directory`."""
+        return os.path.join(self.build_directory, 'manifest.json')
 
     @property
     def bundle_root(self):
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""Persistent caches that allow expensive results to be shared between separate exodus runs.
+
+Cache entries are written to a temporary file and then atomically renamed into place, so several
+processes can safely share a cache directory without any locking. Readers treat any missing or
+malformed entry as a cache miss."""
+import hashlib
+import json
+import logging
+import os
+import socket
+import stat
+import tempfile
+import time
+import uuid
+
+from exodus_bundler.copying import copy_file
+
+
+logger = logging.getLogger(__name__)
+
+
+def file_identity(path):
+    """Returns a tuple that changes whenever the file at `path` is replaced or modified.
+
+    Args:
+        path (str): The path to the file.
+    Returns:
+        tuple: The `(path, device, inode, size, mtime_ns)` of the file, or `None` if it's missing.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1e9)
+    return (path, st.st_dev, st.st_ino, st.st_size, mtime_ns)
+
+
+def hash_file(path):
+    """Computes the SHA-256 hash of a file's contents without reading it all into memory."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_atomically(path, content):
+    """Writes `content` to `path` via a temporary file in the same directory and a rename."""
+    directory = os.path.dirname(path)
+    if not os.path.exists(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Another process might have created it concurrently.
+            if not os.path.isdir(directory):
+                raise
+    f, temporary_path = tempfile.mkstemp(prefix='.tmp-', dir=directory)
+    try:
+        with os.fdopen(f, 'wb') as temporary_file:
+            temporary_file.write(content)
+        os.rename(temporary_path, path)
+    except:  # noqa: E722
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+class DependencyCache(object):
+    """An on-disk cache of the direct dependencies of ELF binaries.
+
+    Each entry is keyed on the identity of the binary (path, device, inode, size, and modification
+    time), the content hash of the linker, the chroot, the resolver, and `LD_LIBRARY_PATH`. The
+    identities of the dependencies are stored alongside them and are re-checked on every lookup, so
+    an entry is only used if none of the involved files have changed.
+
+    Attributes:
+        directory (str): The root directory of the cache.
+        max_size (int): The approximate maximum size of the cache in bytes. The least recently used
+            entries will be evicted when `prune()` is called and this is exceeded.
+    """
+    def __init__(self, directory, max_size=64 * 1024 * 1024):
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+        self.linker_hashes = {}
+
+    def get(self, resolver_name, elf, linker_file):
+        """Looks up the cached dependencies of an ELF binary.
+
+        Args:
+            resolver_name (str): The name of the resolver that produced the dependencies.
+            elf (Elf): The ELF binary.
+            linker_file (File): The linker used to load the binary.
+        Returns:
+            :obj:`list` of :obj:`str`: The dependency paths, or `None` if there's no valid entry.
+        """
+        entry_path = self.entry_path(resolver_name, elf, linker_file)
+        if entry_path is None:
+            return None
+        try:
+            with open(entry_path, 'rb') as f:
+                entry = json.loads(f.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return None
+
+        # Make sure that none of the dependencies have been modified since the entry was written.
+        dependencies = []
+        for identity in entry.get('dependencies', []):
+            if file_identity(identity[0]) != tuple(identity):
+                return None
+            dependencies.append(identity[0])
+
+        # Bump the modification time so that eviction is based on the most recent use.
+        try:
+            os.utime(entry_path, None)
+        except OSError:
+            pass
+        return dependencies
+
+    def set(self, resolver_name, elf, linker_file, dependencies):
+        """Stores the dependencies of an ELF binary in the cache.
+
+        Args:
+            resolver_name (str): The name of the resolver that produced the dependencies.
+            elf (Elf): The ELF binary.
+            linker_file (File): The linker used to load the binary.
+            dependencies (:obj:`list` of :obj:`str`): The dependency paths.
+        """
+        entry_path = self.entry_path(resolver_name, elf, linker_file)
+        if entry_path is None:
+            return
+        identities = [file_identity(dependency) for dependency in dependencies]
+        if any(identity is None for identity in identities):
+            return
+        content = json.dumps({'dependencies': identities}).encode('utf-8')
+        try:
+            write_atomically(entry_path, content)
+        except (IOError, OSError) as error:
+            logger.warning('Unable to write to the dependency cache: %s' % error)
+
+    def entry_path(self, resolver_name, elf, linker_file):
+        """Computes the location of an entry, or `None` if the files can't be identified."""
+        elf_identity = file_identity(elf.path)
+        linker_hash = self.linker_hash(linker_file)
+        if elf_identity is None or linker_hash is None:
+            return None
+        key = json.dumps([
+            resolver_name, elf_identity, linker_hash, elf.chroot,
+            os.environ.get('LD_LIBRARY_PATH', ''),
+        ])
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, 'dependencies', digest[:2], digest[2:])
+
+    def linker_hash(self, linker_file):
+        """Returns the content hash of a linker, memoized on the linker's file identity.
+
+        This is the hash of the original file, which can differ from `File.hash` when the bundled
+        copies are stripped.
+        """
+        identity = file_identity(linker_file.path)
+        if identity is None:
+            return None
+        if identity not in self.linker_hashes:
+            self.linker_hashes[identity] = hash_file(linker_file.path)
+        return self.linker_hashes[identity]
+
+    def prune(self):
+        """Evicts the least recently used entries until the cache fits within `max_size`."""
+        entries = []
+        total_size = 0
+        for root, directories, files in os.walk(os.path.join(self.directory, 'dependencies')):
+            for filename in files:
+                path = os.path.join(root, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total_size += st.st_size
+
+        for mtime, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # It was most likely already removed by another process.
+                pass
+            total_size -= size
+
+
+class BlobStore(object):
+    """A content-addressed store of file contents and hashes that's shared between builds.
+
+    Blobs are stored by their SHA-256 hash and permissions, and they're never modified once they've
+    been renamed into place, so they can be hard linked directly into staging directories. The
+    hashes of source files are also stored, keyed on their identities, so that unchanged files
+    don't need to be read again. The store can be located on a network filesystem and shared by
+    several machines, because both kinds of entries are written using a rename within the same
+    directory and readers never need any locks.
+
+    Attributes:
+        directory (str): The root directory of the store.
+    """
+    # Temporary files from interrupted writes are removed by `prune()` once they're this old.
+    temporary_file_max_age = 24 * 60 * 60
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+
+    def add(self, source_path, content_hash, mode):
+        """Stores the contents of a file unless it's already present.
+
+        Args:
+            source_path (str): The file to store.
+            content_hash (str): The SHA-256 hash of the file's contents.
+            mode (int): The permission bits of the blob.
+        Returns:
+            str: The path to the blob within the store.
+        """
+        blob_path = self.blob_path(content_hash, mode)
+        if os.path.exists(blob_path):
+            touch(blob_path)
+            return blob_path
+
+        directory = os.path.dirname(blob_path)
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        temporary_path = os.path.join(directory, '.tmp-%s-%d-%s' % (
+            socket.gethostname(), os.getpid(), uuid.uuid4().hex))
+        try:
+            # The blob must never share an inode with the source, because touching it on later
+            # hits would otherwise modify the source and changes to the source would corrupt it.
+            copy_file(source_path, temporary_path, hardlink=False)
+            if stat.S_IMODE(os.stat(temporary_path).st_mode) != mode:
+                os.chmod(temporary_path, mode)
+            os.rename(temporary_path, blob_path)
+        except:  # noqa: E722
+            if os.path.lexists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        return blob_path
+
+    def blob_path(self, content_hash, mode):
+        return os.path.join(self.directory, 'blobs', content_hash[:2],
+                            '%s-%o' % (content_hash[2:], mode))
+
+    def hash(self, path):
+        """Returns the SHA-256 hash of a file's contents, reusing a stored hash if it's unchanged.
+
+        Args:
+            path (str): The path to the file.
+        Returns:
+            str: The hexadecimal digest.
+        """
+        identity = file_identity(path)
+        if identity is None:
+            raise IOError('The "%s" file does not exist.' % path)
+        key = hashlib.sha256(json.dumps(identity).encode('utf-8')).hexdigest()
+        entry_path = os.path.join(self.directory, 'hashes', key[:2], key[2:])
+        try:
+            with open(entry_path, 'rb') as f:
+                content_hash = f.read().decode('utf-8')
+            if len(content_hash) == 64:
+                touch(entry_path)
+                return content_hash
+        except (IOError, OSError):
+            pass
+
+        content_hash = hash_file(path)
+        try:
+            write_atomically(entry_path, content_hash.encode('utf-8'))
+        except (IOError, OSError) as error:
+            logger.warning('Unable to write to the blob store: %s' % error)
+        return content_hash
+
+    def prune(self, max_size=None, max_age=None):
+        """Evicts the least recently used entries.
+
+        Args:
+            max_size (int, optional): The maximum total size of the entries in bytes.
+            max_age (float, optional): The maximum number of seconds since an entry was last used.
+        Returns:
+            tuple: The number of entries that were removed, and their total size in bytes.
+        """
+        now = time.time()
+        entries, total_size = [], 0
+        removed_count, removed_size = 0, 0
+        for root, directories, files in os.walk(self.directory):
+            for filename in files:
+                path = os.path.join(root, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                expired = max_age is not None and now - st.st_mtime > max_age
+                if filename.startswith('.tmp-'):
+                    expired = now - st.st_mtime > self.temporary_file_max_age
+                elif not expired:
+                    entries.append((st.st_mtime, st.st_size, path))
+                    total_size += st.st_size
+                    continue
+                if expired and remove_entry(path):
+                    removed_count, removed_size = removed_count + 1, removed_size + st.st_size
+
+        for mtime, size, path in sorted(entries):
+            if max_size is None or total_size <= max_size:
+                break
+            if remove_entry(path):
+                removed_count, removed_size = removed_count + 1, removed_size + size
+            total_size -= size
+        return removed_count, removed_size
+
+
+def remove_entry(path):
+    """Removes a cache entry, returning `False` if it was already removed by another process."""
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
+
+
+def touch(path):
+    """Bumps the modification time of an entry so that eviction is based on the most recent use."""
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
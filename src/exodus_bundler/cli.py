@@ -1,12 +1,21 @@
 # -*- coding: utf-8 -*-
 import argparse
+import json
 import logging
+import os
 import sys
 
 from exodus_bundler import root_logger
 from exodus_bundler.bundling import create_bundle
+from exodus_bundler.bundling import merge_bundles
+from exodus_bundler.caching import BlobStore
 from exodus_bundler.errors import FatalError
 from exodus_bundler.input_parsing import extract_paths
+from exodus_bundler.inspection import describe_index
+from exodus_bundler.inspection import read_index
+from exodus_bundler.profiling import create_host_profile
+from exodus_bundler.profiling import default_library_directories
+from exodus_bundler.profiling import write_host_profile
 
 
 logger = logging.getLogger(__name__)
@@ -20,13 +29,53 @@ def parse_args(args=None, namespace=None):
     parser = argparse.ArgumentParser(formatter_class=formatter, description=(
         'Bundle ELF binary executables with all of their runtime dependencies '
         'so that they can be relocated to other systems with incompatible system '
-        'libraries.'
+        'libraries. Executables with the same names as the "gc", "inspect", "merge", and '
+        '"profile-host" subcommands can be bundled with "exodus -- EXECUTABLE ...".'
     ))
 
     parser.add_argument('executables', metavar='EXECUTABLE', nargs='+', help=(
         'One or more ELF executables to include in the exodus bundle.'
     ))
 
+    parser.add_argument('--base-manifest', metavar='MANIFEST_FILE', default=None, help=(
+        'Creates a delta bundle that only contains the files, symlinks, and launchers that differ '
+        'from the bundle described by this manifest (see "--manifest"). The installer applies '
+        'the delta on top of the previously installed bundle, and removes anything that is no '
+        'longer included.'
+    ))
+
+    parser.add_argument('--blob-store', metavar='BLOB_STORE_DIRECTORY',
+        default=os.environ.get('EXODUS_BLOB_STORE'),
+        help=(
+            'A content-addressed store where file contents and hashes will be kept between builds. '
+            'The store can safely be shared by concurrent builds, including builds on different '
+            'machines that mount it over a network filesystem. Staged files are hard linked from '
+            'the store when it is on the same filesystem as the staging or build directory. Old '
+            'entries can be evicted with "exodus gc". This can also be set with the '
+            'EXODUS_BLOB_STORE environment variable.'
+        ),
+    )
+
+    parser.add_argument('--build-dir', metavar='BUILD_DIRECTORY',
+        default=os.environ.get('EXODUS_BUILD_DIR'),
+        help=(
+            'A persistent directory where the bundle will be staged. Later runs reconcile the '
+            'staged files with the new bundle contents, so that only changed files are copied and '
+            'only changed launchers are recompiled. The directory must not be shared by concurrent '
+            'builds, and it has no effect with "--direct". This can also be set with the '
+            'EXODUS_BUILD_DIR environment variable.'
+        ),
+    )
+
+    parser.add_argument('--cache-dir', metavar='CACHE_DIRECTORY',
+        default=os.environ.get('EXODUS_CACHE_DIR'),
+        help=(
+            'A directory where the library dependencies of each binary will be cached between '
+            'runs. The cache can safely be shared by concurrent builds. This can also be set '
+            'with the EXODUS_CACHE_DIR environment variable.'
+        ),
+    )
+
     parser.add_argument('-c', '--chroot', metavar='CHROOT_PATH',
         default=None,
         help=(
@@ -45,11 +94,61 @@ def parse_args(args=None, namespace=None):
         ),
     )
 
+    parser.add_argument('--compression', default='gzip',
+        choices=['gzip', 'xz', 'zstd', 'none'],
+        help=(
+            'The method used to compress the bundle. The installation script will use whichever '
+            'matching decompressor is available on the target machine.'
+        ),
+    )
+
+    parser.add_argument('--compression-level', metavar='LEVEL', type=int, default=None, help=(
+        'The compression level to use, higher levels are slower but produce smaller bundles. '
+        'Defaults to 9 for gzip, 6 for xz, and 3 for zstd.'
+    ))
+
+    parser.add_argument('--debug-output', metavar='DEBUG_FILE', default=None, help=(
+        'Writes the debugging information that "--strip" removes to a separate tarball, laid out '
+        "by build ID so that it can be extracted into a debugger's debug directory (e.g. "
+        '"/usr/lib/debug"). The same template strings as "--output" can be used.'
+    ))
+
     parser.add_argument('-d', '--detect', action='store_true', help=(
         'Attempt to autodetect direct dependencies using the system package manager. '
         'Operating system support is limited.'
     ))
 
+    parser.add_argument('--direct', action='store_true', help=(
+        'Write the files directly into the bundle from their original locations instead of first '
+        'copying them into a temporary staging directory.'
+    ))
+
+    parser.add_argument('--format', dest='bundle_format', default='tar',
+        choices=['tar', 'blobs'],
+        help=(
+            'The layout of the installation script\'s payload. The "blobs" format compresses each '
+            'file independently, storing already compressed files as-is, so that the installer '
+            'can extract them in parallel. These installers must be saved to a file before they '
+            'are run, and the files are always read directly from their original locations.'
+        ),
+    )
+
+    parser.add_argument('-j', '--jobs', metavar='JOBS', type=int, default=1, help=(
+        'The maximum number of concurrent jobs to use when resolving library dependencies and '
+        'compressing the bundle with gzip.'
+    ))
+
+    parser.add_argument('--manifest', metavar='MANIFEST_FILE', default=None, help=(
+        'Writes a JSON manifest of the complete bundle contents to this file, which can be used '
+        'with "--base-manifest" to create delta bundles for later versions.'
+    ))
+
+    parser.add_argument('--member-order', choices=['type', 'none'], default='type', help=(
+        'The order of the files within the archive. The "type" order adds the directories, '
+        'symlinks, and launchers first, and then groups the files by their kind (text, ELF, other '
+        'binary, and already compressed), extension, and size to improve compression.'
+    ))
+
     parser.add_argument('--no-symlink', metavar='FILE', action='append',
         default=[],
         help=(
@@ -59,13 +158,16 @@ def parse_args(args=None, namespace=None):
         ),
     )
 
-    parser.add_argument('-o', '--output', metavar='OUTPUT_FILE',
+    parser.add_argument('-o', '--output', metavar='OUTPUT_FILE', action='append',
         default=None,
         help=(
             'The file where the bundle will be written out to. The extension depends on the '
             'output type. The "{{executables}}" and "{{extension}}" template strings can be '
             ' used in the provided filename. If omitted, the output will go to stdout when '
-            'it is being piped, or to "./exodus-{{executables}}-bundle.{{extension}}" otherwise.'
+            'it is being piped, or to "./exodus-{{executables}}-bundle.{{extension}}" otherwise. '
+            'This can be specified multiple times to write out several outputs from a single '
+            'compression pass, and outputs ending in the tarball extension (e.g. ".tgz") will be '
+            'written out as tarballs instead of installation scripts.'
         ),
     )
 
@@ -80,13 +182,200 @@ def parse_args(args=None, namespace=None):
         ),
     )
 
+    parser.add_argument('--reproducible', action='store_true', help=(
+        'Normalize the owners, permissions of directories, and modification times of the '
+        'archive members so that identical inputs produce byte-identical bundles. The timestamp '
+        'defaults to zero, and it can be set with the SOURCE_DATE_EPOCH environment variable.'
+    ))
+
+    parser.add_argument('--resolver', choices=['ldd', 'native'], default='ldd', help=(
+        'The method used to find library dependencies. The "ldd" resolver invokes the linker in '
+        'trace mode for each binary, while the "native" resolver parses the ELF dynamic sections '
+        'and emulates the linker search paths without spawning any processes.'
+    ))
+
     parser.add_argument('--shell-launchers', action='store_true', help=(
         'Force the use of shell launchers instead of attempting to compile statically linked ones.'
     ))
 
+    parser.add_argument('--staging-dir', metavar='STAGING_DIRECTORY',
+        default=os.environ.get('EXODUS_STAGING_DIR'),
+        help=(
+            'The directory where the bundle will be temporarily assembled before being archived, '
+            'for example a tmpfs mount like "/dev/shm". Files are reflinked into it when the '
+            'filesystem allows, and read-only files (without any write permissions, or that the '
+            "current user can't write to) are hard linked instead. This can also be set with "
+            'the EXODUS_STAGING_DIR environment variable, and it has no effect with "--direct".'
+        ),
+    )
+
+    parser.add_argument('--strip', choices=['none', 'debug', 'all'], default='none', help=(
+        'Remove the debugging information ("debug") or also the symbol tables ("all") from the '
+        'bundled ELF binaries, the original files are left untouched. This requires "objcopy" '
+        'from GNU binutils, and the dynamic linkers are never stripped.'
+    ))
+
+    parser.add_argument('--target-profile', metavar='PROFILE_FILE', default=None, help=(
+        'A profile of the libraries on the hosts where the bundle will be installed, as written '
+        'by "exodus profile-host". Any library dependencies that are identical to the ones at '
+        'the same paths on those hosts are loaded from there instead of being bundled.'
+    ))
+
     parser.add_argument('-t', '--tarball', action='store_true', help=(
         'Creates a tarball for manual extraction instead of an installation script. '
-        'Note that this will change the output extension from ".sh" to ".tgz".'
+        'Note that this will change the output extension from ".sh" to ".tgz", ".txz", '
+        '".tar.zst", or ".tar" depending on the compression.'
+    ))
+
+    parser.add_argument('-v', '--verbose', action='store_true', help=(
+        'Output additional informational messages.'
+    ))
+
+    return vars(parser.parse_args(args, namespace))
+
+
+def parse_size(size):
+    """Parses a size in bytes with an optional "K", "M", or "G" suffix."""
+    multipliers = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    size = size.strip().upper().rstrip('B')
+    if size and size[-1] in multipliers:
+        return int(float(size[:-1]) * multipliers[size[-1]])
+    return int(size)
+
+
+def parse_gc_args(args=None, namespace=None):
+    """Constructs an argument parser for the `gc` subcommand and parses the arguments."""
+    formatter = argparse.ArgumentDefaultsHelpFormatter
+    parser = argparse.ArgumentParser(prog='exodus gc', formatter_class=formatter, description=(
+        'Evict the least recently used entries from a blob store until it fits within the '
+        'specified limits.'
+    ))
+
+    parser.add_argument('--blob-store', metavar='BLOB_STORE_DIRECTORY',
+        default=os.environ.get('EXODUS_BLOB_STORE'),
+        help=(
+            'The blob store to prune. This can also be set with the EXODUS_BLOB_STORE '
+            'environment variable.'
+        ),
+    )
+
+    parser.add_argument('--max-age', metavar='DAYS', type=float, default=None, help=(
+        'Removes entries that have not been used by a build in this many days.'
+    ))
+
+    parser.add_argument('--max-size', metavar='SIZE', type=parse_size, default='10G', help=(
+        'The maximum total size of the blob store, with an optional "K", "M", or "G" suffix.'
+    ))
+
+    parser.add_argument('-q', '--quiet', action='store_true', help=(
+        'Suppress warning messages.'
+    ))
+
+    parser.add_argument('-v', '--verbose', action='store_true', help=(
+        'Output additional informational messages.'
+    ))
+
+    args = vars(parser.parse_args(args, namespace))
+    if not args['blob_store']:
+        parser.error('A blob store must be specified with "--blob-store".')
+    return args
+
+
+def parse_inspect_args(args=None, namespace=None):
+    """Constructs an argument parser for the `inspect` subcommand and parses the arguments."""
+    formatter = argparse.ArgumentDefaultsHelpFormatter
+    description = (
+        'Display the entry points, files, and launchers of existing bundles. Only the index at '
+        'the beginning of each bundle is read, the rest of the bundle is never decompressed.'
+    )
+    parser = argparse.ArgumentParser(prog='exodus inspect', formatter_class=formatter,
+                                     description=description)
+
+    parser.add_argument('bundles', metavar='BUNDLE', nargs='+', help=(
+        'One or more installation scripts or tarballs created by exodus.'
+    ))
+
+    parser.add_argument('--json', action='store_true', help=(
+        'Output the index of each bundle as a line of JSON instead of a summary.'
+    ))
+
+    return vars(parser.parse_args(args, namespace))
+
+
+def parse_merge_args(args=None, namespace=None):
+    """Constructs an argument parser for the `merge` subcommand and parses the arguments."""
+    formatter = argparse.ArgumentDefaultsHelpFormatter
+    parser = argparse.ArgumentParser(prog='exodus merge', formatter_class=formatter, description=(
+        'Combine existing bundles into a single bundle, without resolving their dependencies '
+        'again. The bundles must have been created by a version of exodus that embeds an index, '
+        "and they can't be delta bundles."
+    ))
+
+    parser.add_argument('bundles', metavar='BUNDLE', nargs='+', help=(
+        'Two or more installation scripts or tarballs to merge.'
+    ))
+
+    parser.add_argument('--compression', choices=['gzip', 'xz', 'zstd', 'none'], default='gzip',
+        help='The method used to compress the merged bundle.')
+
+    parser.add_argument('--compression-level', metavar='LEVEL', type=int, default=None, help=(
+        'The compression level to use, defaults to 9 for gzip, 6 for xz, and 3 for zstd.'
+    ))
+
+    parser.add_argument('-j', '--jobs', metavar='JOBS', type=int, default=1, help=(
+        'The maximum number of concurrent jobs to use when compressing the bundle with gzip.'
+    ))
+
+    parser.add_argument('-o', '--output', metavar='OUTPUT_FILE', action='append', required=True,
+        help=(
+            'The file where the merged bundle will be written out to, or "-" for stdout. The '
+            '"{{executables}}" and "{{extension}}" template strings can be used, and this can be '
+            'specified multiple times. Outputs ending in the tarball extension (e.g. ".tgz") will '
+            'be written out as tarballs instead of installation scripts.'
+        ),
+    )
+
+    parser.add_argument('-q', '--quiet', action='store_true', help=(
+        'Suppress warning messages.'
+    ))
+
+    parser.add_argument('--reproducible', action='store_true', help=(
+        'Normalize the owners, permissions of directories, and modification times of the '
+        'archive members so that identical inputs produce byte-identical bundles.'
+    ))
+
+    parser.add_argument('-t', '--tarball', action='store_true', help=(
+        'Creates a tarball for manual extraction instead of an installation script.'
+    ))
+
+    parser.add_argument('-v', '--verbose', action='store_true', help=(
+        'Output additional informational messages.'
+    ))
+
+    return vars(parser.parse_args(args, namespace))
+
+
+def parse_profile_host_args(args=None, namespace=None):
+    """Constructs an argument parser for the `profile-host` subcommand and parses the arguments."""
+    formatter = argparse.ArgumentDefaultsHelpFormatter
+    parser = argparse.ArgumentParser(
+        prog='exodus profile-host', formatter_class=formatter, description=(
+            'Record the paths and hashes of the shared libraries installed on this host. The '
+            'profile of a reference host can then be passed to "--target-profile" to leave those '
+            'libraries out of bundles for identical hosts.'
+        ),
+    )
+
+    parser.add_argument('directories', metavar='DIRECTORY', nargs='*',
+        default=default_library_directories,
+        help='The directories to search for libraries recursively.')
+
+    parser.add_argument('-o', '--output', metavar='PROFILE_FILE', default='-', help=(
+        'The file where the profile will be written out to, or "-" for stdout.'
+    ))
+
+    parser.add_argument('-q', '--quiet', action='store_true', help=(
+        'Suppress warning messages.'
     ))
 
     parser.add_argument('-v', '--verbose', action='store_true', help=(
@@ -130,19 +419,99 @@ def configure_logging(quiet, verbose, suppress_stdout=False):
     root_logger.addHandler(stdout_handler)
 
 
+def gc(args=None, namespace=None):
+    """Entry point for the `gc` subcommand, which prunes a blob store."""
+    args = parse_gc_args(args, namespace)
+    configure_logging(quiet=args['quiet'], verbose=args['verbose'])
+
+    max_age = args['max_age'] * 24 * 60 * 60 if args['max_age'] is not None else None
+    blob_store = BlobStore(args['blob_store'])
+    removed_count, removed_size = blob_store.prune(max_size=args['max_size'], max_age=max_age)
+    logger.info('Removed %d entries (%d bytes) from "%s".' % (
+        removed_count, removed_size, blob_store.directory))
+
+
+def inspect(args=None, namespace=None):
+    """Entry point for the `inspect` subcommand, which displays the indexes of bundles."""
+    args = parse_inspect_args(args, namespace)
+    configure_logging(quiet=False, verbose=False)
+
+    # Any bundles that can't be read are reported, but they don't prevent inspecting the others.
+    failed = False
+    for filename in args['bundles']:
+        try:
+            index = read_index(filename)
+        except FatalError as fatal_error:
+            logger.error(fatal_error)
+            failed = True
+            continue
+        if args['json']:
+            index = dict(index, filename=filename)
+            sys.stdout.write(json.dumps(index, sort_keys=True) + '\n')
+        else:
+            sys.stdout.write('%s:\n%s' % (filename, describe_index(index)))
+    if failed:
+        sys.exit(1)
+
+
+def merge(args=None, namespace=None):
+    """Entry point for the `merge` subcommand, which combines existing bundles."""
+    args = parse_merge_args(args, namespace)
+    quiet, verbose = args.pop('quiet'), args.pop('verbose')
+    configure_logging(quiet=quiet, verbose=verbose, suppress_stdout='-' in args['output'])
+
+    try:
+        merge_bundles(**args)
+    except FatalError as fatal_error:
+        logger.error('Fatal error encountered, exiting.')
+        logger.error(fatal_error, exc_info=verbose)
+        sys.exit(1)
+
+
+def profile_host(args=None, namespace=None):
+    """Entry point for the `profile-host` subcommand, which records the libraries on this host."""
+    args = parse_profile_host_args(args, namespace)
+    configure_logging(quiet=args['quiet'], verbose=args['verbose'],
+                      suppress_stdout=args['output'] == '-')
+
+    profile = create_host_profile(args['directories'])
+    if args['output'] == '-':
+        write_host_profile(sys.stdout, profile)
+        return
+    with open(args['output'], 'w') as f:
+        write_host_profile(f, profile)
+    logger.info('Recorded %d libraries in "%s".' % (len(profile), args['output']))
+
+
+subcommands = {
+    'gc': gc,
+    'inspect': inspect,
+    'merge': merge,
+    'profile-host': profile_host,
+}
+
+
 def main(args=None, namespace=None):
+    if args is None:
+        args = sys.argv[1:]
+    if args and args[0] in subcommands:
+        return subcommands[args[0]](args[1:], namespace)
+    # A leading `--` skips the subcommands, so that executables with the same names can be bundled.
+    if args and args[0] == '--':
+        args = args[1:]
+
     args = parse_args(args, namespace)
 
     # Dynamically set the default output to stdout if it is being piped.
     if args['output'] is None:
         if sys.stdout.isatty():
-            args['output'] = './exodus-{{executables}}-bundle.{{extension}}'
+            args['output'] = ['./exodus-{{executables}}-bundle.{{extension}}']
         else:
-            args['output'] = '-'
+            args['output'] = ['-']
 
     # Handle the CLI specific options here, removing them from `args` in the process.
     quiet, verbose = args.pop('quiet'), args.pop('verbose')
-    suppress_stdout = args['output'] == '-'
+    suppress_stdout = '-' in args['output']
     configure_logging(quiet=quiet, verbose=verbose, suppress_stdout=suppress_stdout)
 
     # Allow piping in additional files.
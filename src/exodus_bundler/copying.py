@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Copies files into staging directories using the cheapest method supported by the filesystem.
+
+Each strategy either copies the whole file and returns `True`, or leaves nothing behind and returns
+`False` so that the next one can be attempted. In order of preference, they are copy-on-write
+reflinks, hard links to read-only files, in-kernel copies, and finally a plain userspace copy."""
+import errno
+import logging
+import os
+import shutil
+import stat
+
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+# The `FICLONE` ioctl request from `linux/fs.h`, it's supported by btrfs, xfs, and a few others.
+FICLONE = 0x40049409
+
+# Copies and transfers are performed in chunks of this many bytes.
+chunk_size = 8 * 1024 * 1024
+
+
+def remove_partial_copy(destination_path):
+    try:
+        os.remove(destination_path)
+    except OSError as error:
+        if error.errno != errno.ENOENT:
+            raise
+
+
+def copy_with_reflink(source_path, destination_path):
+    """Clones the file's extents so that no data is actually copied until it's modified."""
+    if fcntl is None:
+        return False
+    try:
+        with open(source_path, 'rb') as source, open(destination_path, 'wb') as destination:
+            fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+    except (IOError, OSError):
+        remove_partial_copy(destination_path)
+        return False
+    shutil.copymode(source_path, destination_path)
+    return True
+
+
+def copy_with_hardlink(source_path, destination_path):
+    """Hard links read-only files, so that the bundle can't modify the originals.
+
+    A file is considered read-only if it has no write permission bits at all, or if the current
+    user can't write to it. The first condition also applies when running as root, where the
+    permission checks of `os.access()` always succeed.
+    """
+    if stat.S_IMODE(os.stat(source_path).st_mode) & 0o222 and os.access(source_path, os.W_OK):
+        return False
+    try:
+        os.link(source_path, destination_path)
+    except OSError:
+        # This is expected across filesystems, and with `fs.protected_hardlinks` enabled.
+        return False
+    return True
+
+
+def copy_with_copy_file_range(source_path, destination_path):
+    """Copies the data within the kernel, allowing server-side copies on network filesystems."""
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    if copy_file_range is None:
+        return False
+    return copy_in_kernel(source_path, destination_path,
+                          lambda source, destination, offset: copy_file_range(
+                              source, destination, chunk_size, offset_src=offset))
+
+
+def copy_with_sendfile(source_path, destination_path):
+    """Copies the data within the kernel without passing it through userspace buffers."""
+    sendfile = getattr(os, 'sendfile', None)
+    if sendfile is None:
+        return False
+    return copy_in_kernel(source_path, destination_path,
+                          lambda source, destination, offset: sendfile(
+                              destination, source, offset, chunk_size))
+
+
+def copy_in_kernel(source_path, destination_path, transfer):
+    """Repeatedly calls `transfer(source_fd, destination_fd, offset)` until it returns zero."""
+    try:
+        with open(source_path, 'rb') as source, open(destination_path, 'wb') as destination:
+            offset = 0
+            while True:
+                transferred = transfer(source.fileno(), destination.fileno(), offset)
+                if not transferred:
+                    break
+                offset += transferred
+            if offset != os.fstat(source.fileno()).st_size:
+                raise IOError('Only %d bytes of "%s" were copied.' % (offset, source_path))
+    except (IOError, OSError):
+        remove_partial_copy(destination_path)
+        return False
+    shutil.copymode(source_path, destination_path)
+    return True
+
+
+def copy_in_userspace(source_path, destination_path):
+    shutil.copy(source_path, destination_path)
+    return True
+
+
+strategies = [
+    ('reflink', copy_with_reflink),
+    ('hardlink', copy_with_hardlink),
+    ('copy_file_range', copy_with_copy_file_range),
+    ('sendfile', copy_with_sendfile),
+    ('userspace', copy_in_userspace),
+]
+
+
+def copy_file(source_path, destination_path, hardlink=True):
+    """Copies the contents and permissions of a file, like `shutil.copy()` does.
+
+    Args:
+        source_path (str): The file to copy.
+        destination_path (str): The path of the copy, which must not already exist.
+        hardlink (bool, optional): Whether read-only files can be hard linked. This should be
+            disabled when the copy must remain independent of the source file.
+    Returns:
+        str: The name of the strategy that was used.
+    """
+    for name, strategy in strategies:
+        if name == 'hardlink' and not hardlink:
+            continue
+        if strategy(source_path, destination_path):
+            logger.debug('Copied "%s" to "%s" using %s.' % (source_path, destination_path, name))
+            return name
@@ -0,0 +1,459 @@
+# -*- coding: utf-8 -*-
+"""Resolvers that determine which shared libraries an ELF binary will load at runtime.
+
+The `LddResolver` invokes the binary's linker in trace mode, which is exactly what `ldd` does. The
+`NativeResolver` instead emulates the linker's search in-process by reading the dynamic section of
+each binary, which avoids spawning a process for every file in the dependency closure."""
+import os
+import re
+import struct
+import threading
+from multiprocessing.pool import ThreadPool
+from subprocess import PIPE
+from subprocess import Popen
+
+from exodus_bundler.elf_parsing import DT_NEEDED
+from exodus_bundler.elf_parsing import DT_RPATH
+from exodus_bundler.elf_parsing import DT_RUNPATH
+from exodus_bundler.elf_parsing import DT_SONAME
+from exodus_bundler.elf_parsing import read_dynamic_entries
+from exodus_bundler.elf_parsing import read_elf_header
+from exodus_bundler.errors import FatalError
+
+
+# The directories that will be searched after `LD_LIBRARY_PATH`, the rpaths, and `ld.so.cache`.
+default_library_directories = ['/lib64', '/usr/lib64', '/lib', '/usr/lib', '/lib32', '/usr/lib32']
+default_musl_library_directories = ['/lib', '/usr/local/lib', '/usr/lib']
+
+# These libraries are all provided by the musl linker itself.
+musl_reserved_library_regex = r'^lib(?:c|pthread|rt|m|dl|util|xnet)(?:\.so.*|\.a)?$'
+
+# Constants for parsing the two historical formats of `/etc/ld.so.cache`.
+ld_so_cache_magic = b'ld.so-1.7.0'
+ld_so_cache_new_magic = b'glibc-ld.so.cache1.1'
+
+
+class DynamicInfo(object):
+    """The subset of an ELF binary's header and dynamic section that is relevant for linking.
+
+    Attributes:
+        bits (int): The number of bits for an ELF binary, either 32 or 64.
+        machine (int): The `e_machine` architecture identifier from the ELF header.
+        needed (:obj:`list` of :obj:`str`): The `DT_NEEDED` entries in order.
+        rpath (:obj:`list` of :obj:`str`): The `DT_RPATH` directories, or `None` if absent.
+        runpath (:obj:`list` of :obj:`str`): The `DT_RUNPATH` directories, or `None` if absent.
+        soname (str): The `DT_SONAME` entry, or `None` if absent.
+    """
+    def __init__(self, bits, machine, needed=None, rpath=None, runpath=None, soname=None):
+        self.bits = bits
+        self.machine = machine
+        self.needed = needed or []
+        self.rpath = rpath
+        self.runpath = runpath
+        self.soname = soname
+
+    def compatible_with(self, other):
+        """Whether a library with this info could be loaded into a process alongside `other`."""
+        return self.bits == other.bits and self.machine == other.machine
+
+
+def parse_dependencies_from_ldd_output(content):
+    """Takes the output of `ldd` as a string or list of lines and parses the dependencies."""
+    if isinstance(content, str):
+        content = content.split('\n')
+
+    dependencies = []
+    for line in content:
+        # This first one is a special case of invoking the linker as `ldd`.
+        if re.search(r'^\s*(/.*?)\s*=>\s*ldd\s*\(', line):
+            # We'll exclude this because it's the hardcoded INTERP path, and it would be
+            # impossible to get the full path from this command output.
+            continue
+        match = re.search(r'=>\s*(/.*?)\s*\(', line)
+        match = match or re.search(r'\s*(/.*?)\s*\(', line)
+        if match:
+            dependencies.append(match.group(1))
+
+    return dependencies
+
+
+def parse_ld_so_cache(content):
+    """Parses the contents of an `ld.so.cache` file into a mapping of library names to paths.
+
+    Both the legacy "ld.so-1.7.0" format and the newer "glibc-ld.so.cache1.1" format are supported,
+    as is the combined format where the new one is embedded after the old one.
+
+    Args:
+        content (bytes): The raw contents of the cache file.
+    Returns:
+        dict: A mapping from each library name to a list of candidate paths in priority order.
+    """
+    def read_string(offset):
+        end = content.find(b'\x00', offset)
+        if end < 0:
+            end = len(content)
+        return content[offset:end].decode('utf-8', 'replace')
+
+    entries = []
+    new_format_offset = None
+    if content.startswith(ld_so_cache_magic):
+        # The old header is the magic padded to 12 bytes followed by the library count.
+        [nlibs] = struct.unpack_from('=I', content, 12)
+        entries_end = 16 + nlibs * 12
+        # The new format is optionally embedded after the old entries with an 8 byte alignment.
+        aligned_end = (entries_end + 7) & ~7
+        if content[aligned_end:].startswith(ld_so_cache_new_magic):
+            new_format_offset = aligned_end
+        else:
+            # String offsets are relative to the end of the entries in the old format.
+            for index in range(nlibs):
+                flags, key, value = struct.unpack_from('=iII', content, 16 + index * 12)
+                entries.append((read_string(entries_end + key), read_string(entries_end + value)))
+    elif content.startswith(ld_so_cache_new_magic):
+        new_format_offset = 0
+
+    if new_format_offset is not None:
+        # Recent versions of glibc record the byte order in the header flags.
+        header_flags = struct.unpack_from('=B', content, new_format_offset + 28)[0] & 3
+        endian = {2: '<', 3: '>'}.get(header_flags, '=')
+        [nlibs] = struct.unpack_from(endian + 'I', content, new_format_offset + 20)
+        for index in range(nlibs):
+            entry_offset = new_format_offset + 48 + index * 24
+            flags, key, value = struct.unpack_from(endian + 'iII', content, entry_offset)
+            # String offsets are relative to the start of the new header.
+            entries.append((
+                read_string(new_format_offset + key), read_string(new_format_offset + value),
+            ))
+
+    libraries = {}
+    for name, path in entries:
+        libraries.setdefault(name, []).append(path)
+    return libraries
+
+
+def read_dynamic_info(path):
+    """Reads the linking information from the ELF header and dynamic section of a file.
+
+    Only the header, the program header table, the dynamic segment, and the string table are read,
+    so this is cheap even for very large libraries.
+
+    Args:
+        path (str): The path to the (possibly) ELF binary.
+    Returns:
+        DynamicInfo: The parsed information, or `None` if the file isn't a supported ELF binary.
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = read_elf_header(f, path)
+            entries = read_dynamic_entries(f, header)
+    except (IOError, OSError, FatalError, struct.error):
+        return None
+
+    info = DynamicInfo(bits=header.bits, machine=header.machine)
+    for tag, value in entries:
+        if tag == DT_NEEDED:
+            info.needed.append(value)
+        elif tag == DT_SONAME:
+            info.soname = value
+        elif tag == DT_RPATH:
+            info.rpath = [entry for entry in value.split(':') if entry]
+        elif tag == DT_RUNPATH:
+            info.runpath = [entry for entry in value.split(':') if entry]
+    return info
+
+
+class Resolver(object):
+    """Base class for finding the runtime library dependencies of ELF binaries.
+
+    Note:
+        A single resolver is shared by all of the files in a `Bundle`, so it also holds the
+        bundle-wide `resolution_table` that allows each library to be traced only once.
+
+    Attributes:
+        jobs (int): The maximum number of binaries to resolve concurrently.
+        lock (threading.Lock): Guards the creation of the `resolution_locks`.
+        name (str): The name used to select the resolver from the command-line.
+        resolution_locks (dict): A lock for each key of `resolution_table`, these ensure that
+            concurrent jobs never resolve the same key twice.
+        resolution_table (dict): A mapping from `(library path, linker path)` tuples to the
+            dependencies that were found, see `Elf.find_direct_dependencies()`.
+    """
+    name = None
+
+    def __init__(self, jobs=1):
+        self.jobs = jobs
+        self.lock = threading.Lock()
+        self.resolution_locks = {}
+        self.resolution_table = {}
+
+    def find_direct_dependencies(self, elf, linker_file):
+        """Determines the libraries that the linker would load for an ELF binary.
+
+        Args:
+            elf (Elf): The ELF binary to find the dependencies for.
+            linker_file (File): The linker that will be used to load the binary.
+        Returns:
+            :obj:`list` of :obj:`str`: The paths to the dependencies, including the linker.
+        """
+        raise NotImplementedError()
+
+    def resolve_once(self, key, resolve):
+        """Looks up a key in `resolution_table`, calling `resolve()` to populate it if necessary.
+
+        Any other jobs that need the same key wait for the first one to finish, so `resolve()` is
+        called at most once for each key and every job receives the same result.
+
+        Args:
+            key (tuple): The `(library path, linker path)` key.
+            resolve (function): Computes the value when the key is missing.
+        Returns:
+            The value stored in `resolution_table`.
+        """
+        with self.lock:
+            key_lock = self.resolution_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self.resolution_table:
+                self.resolution_table[key] = resolve()
+            return self.resolution_table[key]
+
+    def map(self, function, items):
+        """Applies a function to each item, using up to `jobs` threads.
+
+        Threads are sufficient here because the work is dominated by waiting on subprocesses and
+        file I/O rather than by the interpreter.
+
+        Args:
+            function (function): The function to apply.
+            items (iterable): The items to apply the function to.
+        Returns:
+            list: The results in the same order as `items`.
+        """
+        items = list(items)
+        if self.jobs <= 1 or len(items) <= 1:
+            return [function(item) for item in items]
+        pool = ThreadPool(min(self.jobs, len(items)))
+        try:
+            return pool.map(function, items)
+        finally:
+            pool.close()
+            pool.join()
+
+
+class CachedResolver(Resolver):
+    """Wraps another resolver and persists its results in a `DependencyCache`.
+
+    Attributes:
+        cache (DependencyCache): The cache where results are stored.
+        resolver (Resolver): The resolver that is used when there's a cache miss.
+    """
+    def __init__(self, resolver, cache):
+        super(CachedResolver, self).__init__(jobs=resolver.jobs)
+        self.name = resolver.name
+        self.resolver = resolver
+        self.cache = cache
+
+    def find_direct_dependencies(self, elf, linker_file):
+        dependencies = self.cache.get(self.name, elf, linker_file)
+        if dependencies is None:
+            dependencies = self.resolver.find_direct_dependencies(elf, linker_file)
+            self.cache.set(self.name, elf, linker_file, dependencies)
+        return dependencies
+
+
+class LddResolver(Resolver):
+    """Finds dependencies by invoking the linker with `LD_TRACE_LOADED_OBJECTS` set."""
+    name = 'ldd'
+
+    def find_direct_dependencies(self, elf, linker_file):
+        linker_path = linker_file.path
+        environment = {}
+        environment.update(os.environ)
+        environment['LD_TRACE_LOADED_OBJECTS'] = '1'
+        extra_ldd_arguments = []
+        if elf.chroot:
+            ld_library_path = '/lib64:/usr/lib64:/lib/:/usr/lib:/lib32/:/usr/lib32/:'
+            ld_library_path += environment.get('LD_LIBRARY_PATH', '')
+            directories = []
+            for directory in ld_library_path.split(':'):
+                if os.path.isabs(directory):
+                    directory = os.path.join(elf.chroot, os.path.relpath(directory, '/'))
+                directories.append(directory)
+            ld_library_path = ':'.join(directories)
+            environment['LD_LIBRARY_PATH'] = ld_library_path
+            # We only need to avoid including system dependencies if there's a chroot set.
+            extra_ldd_arguments += ['--inhibit-cache', '--inhibit-rpath', '']
+
+        process = Popen(['ldd'] + extra_ldd_arguments + [elf.path],
+                        executable=linker_path, stdout=PIPE, stderr=PIPE, env=environment)
+        stdout, stderr = process.communicate()
+        combined_output = stdout.decode('utf-8').split('\n') + stderr.decode('utf-8').split('\n')
+        # Note that we're explicitly adding the linker because when we invoke it as `ldd` we can't
+        # extract the real path from the trace output. Even if it were here twice, it would be
+        # deduplicated though the use of a set.
+        return parse_dependencies_from_ldd_output(combined_output) + [linker_path]
+
+
+class NativeResolver(Resolver):
+    """Finds dependencies by emulating the linker's library search without spawning processes.
+
+    The search order follows that of the GNU linker: `DT_RPATH` entries of the loading objects
+    (unless `DT_RUNPATH` is present), `LD_LIBRARY_PATH`, `DT_RUNPATH`, `/etc/ld.so.cache`, and then
+    the default library directories. The musl linker is handled similarly, but without the cache
+    and with its own default directories. Like the trace output of the linker, the result includes
+    the full set of libraries that would be loaded rather than only the `DT_NEEDED` entries.
+    """
+    name = 'native'
+
+    def __init__(self, jobs=1):
+        super(NativeResolver, self).__init__(jobs=jobs)
+        self.dynamic_infos = {}
+        self.ld_so_caches = {}
+
+    def find_direct_dependencies(self, elf, linker_file):
+        info = self.dynamic_info(elf.path)
+        if info is None:
+            return []
+        linker_path = linker_file.path
+        linker_basename = os.path.basename(linker_path)
+        musl = linker_basename.startswith('ld-musl-')
+
+        # The linker is always loaded first, so it can satisfy requests by its own soname.
+        loaded_paths = [linker_path]
+        loaded_names = {linker_basename: linker_path}
+        linker_info = self.dynamic_info(linker_path)
+        if linker_info and linker_info.soname:
+            loaded_names[linker_info.soname] = linker_path
+
+        # Each queued entry includes the chain of loading objects, used for inherited rpaths.
+        queue = [(elf.path, info, [])]
+        while queue:
+            path, object_info, loaders = queue.pop(0)
+            loaders = loaders + [(path, object_info)]
+            for name in object_info.needed:
+                if name in loaded_names:
+                    continue
+                if musl and re.match(musl_reserved_library_regex, name):
+                    loaded_names[name] = linker_path
+                    continue
+                dependency_path = self.search(name, info, loaders, elf.chroot, musl, linker_path)
+                if dependency_path is None:
+                    continue
+                loaded_names[name] = dependency_path
+                if dependency_path in loaded_paths or dependency_path == elf.path:
+                    continue
+                loaded_paths.append(dependency_path)
+                dependency_info = self.dynamic_info(dependency_path)
+                if dependency_info.soname:
+                    loaded_names.setdefault(dependency_info.soname, dependency_path)
+                queue.append((dependency_path, dependency_info, loaders))
+
+        return loaded_paths
+
+    def dynamic_info(self, path):
+        """Returns the (memoized) `DynamicInfo` for a path."""
+        if path not in self.dynamic_infos:
+            self.dynamic_infos[path] = read_dynamic_info(path)
+        return self.dynamic_infos[path]
+
+    def ld_so_cache(self, chroot):
+        """Returns the (memoized) parsed `/etc/ld.so.cache` for a chroot."""
+        if chroot not in self.ld_so_caches:
+            filename = os.path.join(chroot or '/', 'etc', 'ld.so.cache')
+            try:
+                with open(filename, 'rb') as f:
+                    self.ld_so_caches[chroot] = parse_ld_so_cache(f.read())
+            except (IOError, OSError, struct.error):
+                self.ld_so_caches[chroot] = {}
+        return self.ld_so_caches[chroot]
+
+    def musl_library_directories(self, chroot, linker_path):
+        """Returns the musl search path from `/etc/ld-musl-$ARCH.path`, or the defaults."""
+        match = re.match(r'ld-musl-(.*)\.so', os.path.basename(linker_path))
+        if match:
+            filename = os.path.join(chroot or '/', 'etc', 'ld-musl-%s.path' % match.group(1))
+            if os.path.exists(filename):
+                with open(filename, 'r') as f:
+                    return [entry for entry in re.split(r'[:\n]', f.read()) if entry.strip()]
+        return default_musl_library_directories
+
+    def search(self, name, executable_info, loaders, chroot, musl, linker_path):
+        """Finds the path that the linker would load for a `DT_NEEDED` entry.
+
+        Args:
+            name (str): The library name from the `DT_NEEDED` entry.
+            executable_info (DynamicInfo): The info of the main executable, used for compatibility.
+            loaders (:obj:`list` of :obj:`tuple`): The `(path, DynamicInfo)` pairs for the chain
+                of objects that led to this one being loaded, ending with the requesting object.
+            chroot (str): The root directory used for absolute paths (or `None`).
+            musl (bool): Whether the musl search order should be used instead of the GNU one.
+            linker_path (str): The path to the linker, used for musl path configuration.
+        Returns:
+            str: The path to the library, or `None` if no compatible library was found.
+        """
+        def rooted(directory):
+            if chroot and os.path.isabs(directory):
+                return os.path.join(chroot, os.path.relpath(directory, '/'))
+            return directory
+
+        if '/' in name:
+            candidates = [rooted(name)]
+        else:
+            path, requester_info = loaders[-1]
+            ld_library_path = [rooted(directory) for directory in
+                               os.environ.get('LD_LIBRARY_PATH', '').split(':') if directory]
+            directories = []
+            if musl:
+                directories += ld_library_path
+                for loader_path, loader_info in reversed(loaders):
+                    rpath = loader_info.runpath or loader_info.rpath or []
+                    directories += self.expand_rpath(rpath, loader_path, loader_info, chroot)
+                directories += [rooted(directory) for directory in
+                                self.musl_library_directories(chroot, linker_path)]
+            else:
+                if requester_info.runpath is None:
+                    for loader_path, loader_info in reversed(loaders):
+                        if loader_info.rpath and loader_info.runpath is None:
+                            directories += self.expand_rpath(
+                                loader_info.rpath, loader_path, loader_info, chroot)
+                directories += ld_library_path
+                if requester_info.runpath:
+                    directories += self.expand_rpath(
+                        requester_info.runpath, path, requester_info, chroot)
+            candidates = [os.path.join(directory, name) for directory in directories]
+            if not musl:
+                candidates += [rooted(cached) for cached in self.ld_so_cache(chroot).get(name, [])]
+                candidates += [os.path.join(rooted(directory), name)
+                               for directory in default_library_directories]
+
+        for candidate in candidates:
+            candidate = os.path.normpath(os.path.abspath(candidate))
+            if not os.path.isfile(candidate):
+                continue
+            candidate_info = self.dynamic_info(candidate)
+            if candidate_info and candidate_info.compatible_with(executable_info):
+                return candidate
+        return None
+
+    @staticmethod
+    def expand_rpath(rpath, path, info, chroot):
+        """Expands the `$ORIGIN`, `$LIB`, and `$PLATFORM` tokens in rpath entries."""
+        origin = os.path.dirname(os.path.abspath(path))
+        lib = 'lib64' if info.bits == 64 else 'lib'
+        platform = {3: 'i686', 62: 'x86_64', 183: 'aarch64'}.get(info.machine, '')
+        directories = []
+        for directory in rpath:
+            expanded = re.sub(r'\$(?:\{ORIGIN\}|ORIGIN\b)', lambda match: origin, directory)
+            expanded = re.sub(r'\$(?:\{LIB\}|LIB\b)', lambda match: lib, expanded)
+            expanded = re.sub(r'\$(?:\{PLATFORM\}|PLATFORM\b)', lambda match: platform, expanded)
+            # Only the literal absolute paths are relative to the chroot, `$ORIGIN` already is.
+            from_origin = re.search(r'\$(?:\{ORIGIN\}|ORIGIN\b)', directory)
+            if chroot and not from_origin and os.path.isabs(expanded):
+                expanded = os.path.join(chroot, os.path.relpath(expanded, '/'))
+            directories.append(expanded)
+        return directories
+
+
+resolvers = {
+    LddResolver.name: LddResolver,
+    NativeResolver.name: NativeResolver,
+}
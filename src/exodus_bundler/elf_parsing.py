@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""Low-level parsing of ELF headers, program headers, dynamic sections, and notes.
+
+The ELF header and the program header table are read with a single read in the common case, and
+decoded using precompiled `struct.Struct` layouts for each combination of class and byte order."""
+import binascii
+import struct
+from collections import namedtuple
+
+from exodus_bundler.errors import InvalidElfBinaryError
+from exodus_bundler.errors import UnsupportedArchitectureError
+
+
+# Program header types.
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_INTERP = 3
+PT_NOTE = 4
+
+# Dynamic section tags.
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_STRSZ = 10
+DT_SONAME = 14
+DT_RPATH = 15
+DT_RUNPATH = 29
+
+# Note types.
+NT_GNU_BUILD_ID = 3
+
+# The program header table almost always immediately follows the ELF header, so reading this many
+# bytes up front avoids a second read for nearly every binary.
+initial_read_size = 4096
+
+elf_types = {1: 'relocatable', 2: 'executable', 3: 'shared', 4: 'core'}
+
+
+ElfHeader = namedtuple('ElfHeader', [
+    'bits', 'byteorder', 'type', 'machine', 'program_headers',
+])
+ProgramHeader = namedtuple('ProgramHeader', ['type', 'offset', 'vaddr', 'filesz'])
+
+
+class ElfLayout(object):
+    """Precompiled structures for one combination of ELF class and byte order.
+
+    Attributes:
+        dynamic (struct.Struct): The layout of a dynamic section entry.
+        header (struct.Struct): The layout of the ELF header following the 16 identification bytes.
+        program_header (struct.Struct): The layout of a program header table entry.
+    """
+    def __init__(self, bits, endian):
+        self.bits = bits
+        if bits == 32:
+            self.header = struct.Struct(endian + 'HHIIIIIHHHHHH')
+            self.program_header = struct.Struct(endian + 'IIIIIIII')
+            self.dynamic = struct.Struct(endian + 'iI')
+        else:
+            self.header = struct.Struct(endian + 'HHIQQQIHHHHHH')
+            self.program_header = struct.Struct(endian + 'IIQQQQQQ')
+            self.dynamic = struct.Struct(endian + 'qQ')
+
+    def unpack_program_header(self, buffer, offset):
+        """Unpacks the relevant fields of a program header as a `ProgramHeader`."""
+        fields = self.program_header.unpack_from(buffer, offset)
+        if self.bits == 32:
+            # p_type, p_offset, p_vaddr, p_paddr, p_filesz, p_memsz, p_flags, p_align
+            return ProgramHeader(fields[0], fields[1], fields[2], fields[4])
+        # p_type, p_flags, p_offset, p_vaddr, p_paddr, p_filesz, p_memsz, p_align
+        return ProgramHeader(fields[0], fields[2], fields[3], fields[5])
+
+
+layouts = {
+    (bits, byteorder): ElfLayout(bits, endian)
+    for bits in (32, 64)
+    for (byteorder, endian) in (('little', '<'), ('big', '>'))
+}
+
+
+def read_elf_header(f, path):
+    """Parses the ELF header and program header table from an open file.
+
+    Args:
+        f (file): The file, opened in binary mode.
+        path (str): The path to the file, used in error messages.
+    Returns:
+        ElfHeader: The parsed header.
+    """
+    f.seek(0)
+    content = f.read(initial_read_size)
+    if content[:4] != b'\x7fELF':
+        raise InvalidElfBinaryError('The "%s" file is not a binary ELF file.' % path)
+
+    # Determine whether this is a 32-bit or 64-bit file.
+    identification = bytearray(content[4:6])
+    bits = {1: 32, 2: 64}.get(identification[0]) if len(identification) == 2 else None
+    if not bits:
+        raise UnsupportedArchitectureError(
+            ('The "%s" file does not appear to be either 32 or 64 bits. ' % path) +
+            'Other architectures are not currently supported, but you can open an '
+            'issue at https://github.com/intoli/exodus stating your use-case and '
+            'support might get extended in the future.',
+        )
+
+    # Determine whether it's big or little endian.
+    byteorder = {1: 'little', 2: 'big'}.get(identification[1])
+    if not byteorder:
+        raise UnsupportedArchitectureError(
+            'The "%s" file does not appear to be either little or big endian.' % path,
+        )
+
+    layout = layouts[(bits, byteorder)]
+    if len(content) < 16 + layout.header.size:
+        raise InvalidElfBinaryError('The "%s" file has a truncated ELF header.' % path)
+    header = layout.header.unpack_from(content, 16)
+    e_type, e_machine, e_phoff, e_phentsize, e_phnum = \
+        header[0], header[1], header[4], header[8], header[9]
+
+    # The program header table is usually within the initial read, but not necessarily.
+    table_size = e_phnum * e_phentsize
+    if e_phoff + table_size <= len(content):
+        table, table_offset = content, e_phoff
+    else:
+        f.seek(e_phoff)
+        table, table_offset = f.read(table_size), 0
+
+    program_headers = []
+    for index in range(e_phnum):
+        offset = table_offset + index * e_phentsize
+        if offset + layout.program_header.size > len(table):
+            break
+        program_headers.append(layout.unpack_program_header(table, offset))
+
+    return ElfHeader(bits=bits, byteorder=byteorder, type=elf_types.get(e_type),
+                     machine=e_machine, program_headers=program_headers)
+
+
+def read_dynamic_entries(f, header):
+    """Reads the dynamic section and resolves the string-valued entries.
+
+    Args:
+        f (file): The file, opened in binary mode.
+        header (ElfHeader): The already parsed header of the file.
+    Returns:
+        :obj:`list` of :obj:`tuple`: The `(tag, value)` pairs of the dynamic section, where the
+            values of `DT_NEEDED`, `DT_SONAME`, `DT_RPATH`, and `DT_RUNPATH` are strings.
+    """
+    layout = layouts[(header.bits, header.byteorder)]
+    loads = [program_header for program_header in header.program_headers
+             if program_header.type == PT_LOAD]
+    dynamic = next((program_header for program_header in header.program_headers
+                    if program_header.type == PT_DYNAMIC), None)
+    if dynamic is None:
+        return []
+
+    # Parse the dynamic entries, the string values are offsets into the string table.
+    entries = []
+    f.seek(dynamic.offset)
+    dynamic_segment = f.read(dynamic.filesz)
+    for offset in range(0, len(dynamic_segment) - layout.dynamic.size + 1, layout.dynamic.size):
+        tag, value = layout.dynamic.unpack_from(dynamic_segment, offset)
+        if tag == DT_NULL:
+            break
+        entries.append((tag, value))
+    values = dict(entries)
+
+    # `DT_STRTAB` is a virtual address, so we need to find it in the file using the segments.
+    string_table_address = values.get(DT_STRTAB)
+    string_table_offset = None
+    for load in loads:
+        if string_table_address is not None and \
+                load.vaddr <= string_table_address < load.vaddr + load.filesz:
+            string_table_offset = string_table_address - load.vaddr + load.offset
+            break
+    if string_table_offset is None or DT_STRSZ not in values:
+        return [(tag, value) for (tag, value) in entries
+                if tag not in (DT_NEEDED, DT_SONAME, DT_RPATH, DT_RUNPATH)]
+    f.seek(string_table_offset)
+    string_table = f.read(values[DT_STRSZ])
+
+    def read_string(offset):
+        end = string_table.find(b'\x00', offset)
+        if end < 0:
+            end = len(string_table)
+        return string_table[offset:end].decode('utf-8', 'replace')
+
+    return [(tag, read_string(value) if tag in (DT_NEEDED, DT_SONAME, DT_RPATH, DT_RUNPATH)
+             else value) for (tag, value) in entries]
+
+
+def read_build_id(f, header):
+    """Reads the GNU build ID from the notes of an ELF file.
+
+    Args:
+        f (file): The file, opened in binary mode.
+        header (ElfHeader): The parsed header of the file.
+    Returns:
+        str: The build ID as a hexadecimal string, or `None` if the file doesn't have one.
+    """
+    note_header = struct.Struct(('<' if header.byteorder == 'little' else '>') + 'III')
+    for program_header in header.program_headers:
+        if program_header.type != PT_NOTE:
+            continue
+        f.seek(program_header.offset)
+        notes = f.read(program_header.filesz)
+        offset = 0
+        while offset + note_header.size <= len(notes):
+            name_size, description_size, note_type = note_header.unpack_from(notes, offset)
+            offset += note_header.size
+            name = notes[offset:offset + name_size]
+            # The name and description are both padded to a multiple of four bytes.
+            offset += (name_size + 3) & ~3
+            description = notes[offset:offset + description_size]
+            offset += (description_size + 3) & ~3
+            if note_type == NT_GNU_BUILD_ID and name == b'GNU\x00':
+                return binascii.hexlify(description).decode('ascii')
+    return None
@@ -9,11 +9,36 @@ class DependencyDetectionError(FatalError):
     pass
 
 
+class IncompatibleOptionsError(FatalError):
+    """Signifies that options were specified which can't be used together."""
+    pass
+
+
+class InvalidBundleError(FatalError):
+    """Signifies that an existing bundle couldn't be read."""
+    pass
+
+
 class InvalidElfBinaryError(FatalError):
     """Signifies that a file was expected to be an ELF binary, but wasn't."""
     pass
 
 
+class InvalidManifestError(FatalError):
+    """Signifies that a bundle manifest couldn't be parsed."""
+    pass
+
+
+class InvalidProfileError(FatalError):
+    """Signifies that a host profile couldn't be parsed."""
+    pass
+
+
+class MergeConflictError(FatalError):
+    """Signifies that bundles couldn't be merged because their contents conflict."""
+    pass
+
+
 class MissingFileError(FatalError):
     """Signifies that a file was not found."""
     pass
@@ -27,3 +52,13 @@ class UnexpectedDirectoryError(FatalError):
 class UnsupportedArchitectureError(FatalError):
     """Signifies that a binary has an unexpected architecture."""
     pass
+
+
+class UnsupportedCompressionError(FatalError):
+    """Signifies that a compression method can't be used in the current environment."""
+    pass
+
+
+class UnsupportedStrippingError(FatalError):
+    """Signifies that binaries can't be stripped in the current environment."""
+    pass
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""Utilities for reading the contents of bundles that have already been created."""
+import base64
+import hashlib
+import itertools
+import json
+import os
+import re
+import tarfile
+import tempfile
+import zlib
+from contextlib import contextmanager
+
+from exodus_bundler.archiving import DecompressingReader
+from exodus_bundler.archiving import IdentityCompressor
+from exodus_bundler.archiving import blob_spool_size
+from exodus_bundler.archiving import codecs
+from exodus_bundler.archiving import detect_codec
+from exodus_bundler.archiving import index_filename
+from exodus_bundler.errors import InvalidBundleError
+from exodus_bundler.errors import MergeConflictError
+from exodus_bundler.errors import MissingFileError
+
+
+# The amount of data that's read from the bundle at a time.
+chunk_size = 64 * 1024
+
+# The installation scripts are always smaller than this, so the start of the payload can be found
+# within the first this many bytes of a bundle.
+script_header_size = 16 * 1024
+
+
+def describe_index(index):
+    """Formats the index of a bundle's contents for display.
+
+    Args:
+        index (dict): The index, as returned by `read_index()`.
+    Returns:
+        str: A human-readable summary of the index.
+    """
+    lines = ['Bundle: %s' % index['bundle'], 'Entry points:']
+    for entry_point, path in sorted(index['entry_points'].items()):
+        lines.append('  %s -> %s' % (entry_point, path))
+    lines.append('Launchers:')
+    for launcher in index['launchers']:
+        lines.append('  %s' % launcher['path'])
+        lines.append('    linker: %s' % launcher['linker'])
+        lines.append('    library path: %s' % launcher['library_path'])
+        # Older bundles don't record the libraries that are loaded from the target's system.
+        if launcher.get('system_library_path'):
+            lines.append('    system library path: %s' % launcher['system_library_path'])
+    total_size = sum(file['size'] for file in index['files'])
+    lines.append('Files (%d, %d bytes):' % (len(index['files']), total_size))
+    for file in index['files']:
+        lines.append('  %s %12d %s' % (file['hash'][:12], file['size'], file['path']))
+    return '\n'.join(lines) + '\n'
+
+
+def merge_indexes(indexes, filenames):
+    """Combines the indexes of several bundles into the index of a merged bundle.
+
+    Args:
+        indexes (:obj:`list` of :obj:`dict`): The indexes of the bundles.
+        filenames (:obj:`list` of :obj:`str`): The paths to the corresponding bundles, these are
+            only used in error messages.
+    Returns:
+        dict: The merged index. The `bundle` hash identifies the combination of bundles, while the
+            paths of the entry points and launchers still refer to their original bundle roots.
+            Entry points with the same name are only allowed if their executables are identical,
+            and the first one is kept.
+    """
+    entry_points, entry_point_hashes, entry_point_filenames = {}, {}, {}
+    files, launchers = {}, []
+    for index, filename in zip(indexes, filenames):
+        # The entry points refer to the original paths of the executables within the bundle root.
+        bundle_root = os.path.join('bundles', index['bundle'])
+        file_hashes = dict((file['path'], file['hash']) for file in index['files'])
+        for entry_point, path in sorted(index['entry_points'].items()):
+            file_hash = file_hashes.get('/' + os.path.relpath(path, bundle_root))
+            if entry_point not in entry_points:
+                entry_points[entry_point] = path
+                entry_point_hashes[entry_point] = file_hash
+                entry_point_filenames[entry_point] = filename
+            elif entry_points[entry_point] != path and \
+                    (file_hash is None or entry_point_hashes[entry_point] != file_hash):
+                raise MergeConflictError(
+                    'The "%s" entry point of "%s" conflicts with the one in "%s".' % (
+                        entry_point, filename, entry_point_filenames[entry_point]))
+        for file in index['files']:
+            files[(file['path'], file['hash'])] = file
+        for launcher in index['launchers']:
+            if launcher not in launchers:
+                launchers.append(launcher)
+
+    bundle_hashes = sorted(set(index['bundle'] for index in indexes))
+    return {
+        'bundle': hashlib.sha256('\n'.join(bundle_hashes).encode('utf-8')).hexdigest(),
+        'entry_points': entry_points,
+        'files': [files[key] for key in sorted(files)],
+        'launchers': sorted(launchers, key=lambda launcher: launcher['path']),
+        'version': 1,
+    }
+
+
+@contextmanager
+def open_archive(filename):
+    """Opens the tarball within a bundle for streaming.
+
+    Only as much of the payload is read and decompressed as is needed for the members that are
+    actually accessed.
+
+    Args:
+        filename (str): The path to either an installation script or a tarball.
+    Yields:
+        tarfile.TarFile: The tarball, opened in streaming mode.
+    """
+    try:
+        f = open(filename, 'rb')
+    except (IOError, OSError):
+        raise MissingFileError('The "%s" bundle could not be read.' % filename)
+    reader = None
+    try:
+        chunks = payload_chunks(f, filename)
+        head = next(chunks, b'')
+        codec = detect_codec(head)
+        reader = DecompressingReader(itertools.chain([head], chunks), codec.create_decompressor())
+        with tarfile.open(fileobj=reader, mode='r|') as tar:
+            yield tar
+    except (EOFError, tarfile.TarError, zlib.error) as error:
+        raise InvalidBundleError('The "%s" bundle is corrupt: %s' % (filename, error))
+    finally:
+        if reader is not None:
+            reader.close()
+        f.close()
+
+
+def payload_chunks(f, filename):
+    """Finds the compressed tarball within a bundle, and yields its contents in chunks.
+
+    Args:
+        f (file): The bundle, opened in binary mode.
+        filename (str): The path to the bundle, used in error messages.
+    Returns:
+        iterator: The chunks of the compressed tarball.
+    """
+    head = f.read(script_header_size)
+    if not head.startswith(b'#!'):
+        return read_chunks(f, 0)
+
+    # The installation scripts that are written to disk specify where the payload begins.
+    match = re.search(br'\npayload_offset=(\d+)\n', head)
+    if match:
+        payload_offset = int(match.group(1)) - 1
+        blob_index = read_blob_index(f)
+        if blob_index is None:
+            return read_chunks(f, payload_offset)
+
+        # The tarball is only one part of a blobs payload, it's found using the blob index.
+        for offset, size, encoding, mode, name in blob_index:
+            if name == 'metadata':
+                return read_chunks(f, payload_offset + offset, size)
+        raise InvalidBundleError('The "%s" bundle has no metadata tarball.' % filename)
+
+    # The non-interactive scripts embed the tarball as base64 encoded lines.
+    match = re.search(br'<< "END_OF_FILE"[^\n]*\n', head)
+    if match:
+        return read_base64_chunks(f, match.end())
+
+    raise InvalidBundleError('The "%s" file is not a recognized bundle.' % filename)
+
+
+def read_base64_chunks(f, offset):
+    """Yields the decoded contents of the base64 encoded lines that begin at `offset`."""
+    f.seek(offset)
+    for line in iter(f.readline, b''):
+        if line.startswith(b'END_OF_FILE'):
+            break
+        yield base64.b64decode(line)
+
+
+def read_blob_index(f):
+    """Reads the index at the end of a payload in the "blobs" format, see `write_blobs()`.
+
+    Args:
+        f (file): The bundle, opened in binary mode.
+    Returns:
+        :obj:`list` of :obj:`tuple`: The `(offset, size, encoding, mode, name)` of each blob,
+            or `None` if the bundle isn't in the "blobs" format.
+    """
+    file_size = os.fstat(f.fileno()).st_size
+    f.seek(max(file_size - 32, 0))
+    trailer = f.read()
+    if not trailer.startswith(b'exodus-index '):
+        return None
+    index_size = int(trailer.split()[1])
+    f.seek(file_size - 32 - index_size)
+    blob_index = []
+    for line in f.read(index_size).decode('utf-8').splitlines():
+        offset, size, encoding, mode, name = line.split(' ', 4)
+        blob_index.append((int(offset), int(size), encoding, int(mode, 8), name))
+    return blob_index
+
+
+def read_blobs(filename):
+    """Yields the decompressed blobs of a bundle in the "blobs" format.
+
+    Nothing is yielded for bundles in other formats, where the files are part of the tarball. The
+    blobs are streamed in chunks, and compressed ones are decompressed into spooled temporary files
+    so that their sizes are known without holding large files in memory.
+
+    Args:
+        filename (str): The path to the bundle.
+    Yields:
+        tuple: The `(name, mode, size, fileobj)` of each blob, in the order that they're stored.
+            Each `fileobj` must be read before advancing to the next blob.
+    """
+    with open(filename, 'rb') as f:
+        match = re.search(br'\npayload_offset=(\d+)\n', f.read(script_header_size))
+        blob_index = read_blob_index(f) if match else None
+        for offset, size, encoding, mode, name in blob_index or []:
+            if name == 'metadata':
+                continue
+            if encoding not in codecs and encoding != 'raw':
+                raise InvalidBundleError('The "%s" blob in "%s" has an unknown encoding.' % (
+                    name, filename))
+            chunks = read_chunks(f, int(match.group(1)) - 1 + offset, size)
+            if encoding == 'raw':
+                yield name, mode, size, DecompressingReader(chunks, IdentityCompressor())
+                continue
+            reader = DecompressingReader(chunks, codecs[encoding].create_decompressor())
+            with tempfile.SpooledTemporaryFile(max_size=blob_spool_size) as blob:
+                for chunk in iter(lambda: reader.read(chunk_size), b''):
+                    blob.write(chunk)
+                reader.close()
+                size = blob.tell()
+                blob.seek(0)
+                yield name, mode, size, blob
+
+
+def read_chunks(f, offset, size=None):
+    """Yields the contents of a file starting at `offset`, optionally limited to `size` bytes."""
+    f.seek(offset)
+    while size is None or size > 0:
+        chunk = f.read(chunk_size if size is None else min(chunk_size, size))
+        if not chunk:
+            break
+        if size is not None:
+            size -= len(chunk)
+        yield chunk
+
+
+def read_index(filename):
+    """Reads the index of a bundle's contents, without extracting the rest of the bundle.
+
+    The index immediately follows the root directory of the tarball, so only the beginning of the
+    payload is ever decompressed.
+
+    Args:
+        filename (str): The path to either an installation script or a tarball.
+    Returns:
+        dict: The index, see `Bundle.create_index()`.
+    """
+    with open_archive(filename) as tar:
+        for member in itertools.islice(tar, 2):
+            if os.path.basename(member.name) == index_filename and member.isfile():
+                try:
+                    return json.loads(tar.extractfile(member).read().decode('utf-8'))
+                except ValueError:
+                    break
+    raise InvalidBundleError('The "%s" bundle does not contain a valid index.' % filename)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 """Methods to produce launchers that will invoke the relocated executables with
 the proper linker and library paths."""
+import hashlib
 import os
 import re
 import tempfile
@@ -8,6 +9,7 @@ from distutils.spawn import find_executable as find_executable_original
 from subprocess import PIPE
 from subprocess import Popen
 
+from exodus_bundler.caching import write_atomically
 from exodus_bundler.templating import render_template_file
 
 
@@ -90,18 +92,35 @@ def compile_musl(code):
     return compile_helper(code, [musl])
 
 
-def construct_bash_launcher(linker, library_path, executable, full_linker=True):
+def construct_bash_launcher(linker, library_path, executable, full_linker=True,
+                            system_library_path=''):
     linker_dirname, linker_basename = os.path.split(linker)
     full_linker = 'true' if full_linker else 'false'
     return render_template_file('launcher.sh', linker_basename=linker_basename,
                                 linker_dirname=linker_dirname, library_path=library_path,
-                                executable=executable, full_linker=full_linker)
+                                executable=executable, full_linker=full_linker,
+                                system_library_path=system_library_path)
 
 
-def construct_binary_launcher(linker, library_path, executable, full_linker=True):
+def construct_binary_launcher(linker, library_path, executable, full_linker=True,
+                              cache_directory=None, system_library_path=''):
     linker_dirname, linker_basename = os.path.split(linker)
     full_linker = '1' if full_linker else '0'
     code = render_template_file('launcher.c', linker_basename=linker_basename,
                                 linker_dirname=linker_dirname, library_path=library_path,
-                                executable=executable, full_linker=full_linker)
-    return compile(code)
+                                executable=executable, full_linker=full_linker,
+                                system_library_path=system_library_path)
+    if cache_directory is None:
+        return compile(code)
+
+    # The compiled launchers are stored by the hash of their code, so that they're only rebuilt
+    # when their inputs change.
+    cache_path = os.path.join(cache_directory, hashlib.sha256(code.encode('utf-8')).hexdigest())
+    try:
+        with open(cache_path, 'rb') as f:
+            return f.read()
+    except (IOError, OSError):
+        pass
+    content = compile(code)
+    write_atomically(cache_path, content)
+    return content
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""Utilities for describing the libraries that are already installed on the target hosts."""
+import json
+import logging
+import os
+import re
+
+from exodus_bundler.caching import hash_file
+from exodus_bundler.errors import InvalidProfileError
+from exodus_bundler.errors import MissingFileError
+
+
+logger = logging.getLogger(__name__)
+
+# The directories that are searched for libraries by default, these match the fallback library
+# paths of the launchers.
+default_library_directories = ['/lib64', '/usr/lib64', '/lib', '/usr/lib', '/lib32', '/usr/lib32']
+
+
+def create_host_profile(directories=None):
+    """Hashes the shared libraries that are installed on the current host.
+
+    Both the libraries and any symlinks to them are included, because dependencies are resolved to
+    whichever path the linker found them at.
+
+    Args:
+        directories (:obj:`list` of :obj:`str`, optional): The directories to search recursively,
+            defaults to `default_library_directories`.
+    Returns:
+        dict: The SHA-256 hash of each library's contents, keyed by its absolute path.
+    """
+    profile, hashes = {}, {}
+    for directory in directories or default_library_directories:
+        for root, directory_names, filenames in os.walk(os.path.abspath(directory)):
+            directory_names.sort()
+            for filename in sorted(filenames):
+                if not re.search(r'\.so(?:\.|$)', filename):
+                    continue
+                path = os.path.join(root, filename)
+                real_path = os.path.realpath(path)
+                if not os.path.isfile(real_path):
+                    continue
+                try:
+                    if real_path not in hashes:
+                        hashes[real_path] = hash_file(real_path)
+                except (IOError, OSError) as error:
+                    logger.warning('Skipping "%s" because it could not be read: %s' % (path, error))
+                    continue
+                profile[path] = hashes[real_path]
+    return profile
+
+
+def read_host_profile(filename):
+    """Loads a profile that was written out by `write_host_profile()`.
+
+    Args:
+        filename (str): The path to the profile.
+    Returns:
+        dict: The hash of each library, keyed by its path on the profiled host.
+    """
+    try:
+        with open(filename, 'r') as f:
+            files = json.load(f)['files']
+    except (IOError, OSError):
+        raise MissingFileError('The "%s" host profile could not be read.' % filename)
+    except (KeyError, TypeError, ValueError):
+        raise InvalidProfileError('The "%s" file is not a valid host profile.' % filename)
+    if not isinstance(files, dict):
+        raise InvalidProfileError('The "%s" file is not a valid host profile.' % filename)
+    return files
+
+
+def write_host_profile(f, profile):
+    """Writes out a profile of a host's libraries, which can be used with `TargetProfile`.
+
+    Args:
+        f (file): The file where the profile will be written, opened in text mode.
+        profile (dict): The hash of each library, see `create_host_profile()`.
+    """
+    json.dump({'files': profile, 'version': 1}, f, indent=2, sort_keys=True,
+              separators=(',', ': '))
+    f.write('\n')
+
+
+class TargetProfile(object):
+    """The libraries that are guaranteed to be present on the hosts where bundles are installed.
+
+    Attributes:
+        chroot (str): The root directory that the bundled files are relative to (or `None`).
+        files (dict): The hash of each library, keyed by its path on the target hosts.
+        hashes (dict): The memoized hashes of the local files that have been checked.
+    """
+    def __init__(self, filename, chroot=None):
+        self.chroot = chroot
+        self.files = read_host_profile(filename)
+        self.hashes = {}
+
+    def provides(self, path):
+        """Determines whether an identical copy of a local file is present on the target hosts.
+
+        Args:
+            path (str): The absolute path to the local file.
+        Returns:
+            bool: Whether the file exists at the same path on the targets with the same contents.
+        """
+        target_path = self.target_path(path)
+        if target_path not in self.files:
+            return False
+        if path not in self.hashes:
+            self.hashes[path] = hash_file(path)
+        return self.hashes[path] == self.files[target_path]
+
+    def target_path(self, path):
+        """Returns the path where a local file would be located on the target hosts."""
+        if self.chroot:
+            return os.path.join('/', os.path.relpath(path, self.chroot))
+        return path
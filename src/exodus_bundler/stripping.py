@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Utilities for removing debugging information and symbols from copies of ELF binaries."""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import stat
+import tempfile
+from subprocess import PIPE
+from subprocess import Popen
+
+from exodus_bundler.caching import file_identity
+from exodus_bundler.elf_parsing import read_build_id
+from exodus_bundler.elf_parsing import read_elf_header
+from exodus_bundler.errors import UnsupportedStrippingError
+from exodus_bundler.launchers import find_executable
+
+
+logger = logging.getLogger(__name__)
+
+# The `objcopy` arguments that are used for each of the strip modes. The "debug" mode only removes
+# the sections that aren't loaded into memory at runtime, so the binaries behave identically.
+strip_arguments = {
+    'debug': ['--strip-debug'],
+    'all': ['--strip-all'],
+}
+
+
+class Stripper(object):
+    """Writes stripped copies of ELF binaries, the original files are never modified.
+
+    Each copy is stored under a key derived from the original file's identity and the strip mode,
+    so that unchanged files aren't stripped again when `directory` is persistent.
+
+    Attributes:
+        debug_directory (str): If specified, the debugging information that's removed from each
+            binary is saved here as `.build-id/<xx>/<rest>.debug`, which is the layout that
+            debuggers use to locate it. Binaries without a build ID are skipped.
+        directory (str): The directory where the stripped copies are stored.
+        mode (str): Either "debug" or "all", see `strip_arguments`.
+        used_keys (set): The keys of the copies that have been used by this instance.
+    """
+    def __init__(self, mode, directory, debug_directory=None):
+        self.objcopy = find_executable('objcopy')
+        if not self.objcopy:
+            raise UnsupportedStrippingError(
+                'The "objcopy" command from GNU binutils is required in order to strip binaries.')
+        self.mode = mode
+        self.directory = os.path.abspath(directory)
+        self.debug_directory = debug_directory and os.path.abspath(debug_directory)
+        self.used_keys = set()
+        for directory in [self.directory, self.debug_directory]:
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+
+    def prune(self):
+        """Removes any stripped copies that haven't been used by this instance.
+
+        The temporary files of copies that are still being written by other strippers are kept.
+        """
+        for filename in os.listdir(self.directory):
+            if filename.startswith('.tmp-'):
+                continue
+            if filename.split('.')[0] not in self.used_keys:
+                os.remove(os.path.join(self.directory, filename))
+
+    def run_objcopy(self, arguments, source_path, path):
+        """Runs `objcopy`, writing the output atomically so that interrupted runs leave nothing.
+
+        Each run writes to its own temporary file, so concurrent strippers sharing `directory`
+        can't clobber each other's output.
+
+        Returns:
+            bool: Whether the command succeeded, a warning is logged if it didn't.
+        """
+        f, temporary_path = tempfile.mkstemp(prefix='.tmp-', dir=self.directory)
+        os.close(f)
+        process = Popen([self.objcopy] + arguments + [source_path, temporary_path],
+                        stdout=PIPE, stderr=PIPE)
+        stdout, stderr = process.communicate()
+        if process.returncode != 0:
+            logger.warning('Unable to strip "%s", it will be included unmodified: %s' % (
+                source_path, stderr.decode('utf-8', 'replace').strip()))
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            return False
+        os.chmod(temporary_path, stat.S_IMODE(os.stat(source_path).st_mode))
+        os.rename(temporary_path, path)
+        return True
+
+    def strip(self, path):
+        """Returns the path to a stripped copy of an ELF binary.
+
+        Args:
+            path (str): The path to the original binary.
+        Returns:
+            str: The path to the stripped copy, or the original path if it couldn't be stripped.
+        """
+        key = json.dumps([file_identity(path), self.mode]).encode('utf-8')
+        key = hashlib.sha256(key).hexdigest()
+        self.used_keys.add(key)
+        stripped_path = os.path.join(self.directory, key)
+        if not os.path.exists(stripped_path) and \
+                not self.run_objcopy(strip_arguments[self.mode], path, stripped_path):
+            return path
+
+        if self.debug_directory:
+            with open(path, 'rb') as f:
+                build_id = read_build_id(f, read_elf_header(f, path))
+            debug_path = stripped_path + '.debug'
+            if build_id is None:
+                logger.info('Not saving the debugging information of "%s" because it has no '
+                            'build ID.' % path)
+            elif os.path.exists(debug_path) or \
+                    self.run_objcopy(['--only-keep-debug'], path, debug_path):
+                build_id_path = os.path.join(self.debug_directory, '.build-id', build_id[:2],
+                                             build_id[2:] + '.debug')
+                if not os.path.exists(os.path.dirname(build_id_path)):
+                    os.makedirs(os.path.dirname(build_id_path))
+                shutil.copy2(debug_path, build_id_path)
+
+        return stripped_path
@@ -0,0 +1,83 @@
+#! /bin/bash
+
+user_directory="${HOME}/.exodus"
+if [ "$1" != "--user" ]; then
+    output_directory=${1:-/opt/exodus}
+    mkdir -p ${output_directory} 2> /dev/null
+    if [ ! $? ] || [ ! -w ${output_directory} ] ; then
+        echo "You don't have write access to "${output_directory}"."
+        read -r -p "Would you like to install in ${user_directory} instead? [Y/n] " response
+        if [ -z "${response}" ] || [ "${response:0:1}" == "Y" ] || [ "${response:0:1}" == "y" ]; then
+            output_directory="${user_directory}"
+        else
+            echo "Ok, exiting. You can specify a different installation directory as an argument or run again as root."
+            exit 1
+        fi
+    fi
+else
+    output_directory=${user_directory}
+fi
+
+echo "Installing executable bundle in \"${output_directory}\"..."
+mkdir -p ${output_directory} 2> /dev/null
+
+# Find a command that can decompress the blobs on this machine.
+{{decompressor}}
+
+# The payload begins at this byte offset within the script, and it ends with an index of the
+# blobs that it contains. The last 32 bytes of the file specify the size of the index.
+installer="$0"
+payload_offset={{payload_offset}}
+index_size=$(tail -c 32 "${installer}" | cut -c 14-)
+index_size=$((index_size + 0))
+
+# Each index line contains the offset, size, encoding, permissions, and name of a blob. The names
+# are content hashes, so blobs that were already installed by another bundle are skipped. New ones
+# are written to temporary files and renamed into place, so that concurrent installations never
+# see partially written blobs.
+extract_blob() {
+    blob_path="${output_directory}/data/$5"
+    if [ -f "${blob_path}" ]; then
+        return 0
+    fi
+    temporary_path=$(mktemp "${output_directory}/data/.$5.XXXXXX") && \
+    tail -c +$((payload_offset + $1)) "${installer}" | head -c $2 | \
+        if [ "$3" = "raw" ]; then cat; else decompress; fi > "${temporary_path}" && \
+        chmod "$4" "${temporary_path}" && \
+        mv -f "${temporary_path}" "${blob_path}" || { rm -f "${temporary_path}"; return 1; }
+}
+export -f decompress extract_blob
+export installer output_directory payload_offset
+
+# Delta bundles list the paths that were removed since the version that they're based on, these
+# are deleted after extraction. Directories are listed after their contents so they'll be empty.
+apply_removals() {
+    removals="${output_directory}/.exodus-removals"
+    if [ -f "${removals}" ]; then
+        while IFS= read -r path; do
+            rmdir "${output_directory}/${path}" 2> /dev/null || rm -f "${output_directory}/${path}" 2> /dev/null
+        done < "${removals}"
+        rm -f "${removals}"
+    fi
+}
+
+# The blobs are extracted in parallel first, and then the metadata tarball containing the
+# directory structure, symlinks, and launchers is extracted on top of them (without the index).
+jobs=$(getconf _NPROCESSORS_ONLN 2> /dev/null || echo 1)
+mkdir -p "${output_directory}/data" && \
+tail -c $((index_size + 32)) "${installer}" | head -c ${index_size} | grep -v ' metadata$' | \
+    xargs -P ${jobs} -n 5 bash -c 'extract_blob "$@"' extract_blob && \
+set -- $(tail -c $((index_size + 32)) "${installer}" | head -c ${index_size} | grep ' metadata$') && \
+tail -c +$((payload_offset + $1)) "${installer}" | head -c $2 | decompress | \
+    tar -C "${output_directory}" --strip-components 1 --exclude=exodus/.exodus-index.json --no-same-owner -p -vxf - > /dev/null && \
+    apply_removals
+if [ $? -eq 0 ]; then
+    echo "Successfully installed, be sure to add "${output_directory}/bin" to your \$PATH."
+    exit 0
+else
+    echo "Something went wrong, please send an email to contact@intoli.com with details about the bundle."
+    exit 1
+fi
+
+# The blobs will go here.
+BEGIN-PAYLOAD
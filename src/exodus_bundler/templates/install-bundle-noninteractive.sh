@@ -10,8 +10,23 @@ fi
 echo "Installing executable bundle in \"${output_directory}\"..."
 mkdir -p ${output_directory} 2> /dev/null
 
-# Actually perform the extraction.
-base64 -d << "END_OF_FILE" | tar -C "${output_directory}" --strip-components 1 --no-same-owner -p -zvxf - > /dev/null
+# Find a command that can decompress the tarball on this machine.
+{{decompressor}}
+
+# Delta bundles list the paths that were removed since the version that they're based on, these
+# are deleted after extraction. Directories are listed after their contents so they'll be empty.
+apply_removals() {
+    removals="${output_directory}/.exodus-removals"
+    if [ -f "${removals}" ]; then
+        while IFS= read -r path; do
+            rmdir "${output_directory}/${path}" 2> /dev/null || rm -f "${output_directory}/${path}" 2> /dev/null
+        done < "${removals}"
+        rm -f "${removals}"
+    fi
+}
+
+# Actually perform the extraction, skipping the index which is only used to inspect the bundle.
+base64 -d << "END_OF_FILE" | decompress | tar -C "${output_directory}" --strip-components 1 --exclude=exodus/.exodus-index.json --no-same-owner -p -vxf - > /dev/null && apply_removals
 {{base64_encoded_tarball}}
 END_OF_FILE
 if [ $? -eq 0 ]; then
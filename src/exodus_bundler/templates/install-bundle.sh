@@ -21,9 +21,26 @@ fi
 echo "Installing executable bundle in \"${output_directory}\"..."
 mkdir -p ${output_directory} 2> /dev/null
 
-# Actually perform the extraction.
-begin_tarball_line=$((1 + $(grep --text --line-number '^BEGIN-TARBALL$' $0 | cut -d ':' -f 1)))
-tail -n +$begin_tarball_line "$0" | tar -C "${output_directory}" --strip-components 1 --no-same-owner -p -zvxf - > /dev/null
+# Find a command that can decompress the tarball on this machine.
+{{decompressor}}
+
+# Delta bundles list the paths that were removed since the version that they're based on, these
+# are deleted after extraction. Directories are listed after their contents so they'll be empty.
+apply_removals() {
+    removals="${output_directory}/.exodus-removals"
+    if [ -f "${removals}" ]; then
+        while IFS= read -r path; do
+            rmdir "${output_directory}/${path}" 2> /dev/null || rm -f "${output_directory}/${path}" 2> /dev/null
+        done < "${removals}"
+        rm -f "${removals}"
+    fi
+}
+
+# Actually perform the extraction, the tarball begins at this byte offset within the script. The
+# index of the bundle's contents is only used for inspecting it, so it isn't extracted.
+payload_offset={{payload_offset}}
+tail -c +${payload_offset} "$0" | decompress | tar -C "${output_directory}" --strip-components 1 --exclude=exodus/.exodus-index.json --no-same-owner -p -vxf - > /dev/null && \
+    apply_removals
 if [ $? -eq 0 ]; then
     echo "Successfully installed, be sure to add "${output_directory}/bin" to your \$PATH."
     exit 0
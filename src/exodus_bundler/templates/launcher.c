@@ -5,6 +5,7 @@
 
 int main(int argc, char *argv[])  {
     char *original_library_path = "{{library_path}}";
+    char *system_library_path = "{{system_library_path}}";
     char *executable = "{{executable}}";
     char *linker_basename = "{{linker_basename}}";
     char *linker_dirname = "{{linker_dirname}}/";
@@ -24,7 +25,8 @@ int main(int argc, char *argv[])  {
             library_segments += (original_library_path[i] == ':');
         }
         char *library_path = malloc(
-            (strlen(original_library_path) + library_segments * strlen(current_directory) + 1) * sizeof(char));
+            (strlen(original_library_path) + library_segments * strlen(current_directory) +
+             strlen(system_library_path) + 2) * sizeof(char));
         strcpy(library_path, current_directory);
         int character_offset = current_directory_length;
         for (i = 0; original_library_path[i]; i++) {
@@ -37,6 +39,12 @@ int main(int argc, char *argv[])  {
         }
         library_path[character_offset] = '\0';
 
+        // Libraries that are guaranteed to be present on the target are loaded from the system.
+        if (system_library_path[0]) {
+            strcat(library_path, ":");
+            strcat(library_path, system_library_path);
+        }
+
         // Construct an absolute path to the linker.
         char full_linker_path[4096] = { 0 };
         strcpy(full_linker_path, current_directory);
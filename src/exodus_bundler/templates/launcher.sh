@@ -4,6 +4,11 @@ current_directory="$(dirname "$(readlink -f "$0")")"
 executable="${current_directory}/{{executable}}"
 library_path="{{library_path}}"
 library_path="${current_directory}/${library_path//:/:${current_directory}/}"
+# Libraries that are guaranteed to be present on the target are loaded from the system instead.
+system_library_path="{{system_library_path}}"
+if [ -n "${system_library_path}" ]; then
+    library_path="${library_path}:${system_library_path}"
+fi
 linker="${current_directory}/{{linker_dirname}}/{{linker_basename}}"
 if [ "{{full_linker}}" == "true" ]; then
     exec "${linker}" --library-path "${library_path}" --inhibit-rpath "" "${executable}" "$@"
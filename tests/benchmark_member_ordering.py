@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Compares the compressed size and speed of bundles with and without member ordering.
+
+Run this with `python tests/benchmark_member_ordering.py` from the root of the repository. The
+test binaries are bundled once for each combination of compression codec and member order, and
+each measurement is the best of several repetitions."""
+import io
+import os
+import tarfile
+import time
+
+from exodus_bundler.archiving import TarballWriter
+from exodus_bundler.archiving import codecs
+from exodus_bundler.archiving import write_tarball
+from exodus_bundler.bundling import Bundle
+from exodus_bundler.errors import UnsupportedCompressionError
+
+
+parent_directory = os.path.dirname(os.path.realpath(__file__))
+chroot = os.path.join(parent_directory, 'data', 'binaries', 'chroot')
+executables = [
+    os.path.join(chroot, 'bin', name) for name in sorted(os.listdir(os.path.join(chroot, 'bin')))
+    if name != 'ldd'
+]
+repetitions = 3
+
+
+def measure(bundle, compression, member_order):
+    """Returns the compressed size and the best time out of `repetitions` runs."""
+    best_time = None
+    for i in range(repetitions):
+        output = io.BytesIO()
+
+        def add_members(tar):
+            writer = TarballWriter(tar, member_order=member_order)
+            bundle.create_bundle(shell_launchers=True, writer=writer)
+            writer.close()
+
+        start_time = time.time()
+        write_tarball(output, add_members, compression=compression)
+        elapsed_time = time.time() - start_time
+        best_time = elapsed_time if best_time is None else min(best_time, elapsed_time)
+    return len(output.getvalue()), best_time
+
+
+def main():
+    bundle = Bundle(chroot=chroot)
+    for executable in executables:
+        bundle.add_file(executable, entry_point=True)
+
+    # Measure the uncompressed size for reference.
+    output = io.BytesIO()
+    with tarfile.open(fileobj=output, mode='w|') as tar:
+        writer = TarballWriter(tar)
+        bundle.create_bundle(shell_launchers=True, writer=writer)
+        writer.close()
+    print('Uncompressed size: %d bytes in %d files.' % (len(output.getvalue()), len(bundle.files)))
+    print('')
+
+    print('%-6s %14s %14s %8s %10s %10s %8s' % (
+        'codec', 'unordered', 'ordered', 'ratio', 'unordered', 'ordered', 'speedup'))
+    for compression in ['gzip', 'xz', 'zstd']:
+        try:
+            codecs[compression].check_availability()
+        except UnsupportedCompressionError:
+            print('%-6s skipped, the codec is unavailable.' % compression)
+            continue
+        unordered_size, unordered_time = measure(bundle, compression, 'none')
+        ordered_size, ordered_time = measure(bundle, compression, 'type')
+        print('%-6s %14d %14d %7.2f%% %9.3fs %9.3fs %7.2fx' % (
+            compression, unordered_size, ordered_size,
+            100.0 * (unordered_size - ordered_size) / unordered_size,
+            unordered_time, ordered_time, unordered_time / ordered_time,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+import base64
+import gzip
+import io
+import os
+import subprocess
+import tarfile
+
+import pytest
+
+from exodus_bundler import archiving
+from exodus_bundler.archiving import Base64Writer
+from exodus_bundler.archiving import DecompressingReader
+from exodus_bundler.archiving import DirectoryWriter
+from exodus_bundler.archiving import ParallelGzipCompressor
+from exodus_bundler.archiving import ProcessCompressor
+from exodus_bundler.archiving import TarballWriter
+from exodus_bundler.archiving import TeeWriter
+from exodus_bundler.archiving import add_directory
+from exodus_bundler.archiving import codecs
+from exodus_bundler.archiving import compress_blob
+from exodus_bundler.archiving import detect_codec
+from exodus_bundler.archiving import write_blobs
+from exodus_bundler.archiving import write_tarball
+from exodus_bundler.errors import UnsupportedCompressionError
+from exodus_bundler.launchers import find_executable
+
+
+@pytest.mark.parametrize('chunk_size', [1, 57, 100, 4096])
+def test_base64_writer(chunk_size):
+    data = os.urandom(10000)
+    output = io.BytesIO()
+    writer = Base64Writer(output)
+    for start in range(0, len(data), chunk_size):
+        writer.write(data[start:start + chunk_size])
+    writer.close()
+
+    lines = output.getvalue().split(b'\n')
+    assert all(len(line) <= 76 for line in lines), 'The lines should be at most 76 characters.'
+    assert base64.b64decode(b''.join(lines)) == data, 'The data should survive a round trip.'
+
+
+def test_tee_writer():
+    outputs = [io.BytesIO(), io.BytesIO()]
+    base64_writer = Base64Writer(outputs[1])
+    writer = TeeWriter([outputs[0], base64_writer])
+    with tarfile.open(fileobj=writer, mode='w|') as tar:
+        info = tarfile.TarInfo('hello')
+        info.size = 5
+        tar.addfile(info, io.BytesIO(b'world'))
+    base64_writer.close()
+
+    assert len(outputs[0].getvalue()) > 0, 'The data should have been written out.'
+    assert base64.b64decode(outputs[1].getvalue()) == outputs[0].getvalue(), \
+        'Each file should receive identical data.'
+
+
+@pytest.mark.parametrize('size', [0, 1000, 5 * ParallelGzipCompressor.block_size + 1])
+def test_parallel_gzip_compressor(size):
+    # Repetitive data makes sure that back-references can't cross the block boundaries.
+    data = (os.urandom(1000) * (size // 1000 + 1))[:size]
+    compressor = ParallelGzipCompressor(level=6, jobs=4)
+    compressed_data = b''.join(compressor.compress(data[start:start + 10240])
+                               for start in range(0, len(data), 10240))
+    compressed_data += compressor.flush()
+    decompressed_data = gzip.GzipFile(fileobj=io.BytesIO(compressed_data)).read()
+    assert decompressed_data == data, 'The data should survive a round trip.'
+    if size > 1000:
+        assert len(compressed_data) < size / 10, 'The repetitive data should be compressed.'
+
+
+def test_process_compressor():
+    data = os.urandom(1024 * 1024)
+    compressor = ProcessCompressor(['gzip', '-c'])
+    compressed_data = compressor.compress(data) + compressor.flush()
+    process = subprocess.Popen(['gzip', '-dc'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    assert process.communicate(compressed_data)[0] == data, \
+        'The data should survive a round trip through the process.'
+
+
+@pytest.mark.parametrize('compression', sorted(codecs))
+def test_write_tarball(compression, tmpdir):
+    codec = codecs[compression]
+    try:
+        codec.check_availability()
+    except UnsupportedCompressionError:
+        pytest.skip('The "%s" compression is not available.' % compression)
+    tmpdir.join('source', 'data.txt').write('exodus' * 1000, ensure=True)
+    output = io.BytesIO()
+    write_tarball(output, lambda tar: tar.add(str(tmpdir.join('source')), arcname='exodus'),
+                  compression=compression, compression_level=1)
+
+    # Decompress the tarball using the same shell function that the installers use.
+    decompressor = codec.shell_decompressor()
+    process = subprocess.Popen(['sh', '-c', decompressor + '\ndecompress'],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    tarball = process.communicate(output.getvalue())[0]
+    assert process.returncode == 0, 'The decompressor should have succeeded.'
+    with tarfile.open(fileobj=io.BytesIO(tarball), mode='r:') as tar:
+        member = tar.extractfile('exodus/data.txt')
+        assert member.read() == b'exodus' * 1000, 'The file should survive a round trip.'
+
+
+@pytest.mark.parametrize('compression', sorted(codecs))
+def test_decompressing_reader(compression):
+    codec = codecs[compression]
+    try:
+        codec.check_availability()
+    except UnsupportedCompressionError:
+        pytest.skip('The "%s" compression is not available.' % compression)
+    data = b''.join(os.urandom(64) * 64 for i in range(256))
+    compressor = codec.create_compressor(codec.default_level)
+    compressed_data = compressor.compress(data) + compressor.flush()
+    assert detect_codec(compressed_data[:16]) is codec, 'The codec should be detected.'
+
+    chunks = (compressed_data[start:start + 1000] for start in range(0, len(compressed_data), 1000))
+    reader = DecompressingReader(chunks, codec.create_decompressor())
+    assert reader.read(10) == data[:10], 'The beginning of the data should be read.'
+    assert reader.read() == data[10:], 'The rest of the data should be read.'
+    assert reader.read(10) == b'', 'Nothing should be read past the end.'
+    reader.close()
+
+
+def test_missing_decompressor():
+    # No decompressors are available with an empty `PATH` and no absolute paths.
+    shell = find_executable('sh')
+    decompressor = codecs['zstd'].shell_decompressor()
+    process = subprocess.Popen([shell, '-c', decompressor + '\ndecompress'],
+                               env={'PATH': ''}, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate(b'')
+    assert process.returncode == 1, 'The installer should exit with an error.'
+    assert b'--compression' in stderr, 'The error should suggest a different compression.'
+
+
+def test_directory_writer_links_identical_files(tmpdir):
+    source_path = str(tmpdir.join('source'))
+    tmpdir.join('source').write('linker')
+    tmpdir.join('copy').write('linker')
+    tmpdir.join('other-copy').write('linker')
+    writer = DirectoryWriter(str(tmpdir.join('bundle')))
+    for directory in ['a', 'b', 'e']:
+        writer.copy(source_path, str(tmpdir.join('bundle', directory, 'linker')))
+    writer.copy(str(tmpdir.join('copy')), str(tmpdir.join('bundle', 'c', 'linker')),
+                content_hash='hash')
+    writer.copy(str(tmpdir.join('other-copy')), str(tmpdir.join('bundle', 'd', 'linker')),
+                content_hash='hash')
+
+    assert os.stat(str(tmpdir.join('bundle', 'a', 'linker'))).st_nlink == 3, \
+        'The copies of the same inode should be hard linked together.'
+    assert os.path.samefile(str(tmpdir.join('bundle', 'c', 'linker')),
+                            str(tmpdir.join('bundle', 'd', 'linker'))), \
+        'Files with the same hash should be hard linked together.'
+
+
+def test_directory_writer_reconciles_base_manifest(tmpdir):
+    tmpdir.join('source').write('linker')
+    source_path = str(tmpdir.join('source'))
+    root = str(tmpdir.join('bundle'))
+
+    def create_members(writer, version):
+        writer.copy(source_path, os.path.join(root, 'data', 'linker'), content_hash='hash')
+        writer.write(os.path.join(root, 'bin', 'launcher'), version.encode('utf-8'), 0o755)
+        writer.symlink('../data/linker', os.path.join(root, version, 'linker'))
+
+    writer = DirectoryWriter(root, manifest=True)
+    create_members(writer, 'old')
+    inode = os.stat(os.path.join(root, 'data', 'linker')).st_ino
+
+    new_writer = DirectoryWriter(root, base_manifest=writer.manifest)
+    create_members(new_writer, 'new')
+    new_writer.prune()
+    assert os.stat(os.path.join(root, 'data', 'linker')).st_ino == inode, \
+        'Unchanged files should be left in place.'
+    assert tmpdir.join('bundle', 'bin', 'launcher').read() == 'new', \
+        'Changed files should be replaced.'
+    assert sorted(os.listdir(root)) == ['bin', 'data', 'new'], \
+        'Removed members should be pruned.'
+
+
+def test_tarball_writer_links_identical_files(tmpdir):
+    source_path = str(tmpdir.join('source'))
+    tmpdir.join('source').write('linker')
+    output = io.BytesIO()
+    with tarfile.open(fileobj=output, mode='w') as tar:
+        writer = TarballWriter(tar)
+        writer.copy(source_path, '/exodus/a/linker')
+        writer.copy(source_path, '/exodus/b/linker')
+        os.chmod(source_path, 0o700)
+        writer.copy(source_path, '/exodus/c/linker')
+        writer.close()
+
+    output.seek(0)
+    with tarfile.open(fileobj=output) as tar:
+        assert tar.getmember('exodus/a/linker').isfile(), 'The first copy should be stored.'
+        member = tar.getmember('exodus/b/linker')
+        assert member.islnk() and member.linkname == 'exodus/a/linker', \
+            'Subsequent copies should be stored as hard links.'
+        assert tar.extractfile(member).read() == b'linker', 'The link should resolve.'
+        assert tar.getmember('exodus/c/linker').isfile(), \
+            'Files with different permissions should not be linked.'
+
+
+def test_tarball_writer_base_manifest(tmpdir):
+    tmpdir.join('source').write('linker')
+    source_path = str(tmpdir.join('source'))
+
+    def create_members(writer, version):
+        writer.copy(source_path, '/exodus/data/linker', content_hash='hash')
+        writer.write('/exodus/bin/launcher', version.encode('utf-8'), 0o755)
+        writer.symlink('../data/linker', '/exodus/%s/linker' % version)
+
+    with tarfile.open(fileobj=io.BytesIO(), mode='w') as tar:
+        writer = TarballWriter(tar, manifest=True)
+        create_members(writer, 'old')
+        writer.close()
+    assert writer.manifest['data/linker'] == ['file', 'hash', 0o644]
+    assert writer.manifest['old/linker'] == ['symlink', '../data/linker']
+
+    output = io.BytesIO()
+    with tarfile.open(fileobj=output, mode='w') as tar:
+        delta_writer = TarballWriter(tar, base_manifest=writer.manifest)
+        create_members(delta_writer, 'new')
+        delta_writer.close()
+
+    output.seek(0)
+    with tarfile.open(fileobj=output) as tar:
+        names = tar.getnames()
+        assert 'exodus/data/linker' not in names, 'Unchanged members should be omitted.'
+        assert 'exodus/bin/launcher' in names and 'exodus/new/linker' in names, \
+            'Changed and new members should be included.'
+        removals = tar.extractfile('exodus/.exodus-removals').read().decode('utf-8')
+        assert removals == 'old/linker\nold\n', 'Removed members should be listed.'
+
+
+def test_compress_blob(monkeypatch, tmpdir):
+    # Small chunks make sure that files are compressed incrementally, and spooled to disk.
+    monkeypatch.setattr(archiving, 'blob_chunk_size', 100)
+    monkeypatch.setattr(archiving, 'blob_spool_size', 100)
+
+    def read_blob(path):
+        encoding, blob = compress_blob(path, 'gzip')
+        with blob:
+            return encoding, blob.read()
+
+    tmpdir.join('text').write('exodus' * 1000)
+    encoding, data = read_blob(str(tmpdir.join('text')))
+    assert encoding == 'gzip' and gzip.GzipFile(fileobj=io.BytesIO(data)).read() == b'exodus' * 1000
+
+    random_data = os.urandom(1000)
+    tmpdir.join('random').write(random_data, mode='wb')
+    assert read_blob(str(tmpdir.join('random'))) == ('raw', random_data), \
+        'Incompressible data should be stored raw.'
+
+    with gzip.open(str(tmpdir.join('text.gz')), 'wb') as f:
+        f.write(b'exodus' * 1000)
+    assert read_blob(str(tmpdir.join('text.gz')))[0] == 'raw', \
+        'Already compressed data should be stored raw.'
+
+
+def test_write_blobs(tmpdir):
+    tmpdir.join('library').write('library' * 1000)
+
+    def create_members(writer):
+        writer.copy(str(tmpdir.join('library')), '/exodus/data/hash')
+        writer.copy(str(tmpdir.join('library')), '/exodus/bin/linker')
+        writer.symlink('../data/hash', '/exodus/bin/library')
+
+    output = io.BytesIO()
+    write_blobs(output, create_members, jobs=2)
+    payload = output.getvalue()
+    index_size = int(payload[-32:].split()[1])
+    index = payload[-32 - index_size:-32].decode('utf-8').splitlines()
+    entries = {}
+    for line in index:
+        offset, size, encoding, mode, name = line.split()
+        entries[name] = (int(offset), int(size), encoding, mode)
+    assert sorted(entries) == ['hash', 'metadata'], 'There should be one blob and the metadata.'
+
+    offset, size, encoding, mode = entries['hash']
+    assert encoding == 'gzip', 'The blob should have been compressed.'
+    assert int(mode, 8) == os.stat(str(tmpdir.join('library'))).st_mode & 0o777, \
+        'The permissions should be recorded in the index.'
+    blob = gzip.GzipFile(fileobj=io.BytesIO(payload[offset:offset + size])).read()
+    assert blob == b'library' * 1000, 'The blob should contain the file contents.'
+
+    offset, size, encoding, mode = entries['metadata']
+    metadata = gzip.GzipFile(fileobj=io.BytesIO(payload[offset:offset + size])).read()
+    with tarfile.open(fileobj=io.BytesIO(metadata)) as tar:
+        assert 'exodus/data/hash' not in tar.getnames(), 'Blobs should not be in the metadata.'
+        assert tar.getmember('exodus/bin/linker').linkname == 'exodus/data/hash', \
+            'Identical files should be hard links to the blob.'
+        assert tar.getmember('exodus/bin/library').issym(), 'Symlinks should be in the metadata.'
+
+
+def create_mixed_files(directory):
+    directory.join('archive.gz').write(b'\x1f\x8b' + os.urandom(100), mode='wb', ensure=True)
+    directory.join('libbig.so.1').write(b'\x7fELF' + b'\x00' * 2000, mode='wb')
+    directory.join('libsmall.so').write(b'\x7fELF' + b'\x00' * 1000, mode='wb')
+    directory.join('readme.txt').write('exodus')
+    return ['readme.txt', 'libsmall.so', 'libbig.so.1', 'archive.gz']
+
+
+def test_tarball_writer_member_order(tmpdir):
+    expected_order = create_mixed_files(tmpdir.join('source'))
+    output = io.BytesIO()
+    with tarfile.open(fileobj=output, mode='w') as tar:
+        writer = TarballWriter(tar)
+        for name in reversed(expected_order):
+            writer.copy(str(tmpdir.join('source', name)), '/exodus/data/%s' % name)
+            writer.copy(str(tmpdir.join('source', name)), '/exodus/bin/%s' % name)
+        writer.symlink('../data/readme.txt', '/exodus/bin/link')
+        writer.close()
+
+    output.seek(0)
+    with tarfile.open(fileobj=output) as tar:
+        names = tar.getnames()
+    assert names[:4] == ['exodus', 'exodus/data', 'exodus/bin', 'exodus/bin/link'], \
+        'The directories and symlinks should come first.'
+    assert names[4:8] == ['exodus/data/%s' % name for name in expected_order], \
+        'The files should be grouped by kind, extension, and size.'
+    assert names[8:] == ['exodus/bin/%s' % name for name in reversed(expected_order)], \
+        'The hard links should come last.'
+
+
+def test_add_directory_member_order(tmpdir):
+    expected_order = create_mixed_files(tmpdir.join('source', 'data'))
+    tmpdir.join('source', 'bin').ensure(dir=True)
+    os.symlink('../data/readme.txt', str(tmpdir.join('source', 'bin', 'link')))
+    output = io.BytesIO()
+    with tarfile.open(fileobj=output, mode='w') as tar:
+        add_directory(tar, str(tmpdir.join('source')))
+
+    output.seek(0)
+    with tarfile.open(fileobj=output) as tar:
+        names = tar.getnames()
+    assert names == ['exodus', 'exodus/bin', 'exodus/data', 'exodus/bin/link'] + \
+        ['exodus/data/%s' % name for name in expected_order], \
+        'The directories and symlinks should come first, followed by the grouped files.'
@@ -1,22 +1,37 @@
 # -*- coding: utf-8 -*-
+import hashlib
+import io
 import os
 import shutil
+import struct
+import tarfile
+import time
 from subprocess import PIPE
 from subprocess import Popen
 
 import pytest
 
+from exodus_bundler.archiving import TarballWriter
+from exodus_bundler.archiving import index_filename
 from exodus_bundler.bundling import Bundle
 from exodus_bundler.bundling import Elf
 from exodus_bundler.bundling import File
-from exodus_bundler.bundling import bytes_to_int
+from exodus_bundler.bundling import create_bundle
 from exodus_bundler.bundling import create_unpackaged_bundle
 from exodus_bundler.bundling import detect_elf_binary
-from exodus_bundler.bundling import parse_dependencies_from_ldd_output
+from exodus_bundler.bundling import merge_bundles
+from exodus_bundler.bundling import render_installer
 from exodus_bundler.bundling import resolve_binary
 from exodus_bundler.bundling import resolve_file_path
 from exodus_bundler.bundling import run_ldd
 from exodus_bundler.bundling import stored_property
+from exodus_bundler.errors import IncompatibleOptionsError
+from exodus_bundler.errors import MergeConflictError
+from exodus_bundler.inspection import read_index
+from exodus_bundler.launchers import construct_bash_launcher
+from exodus_bundler.launchers import find_executable
+from exodus_bundler.profiling import create_host_profile
+from exodus_bundler.profiling import write_host_profile
 
 
 parent_directory = os.path.dirname(os.path.realpath(__file__))
@@ -56,6 +71,65 @@ def test_bundle_add_file_recursively():
         'All of the executables and their dependencies should be in the first bundle.'
 
 
+def test_bundle_create_bundle_with_tarball_writer():
+    def read_members(tar):
+        members = {}
+        for member in tar.getmembers():
+            # Staged files might be hard links, so these are compared based on their contents.
+            if member.isfile() or member.islnk():
+                content = tar.extractfile(member).read()
+                members[member.name] = (tarfile.REGTYPE, member.mode, None, content)
+            else:
+                members[member.name] = (member.type, member.mode, member.linkname, None)
+        return members
+
+    staged_bundle = Bundle(chroot=chroot, working_directory=True)
+    try:
+        staged_bundle.add_file(fizz_buzz_glibc_32, entry_point=True)
+        staged_bundle.add_file(fizz_buzz_musl_64, entry_point=True)
+        staged_bundle.create_bundle(shell_launchers=True)
+        staged_output = io.BytesIO()
+        with tarfile.open(fileobj=staged_output, mode='w') as tar:
+            tar.add(staged_bundle.working_directory, arcname='exodus')
+    finally:
+        staged_bundle.delete_working_directory()
+
+    direct_bundle = Bundle(chroot=chroot)
+    direct_bundle.add_file(fizz_buzz_glibc_32, entry_point=True)
+    direct_bundle.add_file(fizz_buzz_musl_64, entry_point=True)
+    direct_output = io.BytesIO()
+    with tarfile.open(fileobj=direct_output, mode='w') as tar:
+        writer = TarballWriter(tar)
+        direct_bundle.create_bundle(shell_launchers=True, writer=writer)
+        writer.close()
+
+    staged_output.seek(0)
+    direct_output.seek(0)
+    with tarfile.open(fileobj=staged_output) as staged_tar, \
+            tarfile.open(fileobj=direct_output) as direct_tar:
+        assert read_members(staged_tar) == read_members(direct_tar), \
+            'Writing directly to a tarball should produce the same members as staging.'
+
+
+def test_bundle_create_index():
+    bundle = Bundle(chroot=chroot)
+    file = bundle.add_file(fizz_buzz_glibc_32, entry_point=True)
+    index = bundle.create_index()
+    source_path = os.path.join('bundles', bundle.hash, file.source)
+    assert index['entry_points'] == {'fizz-buzz-glibc-32': source_path}
+    assert index['launchers'] == [{
+        'library_path': file.library_path(),
+        'linker': file.elf.linker_file.path,
+        'path': source_path,
+        'system_library_path': '',
+    }], 'The launcher should be described.'
+    assert sorted(entry['path'] for entry in index['files']) == \
+        sorted(file.path for file in bundle.files), 'Every file should be included.'
+    entry = next(entry for entry in index['files'] if entry['path'] == file.path)
+    assert entry['hash'] == file.hash
+    assert entry['size'] == os.path.getsize(file.path)
+
+
 def test_bundle_delete_working_directory():
     bundle = Bundle()
     assert bundle.working_directory is None, \
@@ -103,14 +177,83 @@ def test_bundle_root():
         bundle.delete_working_directory()
 
 
-@pytest.mark.parametrize('int,bytes,byteorder', [
-    (1234567890, b'\xd2\x02\x96I\x00\x00\x00\x00', 'little'),
-    (1234567890, b'\x00\x00\x00\x00I\x96\x02\xd2', 'big'),
-    (9876543210, b'\xea\x16\xb0L\x02\x00\x00\x00', 'little'),
-    (9876543210, b'\x00\x00\x00\x02L\xb0\x16\xea', 'big'),
-])
-def test_bytes_to_int(int, bytes, byteorder):
-    assert bytes_to_int(bytes, byteorder=byteorder) == int, 'Byte conversion should work.'
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_bundle_traces_shared_libraries_once(jobs):
+    bundle = Bundle(chroot=chroot, jobs=jobs)
+    resolver = bundle.resolver
+    traced_paths = []
+    find_direct_dependencies = resolver.find_direct_dependencies
+
+    def counting_find_direct_dependencies(elf, linker_file):
+        traced_paths.append(elf.path)
+        # This widens the window where concurrent jobs could trace the same library twice.
+        time.sleep(0.01)
+        return find_direct_dependencies(elf, linker_file)
+
+    resolver.find_direct_dependencies = counting_find_direct_dependencies
+    paths = [echo_args_glibc_32, echo_proc_self_exe_glibc_32, fizz_buzz_glibc_32]
+    # The executables share the same resolver, so they're resolved concurrently when `jobs > 1`.
+    files = resolver.map(lambda path: File(path, chroot=chroot, resolver=resolver), paths)
+    resolver.map(lambda file: file.elf.dependencies, files)
+    assert len(traced_paths) == len(set(traced_paths)), \
+        'Each file should only be traced once for each linker.'
+    assert any('libc.so' in path for path in traced_paths), 'The libc library should be traced.'
+    libcs = [dependency for file in files for dependency in file.elf.direct_dependencies
+             if 'libc.so' in dependency.path]
+    libc_dependencies = set(frozenset(id(dependency) for dependency in libc.elf.dependencies)
+                            for libc in libcs)
+    assert len(libc_dependencies) == 1, 'The resolved dependencies should be shared.'
+
+
+def test_bundle_with_target_profile(tmpdir):
+    profile = create_host_profile([chroot])
+    profile = dict((os.path.join('/', os.path.relpath(path, chroot)), file_hash)
+                   for path, file_hash in profile.items())
+    filename = str(tmpdir.join('profile.json'))
+    with io.open(filename, 'w') as f:
+        write_host_profile(f, profile)
+
+    bundle = Bundle(chroot=chroot, target_profile=filename)
+    file = bundle.add_file(fizz_buzz_glibc_32, entry_point=True)
+    bundled_paths = set(bundled_file.path for bundled_file in bundle.files)
+    assert os.path.join(chroot, 'usr', 'lib32', 'libc.so.6') not in bundled_paths, \
+        'Libraries that are identical on the target should be left out.'
+    assert file.elf.linker_file.path in bundled_paths, 'The linker should always be bundled.'
+    assert bundle.provided_paths == set([os.path.join(chroot, 'usr', 'lib32', 'libc.so.6')])
+    assert file.system_library_path(bundle.provided_paths) == '/usr/lib32'
+    assert file.system_library_path() == '', \
+        'The shared `File` objects should not record which libraries were left out.'
+
+    launcher = construct_bash_launcher(linker='./linker',
+                                       library_path=file.library_path(bundle.provided_paths),
+                                       executable='./fizz-buzz',
+                                       system_library_path='/usr/lib32')
+    assert 'system_library_path="/usr/lib32"' in launcher
+
+
+def test_create_bundle_with_stripping(tmpdir):
+    if not find_executable('objcopy'):
+        pytest.skip('The "objcopy" command is not available.')
+    output, debug_output = str(tmpdir.join('bundle.tgz')), str(tmpdir.join('debug.tgz'))
+    create_bundle([fizz_buzz_glibc_64], output, chroot=chroot, strip='all',
+                  debug_output=debug_output)
+    files = dict((file['path'], file) for file in read_index(output)['files'])
+    executable = files[fizz_buzz_glibc_64]
+    assert executable['size'] < os.path.getsize(fizz_buzz_glibc_64), 'It should be stripped.'
+    with open(fizz_buzz_glibc_64, 'rb') as f:
+        assert executable['hash'] != hashlib.sha256(f.read()).hexdigest(), \
+            'The hash should be computed from the stripped contents.'
+    with tarfile.open(output) as tar:
+        assert os.path.join('exodus', 'data', executable['hash']) in tar.getnames()
+
+    with tarfile.open(debug_output) as tar:
+        debug_names = tar.getnames()
+    assert any(name.startswith('exodus-debug/.build-id/') and name.endswith('.debug')
+               for name in debug_names), 'The debugging information should be included.'
+
+    with pytest.raises(IncompatibleOptionsError):
+        create_bundle([fizz_buzz_glibc_64], str(tmpdir.join('unstripped.tgz')), chroot=chroot,
+                      debug_output=debug_output)
 
 
 @pytest.mark.parametrize('fizz_buzz,shell_launchers', [
@@ -141,6 +284,37 @@ def test_create_unpackaged_bundle(fizz_buzz, shell_launchers):
         shutil.rmtree(root_directory)
 
 
+def test_create_unpackaged_bundle_with_build_dir(tmpdir):
+    build_dir = str(tmpdir.join('build'))
+    root_directory = create_unpackaged_bundle(
+        [fizz_buzz_glibc_32, fizz_buzz_glibc_64], chroot=chroot, shell_launchers=True,
+        build_dir=build_dir)
+    data_directory = os.path.join(root_directory, 'data')
+    inodes = dict((name, os.stat(os.path.join(data_directory, name)).st_ino)
+                  for name in os.listdir(data_directory))
+
+    # Rebuilding with a different set of executables should reuse the unchanged files.
+    assert create_unpackaged_bundle(
+        [fizz_buzz_glibc_32, fizz_buzz_musl_64], chroot=chroot, shell_launchers=True,
+        build_dir=build_dir) == root_directory
+    fresh_root_directory = create_unpackaged_bundle(
+        [fizz_buzz_glibc_32, fizz_buzz_musl_64], chroot=chroot, shell_launchers=True)
+    try:
+        for directory in ['bin', 'bundles', 'data']:
+            assert sorted(os.listdir(os.path.join(root_directory, directory))) == \
+                sorted(os.listdir(os.path.join(fresh_root_directory, directory))), \
+                'Stale files should have been removed from the build directory.'
+    finally:
+        shutil.rmtree(fresh_root_directory)
+    shared_names = set(inodes) & set(os.listdir(data_directory))
+    assert len(shared_names) > 0 and all(
+        os.stat(os.path.join(data_directory, name)).st_ino == inodes[name]
+        for name in shared_names), 'Unchanged files should have been kept.'
+
+    process = Popen([os.path.join(root_directory, 'bin', 'fizz-buzz-musl-64')], stdout=PIPE)
+    assert 'FIZZBUZZ' in process.communicate()[0].decode('utf-8')
+
+
 @pytest.mark.parametrize('detect', [False, True])
 def test_create_unpackaged_bundle_detects_dependencies(detect):
     binary_name = 'ls'
@@ -251,6 +425,35 @@ def test_elf_direct_dependencies(fizz_buzz):
             '"libc" was not found as a direct dependency of the executable.'
 
 
+@pytest.mark.parametrize('bits,byteorder', [
+    (32, 'big'),
+    (32, 'little'),
+    (64, 'big'),
+    (64, 'little'),
+])
+def test_elf_headers(tmpdir, bits, byteorder):
+    # Construct a minimal executable with only an ELF header and a PT_INTERP program header.
+    endian = {'big': '>', 'little': '<'}[byteorder]
+    linker_path = os.path.join(chroot, 'lib64', 'ld-linux-x86-64.so.2').encode('utf-8') + b'\x00'
+    identification = b'\x7fELF' + struct.pack('BBB9x', bits // 32, 1 + (byteorder == 'big'), 1)
+    if bits == 32:
+        header = struct.pack(endian + 'HHIIIIIHHHHHH', 2, 3, 1, 0, 52, 0, 0, 52, 32, 1, 0, 0, 0)
+        program_header = struct.pack(endian + 'IIIIIIII', 3, 84, 0, 0, len(linker_path), 0, 4, 1)
+    else:
+        header = struct.pack(endian + 'HHIQQQIHHHHHH', 2, 62, 1, 0, 64, 0, 0, 64, 56, 1, 0, 0, 0)
+        program_header = struct.pack(endian + 'IIQQQQQQ', 3, 4, 120, 0, 0, len(linker_path), 0, 1)
+    path = str(tmpdir.join('binary'))
+    with open(path, 'wb') as f:
+        f.write(identification + header + program_header + linker_path)
+
+    elf = Elf(path)
+    assert elf.bits == bits, 'The ELF class should be parsed.'
+    assert elf.byteorder == byteorder, 'The byte order should be parsed.'
+    assert elf.type == 'executable', 'The ELF type should be parsed.'
+    assert elf.linker_file.path == linker_path[:-1].decode('utf-8'), \
+        'The linker should be parsed from the PT_INTERP program header.'
+
+
 @pytest.mark.parametrize('fizz_buzz,expected_linker_path', [
     (fizz_buzz_glibc_32, '/lib/ld-linux.so.2'),
     (fizz_buzz_glibc_64, '/lib64/ld-linux-x86-64.so.2'),
@@ -336,23 +539,64 @@ def test_file_symlink():
         bundle.delete_working_directory()
 
 
-@pytest.mark.parametrize('filename_prefix', [
-    'htop-amazon-linux',
-    'htop-arch',
-    'htop-ubuntu-14.04',
-])
-def test_parse_dependencies_from_ldd_output(filename_prefix):
-    ldd_output_filename = filename_prefix + '.txt'
-    with open(os.path.join(ldd_output_directory, ldd_output_filename)) as f:
-        ldd_output = f.read()
-    dependencies = parse_dependencies_from_ldd_output(ldd_output)
-
-    ldd_results_filename = filename_prefix + '-dependencies.txt'
-    with open(os.path.join(ldd_output_directory, ldd_results_filename)) as f:
-        expected_dependencies = [line for line in f.read().split('\n') if len(line)]
-
-    assert set(dependencies) == set(expected_dependencies), \
-        'The dependencies were not parsed correctly from ldd output for "%s"' % filename_prefix
+def test_merge_bundles(tmpdir):
+    bundles = [str(tmpdir.join('glibc-32.sh')), str(tmpdir.join('glibc-64.tgz')),
+               str(tmpdir.join('both.sh'))]
+    create_bundle([fizz_buzz_glibc_32], bundles[0], chroot=chroot, bundle_format='blobs')
+    create_bundle([fizz_buzz_glibc_64], bundles[1], chroot=chroot, compression='none')
+    create_bundle([fizz_buzz_glibc_32, fizz_buzz_glibc_64], bundles[2], chroot=chroot)
+
+    output = str(tmpdir.join('merged.tgz'))
+    merge_bundles(bundles, output, reproducible=True)
+    with tarfile.open(output) as tar:
+        names = tar.getnames()
+    assert names[1] == os.path.join('exodus', index_filename), 'The index should come first.'
+    assert len(names) == len(set(names)), 'Each member should only be added once.'
+    indexes = [read_index(filename) for filename in bundles]
+    for index in indexes:
+        assert os.path.join('exodus', 'bundles', index['bundle']) in names, \
+            'Each of the bundle roots should be included.'
+    data_names = [name for name in names if name.startswith('exodus/data/')]
+    file_hashes = set(file['hash'] for index in indexes for file in index['files'])
+    assert len(data_names) == len(file_hashes), 'The data files should be deduplicated.'
+
+    index = read_index(output)
+    assert sorted(index['entry_points']) == ['fizz-buzz-glibc-32', 'fizz-buzz-glibc-64']
+    assert len(index['launchers']) == 4, 'The launchers of every bundle should be included.'
+
+
+def test_merge_bundles_conflicting_entry_points(tmpdir):
+    bundles = [str(tmpdir.join('a.tgz')), str(tmpdir.join('b.tgz'))]
+    create_bundle([fizz_buzz_glibc_32], bundles[0], chroot=chroot, rename=['fizz-buzz'])
+    create_bundle([fizz_buzz_glibc_64], bundles[1], chroot=chroot, rename=['fizz-buzz'])
+    output = str(tmpdir.join('merged.tgz'))
+    with pytest.raises(MergeConflictError):
+        merge_bundles(bundles, output)
+    assert not os.path.exists(output), 'The partially written bundle should be removed.'
+
+
+def test_merge_bundles_conflicting_modes(tmpdir):
+    for filename, mode in [('a.txt', 0o644), ('b.txt', 0o755)]:
+        tmpdir.join(filename).write('identical content')
+        tmpdir.join(filename).chmod(mode)
+    bundles = [str(tmpdir.join('a.sh')), str(tmpdir.join('b.sh'))]
+    create_bundle([fizz_buzz_glibc_32], bundles[0], chroot=chroot, add=[str(tmpdir.join('a.txt'))],
+                  bundle_format='blobs')
+    create_bundle([fizz_buzz_glibc_32], bundles[1], chroot=chroot, add=[str(tmpdir.join('b.txt'))],
+                  bundle_format='blobs')
+    output = str(tmpdir.join('merged.tgz'))
+    with pytest.raises(MergeConflictError):
+        merge_bundles(bundles, output)
+    assert not os.path.exists(output), 'The partially written bundle should be removed.'
+
+
+@pytest.mark.parametrize('template_filename', ['install-bundle.sh', 'install-bundle-blobs.sh'])
+def test_render_installer(template_filename):
+    script_content = render_installer(template_filename, decompressor='')
+    offsets = [line.split(b'=')[1] for line in script_content.split(b'\n')
+               if line.startswith(b'payload_offset=')]
+    assert offsets == [str(len(script_content) + 1).encode('utf-8')], \
+        'The payload offset should point just past the end of the script.'
 
 
 def test_resolve_binary():
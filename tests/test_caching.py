@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import shutil
+
+from exodus_bundler.bundling import Elf
+from exodus_bundler.caching import BlobStore
+from exodus_bundler.caching import DependencyCache
+from exodus_bundler.dependency_resolution import CachedResolver
+from exodus_bundler.dependency_resolution import LddResolver
+
+
+parent_directory = os.path.dirname(os.path.realpath(__file__))
+chroot = os.path.join(parent_directory, 'data', 'binaries', 'chroot')
+fizz_buzz_glibc_64 = os.path.join(chroot, 'bin', 'fizz-buzz-glibc-64')
+
+
+class CountingResolver(LddResolver):
+    def __init__(self):
+        super(CountingResolver, self).__init__()
+        self.calls = 0
+
+    def find_direct_dependencies(self, elf, linker_file):
+        self.calls += 1
+        return super(CountingResolver, self).find_direct_dependencies(elf, linker_file)
+
+
+def test_dependency_cache_hits_and_invalidates(tmpdir):
+    # Work on a copy so that the modification time can be changed.
+    binary = str(tmpdir.join('fizz-buzz'))
+    shutil.copy(fizz_buzz_glibc_64, binary)
+    cache_directory = str(tmpdir.join('cache'))
+
+    counting_resolver = CountingResolver()
+    resolver = CachedResolver(counting_resolver, DependencyCache(cache_directory))
+    cold_dependencies = Elf(binary, chroot=chroot, resolver=resolver).direct_dependencies
+    assert counting_resolver.calls == 1, 'The resolver should be invoked on a cold cache.'
+
+    # A new cache instance simulates a separate run.
+    resolver = CachedResolver(counting_resolver, DependencyCache(cache_directory))
+    warm_dependencies = Elf(binary, chroot=chroot, resolver=resolver).direct_dependencies
+    assert counting_resolver.calls == 1, 'The resolver should not be invoked on a warm cache.'
+    assert set(file.path for file in cold_dependencies) == \
+        set(file.path for file in warm_dependencies), 'The cached dependencies should match.'
+
+    st = os.stat(binary)
+    os.utime(binary, (st.st_atime, st.st_mtime + 10))
+    resolver = CachedResolver(counting_resolver, DependencyCache(cache_directory))
+    Elf(binary, chroot=chroot, resolver=resolver).direct_dependencies
+    assert counting_resolver.calls == 2, 'Modifying the binary should invalidate the entry.'
+
+
+def test_dependency_cache_prune(tmpdir):
+    cache = DependencyCache(str(tmpdir), max_size=0)
+    resolver = CachedResolver(LddResolver(), cache)
+    Elf(fizz_buzz_glibc_64, chroot=chroot, resolver=resolver).direct_dependencies
+    entries = [files for root, directories, files in os.walk(str(tmpdir)) if files]
+    assert len(entries) == 1, 'An entry should have been written to the cache.'
+    cache.prune()
+    entries = [files for root, directories, files in os.walk(str(tmpdir)) if files]
+    assert len(entries) == 0, 'The entry should have been evicted.'
+
+
+def test_blob_store_add_and_hash(tmpdir):
+    blob_store = BlobStore(str(tmpdir.join('store')))
+    with open(fizz_buzz_glibc_64, 'rb') as f:
+        expected_hash = hashlib.sha256(f.read()).hexdigest()
+    assert blob_store.hash(fizz_buzz_glibc_64) == expected_hash
+    hash_entries = [files for root, directories, files in os.walk(str(tmpdir)) if files]
+    assert len(hash_entries) == 1, 'The hash should have been stored.'
+    assert blob_store.hash(fizz_buzz_glibc_64) == expected_hash, 'The stored hash should match.'
+
+    blob_path = blob_store.add(fizz_buzz_glibc_64, expected_hash, 0o755)
+    assert blob_path == blob_store.add(fizz_buzz_glibc_64, expected_hash, 0o755)
+    with open(blob_path, 'rb') as f:
+        assert hashlib.sha256(f.read()).hexdigest() == expected_hash
+    assert os.stat(blob_path).st_mode & 0o777 == 0o755
+
+
+def test_blob_store_add_leaves_source_unmodified(tmpdir):
+    # Read-only files are otherwise eligible to be hard linked when copying.
+    source_path = str(tmpdir.join('fizz-buzz'))
+    shutil.copy(fizz_buzz_glibc_64, source_path)
+    os.chmod(source_path, 0o444)
+    os.utime(source_path, (978307200, 978307200))
+    st = os.stat(source_path)
+
+    blob_store = BlobStore(str(tmpdir.join('store')))
+    content_hash = blob_store.hash(source_path)
+    blob_path = blob_store.add(source_path, content_hash, 0o444)
+    assert os.stat(blob_path).st_ino != st.st_ino, 'The blob should be a private copy.'
+    # The second addition is a hit, which touches the existing blob.
+    assert blob_store.add(source_path, content_hash, 0o444) == blob_path
+    new_st = os.stat(source_path)
+    assert (new_st.st_ino, new_st.st_nlink, new_st.st_mtime) == \
+        (st.st_ino, st.st_nlink, st.st_mtime), 'The source file should never be modified.'
+
+
+def test_blob_store_prune(tmpdir):
+    blob_store = BlobStore(str(tmpdir))
+    size = os.path.getsize(fizz_buzz_glibc_64)
+    old_blob = blob_store.add(fizz_buzz_glibc_64, 'a' * 64, 0o755)
+    new_blob = blob_store.add(fizz_buzz_glibc_64, 'b' * 64, 0o755)
+    os.utime(old_blob, (0, 0))
+    temporary_path = os.path.join(os.path.dirname(new_blob), '.tmp-interrupted')
+    shutil.copy(fizz_buzz_glibc_64, temporary_path)
+    os.utime(temporary_path, (0, 0))
+
+    assert blob_store.prune(max_size=size) == (2, 2 * size)
+    assert not os.path.exists(old_blob), 'The least recently used blob should be evicted.'
+    assert not os.path.exists(temporary_path), 'Stale temporary files should be removed.'
+    assert os.path.exists(new_blob), 'The most recently used blob should be kept.'
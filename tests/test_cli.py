@@ -1,15 +1,20 @@
 # -*- coding: utf-8 -*-
+import base64
 import io
+import json
 import os
+import shutil
 import subprocess
 import tarfile
 import tempfile
 
 import pytest
 
+from exodus_bundler.archiving import codecs
 from exodus_bundler.bundling import logger
 from exodus_bundler.cli import configure_logging
 from exodus_bundler.cli import parse_args
+from exodus_bundler.errors import UnsupportedCompressionError
 
 
 parent_directory = os.path.dirname(os.path.realpath(__file__))
@@ -52,6 +57,179 @@ def test_adding_additional_files(capsys):
         assert any(fizz_buzz_glibc_64 in name for name in names), stderr
 
 
+def test_blob_store_gc(tmpdir):
+    blob_store = str(tmpdir.join('store'))
+    args = ['--blob-store', blob_store, '--chroot', chroot, '--output', str(tmpdir.join('a.sh')),
+            fizz_buzz_glibc_32]
+    returncode, stdout, stderr = run_exodus(args)
+    assert returncode == 0, stderr
+    blobs = [files for root, directories, files in os.walk(os.path.join(blob_store, 'blobs'))]
+    assert sum(len(files) for files in blobs) > 0, 'The bundled files should have been stored.'
+
+    returncode, stdout, stderr = run_exodus(['gc', '--blob-store', blob_store, '--max-size', '0'])
+    assert returncode == 0, stderr
+    remaining = [files for root, directories, files in os.walk(blob_store)]
+    assert sum(len(files) for files in remaining) == 0, 'Every entry should have been evicted.'
+
+
+@pytest.mark.parametrize('name,prefix', [
+    # Graphviz ships a `gc` executable, for example, which needs to be escaped.
+    ('gc', ['--']),
+    # Bundler's `bundle` executable isn't a subcommand, so it doesn't.
+    ('bundle', []),
+])
+def test_bundling_executable_named_like_subcommand(name, prefix, tmpdir):
+    shutil.copy(fizz_buzz_glibc_32, str(tmpdir.join(name)))
+    env = dict(os.environ, PATH=os.pathsep.join([str(tmpdir), os.environ['PATH']]))
+    output = str(tmpdir.join('%s.tgz' % name))
+    args = prefix + [name, '--chroot', chroot, '--output', output]
+    returncode, stdout, stderr = run_exodus(args, env=env)
+    assert returncode == 0, stderr
+    with tarfile.open(output) as tar:
+        assert 'exodus/bin/%s' % name in tar.getnames(), 'The executable should have been bundled.'
+
+    if prefix:
+        returncode, stdout, stderr = run_exodus([name], env=env)
+        assert returncode != 0 and '--blob-store' in stderr, 'The subcommand should still run.'
+
+
+def test_inspecting_bundle(tmpdir):
+    # The bundle written to stdout uses the non-interactive script with a base64 encoded tarball.
+    args = ['--chroot', chroot, '--output', '-', fizz_buzz_glibc_32]
+    returncode, stdout, stderr = run_exodus(args, universal_newlines=False)
+    assert returncode == 0, stderr
+    bundle = tmpdir.join('bundle.sh')
+    bundle.write_binary(stdout)
+
+    returncode, stdout, stderr = run_exodus(['inspect', '--json', str(bundle)])
+    assert returncode == 0, stderr
+    index = json.loads(stdout)
+    assert index['filename'] == str(bundle)
+    assert list(index['entry_points']) == ['fizz-buzz-glibc-32']
+
+    returncode, stdout, stderr = run_exodus(['inspect', str(bundle), fizz_buzz_glibc_32])
+    assert returncode == 1, 'Inspecting a file that is not a bundle should fail.'
+    assert 'fizz-buzz-glibc-32 -> bundles/' in stdout, 'The valid bundle should be described.'
+
+
+@pytest.mark.parametrize('compression,jobs,direct', [
+    ('gzip', 1, False), ('gzip', 4, False), ('gzip', 1, True),
+    ('none', 1, False), ('xz', 1, False), ('zstd', 1, False),
+])
+def test_installing_bundle(compression, jobs, direct, tmpdir):
+    try:
+        codecs[compression].check_availability()
+    except UnsupportedCompressionError:
+        pytest.skip('The "%s" compression is not available.' % compression)
+    filename = str(tmpdir.join('bundle.sh'))
+    installation_directory = str(tmpdir.join('installation'))
+    args = ['--chroot', chroot, '--compression', compression, '--jobs', str(jobs),
+            '--output', filename, fizz_buzz_glibc_32]
+    if direct:
+        args.append('--direct')
+    returncode, stdout, stderr = run_exodus(args)
+    assert returncode == 0, "Exodus should have exited with a success status code, but didn't."
+
+    process = subprocess.Popen(['bash', filename, installation_directory],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    assert process.returncode == 0, stderr
+
+    executable = os.path.join(installation_directory, 'bin', 'fizz-buzz-glibc-32')
+    process = subprocess.Popen([executable], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    assert 'FIZZBUZZ' in stdout.decode('utf-8'), stderr
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'none', 'zstd'])
+def test_installing_blobs_bundle(compression, tmpdir):
+    try:
+        codecs[compression].check_availability()
+    except UnsupportedCompressionError:
+        pytest.skip('The "%s" compression is not available.' % compression)
+    filename = str(tmpdir.join('bundle.sh'))
+    installation_directory = str(tmpdir.join('installation'))
+    args = ['--chroot', chroot, '--compression', compression, '--format', 'blobs', '--jobs', '2',
+            '--output', filename, fizz_buzz_glibc_32, fizz_buzz_glibc_64]
+    returncode, stdout, stderr = run_exodus(args)
+    assert returncode == 0, "Exodus should have exited with a success status code, but didn't."
+
+    process = subprocess.Popen(['bash', filename, installation_directory],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    assert process.returncode == 0, stderr
+
+    for fizz_buzz in [fizz_buzz_glibc_32, fizz_buzz_glibc_64]:
+        executable = os.path.join(installation_directory, 'bin', os.path.basename(fizz_buzz))
+        process = subprocess.Popen([executable], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        assert 'FIZZBUZZ' in stdout.decode('utf-8'), stderr
+
+
+def test_installing_blobs_bundle_skips_existing_blobs(tmpdir):
+    installation_directory = str(tmpdir.join('installation'))
+    data_directory = os.path.join(installation_directory, 'data')
+    for i, fizz_buzz in enumerate([fizz_buzz_glibc_32, fizz_buzz_glibc_32_exe]):
+        filename = str(tmpdir.join('bundle.sh'))
+        args = ['--chroot', chroot, '--format', 'blobs', '--output', filename, fizz_buzz]
+        returncode, stdout, stderr = run_exodus(args)
+        assert returncode == 0, stderr
+
+        process = subprocess.Popen(['bash', filename, installation_directory],
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        assert process.returncode == 0, stderr
+        if i == 0:
+            # Backdate the blobs so that we can tell whether they're written out again.
+            existing_names = os.listdir(data_directory)
+            for name in existing_names:
+                os.utime(os.path.join(data_directory, name), (0, 0))
+
+    # The libraries are shared between the bundles, so they should only be written out once.
+    names = os.listdir(data_directory)
+    assert len(set(names) - set(existing_names)) > 0, 'The second bundle should add new blobs.'
+    assert all(os.stat(os.path.join(data_directory, name)).st_mtime == 0
+               for name in existing_names), 'The existing blobs should not be written out again.'
+    assert not any(name.startswith('.') for name in names), \
+        'No temporary files should be left behind.'
+    for fizz_buzz in ['fizz-buzz-glibc-32', 'fizz-buzz-glibc-32-exe']:
+        executable = os.path.join(installation_directory, 'bin', fizz_buzz)
+        process = subprocess.Popen([executable], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        assert 'FIZZBUZZ' in stdout.decode('utf-8'), stderr
+
+
+def test_installing_delta_bundle(tmpdir):
+    installation_directory = str(tmpdir.join('installation'))
+    versions = [[fizz_buzz_glibc_32, fizz_buzz_glibc_64], [fizz_buzz_glibc_32, fizz_buzz_musl_64]]
+    for i, executables in enumerate(versions):
+        filename = str(tmpdir.join('bundle-%d.sh' % i))
+        args = ['--chroot', chroot, '--manifest', str(tmpdir.join('manifest-%d.json' % i)),
+                '--output', filename] + executables
+        if i > 0:
+            args += ['--base-manifest', str(tmpdir.join('manifest-%d.json' % (i - 1)))]
+        returncode, stdout, stderr = run_exodus(args)
+        assert returncode == 0, stderr
+
+        process = subprocess.Popen(['bash', filename, installation_directory],
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        assert process.returncode == 0, stderr
+
+    assert os.path.getsize(str(tmpdir.join('bundle-1.sh'))) < \
+        os.path.getsize(str(tmpdir.join('bundle-0.sh'))) / 2, \
+        'The delta should omit the unchanged files.'
+    assert sorted(os.listdir(os.path.join(installation_directory, 'bin'))) == \
+        ['fizz-buzz-glibc-32', 'fizz-buzz-musl-64'], 'The removed executable should be deleted.'
+    assert len(os.listdir(os.path.join(installation_directory, 'bundles'))) == 1, \
+        'The previous version of the bundle should be deleted.'
+    for fizz_buzz in ['fizz-buzz-glibc-32', 'fizz-buzz-musl-64']:
+        executable = os.path.join(installation_directory, 'bin', fizz_buzz)
+        process = subprocess.Popen([executable], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        assert 'FIZZBUZZ' in stdout.decode('utf-8'), stderr
+
+
 def test_logging_outputs(capsys):
     # There should be no output before configuring the logger.
     logger.error('error')
@@ -72,6 +250,31 @@ def test_logging_outputs(capsys):
     assert all(output not in err for output in ('info', 'debug'))
 
 
+def test_merging_bundles(tmpdir):
+    bundles = [str(tmpdir.join('glibc.sh')), str(tmpdir.join('musl.tgz'))]
+    returncode, stdout, stderr = run_exodus(
+        ['--chroot', chroot, '--output', bundles[0], fizz_buzz_glibc_32])
+    assert returncode == 0, stderr
+    returncode, stdout, stderr = run_exodus(
+        ['--chroot', chroot, '--output', bundles[1], fizz_buzz_musl_64])
+    assert returncode == 0, stderr
+
+    filename = str(tmpdir.join('merged.sh'))
+    returncode, stdout, stderr = run_exodus(['merge', '--output', filename] + bundles)
+    assert returncode == 0, stderr
+    installation_directory = str(tmpdir.join('installation'))
+    process = subprocess.Popen(['bash', filename, installation_directory],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    assert process.returncode == 0, stderr
+
+    for entry_point in ['fizz-buzz-glibc-32', 'fizz-buzz-musl-64']:
+        executable = os.path.join(installation_directory, 'bin', entry_point)
+        process = subprocess.Popen([executable], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        assert 'FIZZBUZZ' in stdout.decode('utf-8'), stderr
+
+
 def test_missing_binary(capsys):
     # Without the --verbose flag.
     command = 'this-is-almost-definitely-not-going-to-be-a-command-anywhere'
@@ -85,6 +288,16 @@ def test_missing_binary(capsys):
     assert 'Traceback' in stderr, 'Traceback should be included with the --verbose flag.'
 
 
+def test_profiling_host(tmpdir):
+    profile = str(tmpdir.join('profile.json'))
+    library_directory = os.path.join(chroot, 'usr', 'lib32')
+    returncode, stdout, stderr = run_exodus(['profile-host', '-o', profile, library_directory])
+    assert returncode == 0, stderr
+    with open(profile, 'r') as f:
+        files = json.load(f)['files']
+    assert os.path.join(library_directory, 'libc.so.6') in files, 'The library was not recorded.'
+
+
 def test_required_argument():
     with pytest.raises(SystemExit):
         parse_args([])
@@ -124,6 +337,70 @@ def test_writing_bundle_to_stdout():
     assert stdout.startswith('#! /bin/sh'), stderr
 
 
+def test_writing_bundle_to_stdout_embeds_tarball():
+    args = ['--chroot', chroot, '--output', '-', fizz_buzz_glibc_32]
+    returncode, stdout, stderr = run_exodus(args)
+    assert returncode == 0, "Exodus should have exited with a success status code, but didn't."
+    lines = stdout.split('\n')
+    start = next(i for i, line in enumerate(lines) if line.startswith('base64 -d')) + 1
+    end = lines.index('END_OF_FILE')
+    stream = io.BytesIO(base64.b64decode(''.join(lines[start:end])))
+    with tarfile.open(fileobj=stream, mode='r:gz') as f:
+        assert 'exodus/bin/fizz-buzz-glibc-32' in f.getnames(), stderr
+
+
+def test_writing_multiple_outputs(tmpdir):
+    script_filename = str(tmpdir.join('bundle.sh'))
+    tarball_filename = str(tmpdir.join('bundle.tgz'))
+    args = ['--chroot', chroot, '--output', script_filename, '--output', tarball_filename,
+            '--output', '-', fizz_buzz_glibc_32]
+    returncode, stdout, stderr = run_exodus(args)
+    assert returncode == 0, "Exodus should have exited with a success status code, but didn't."
+
+    # All of the outputs should share the exact same compressed tarball.
+    with open(tarball_filename, 'rb') as f:
+        tarball = f.read()
+    with tarfile.open(fileobj=io.BytesIO(tarball), mode='r:gz') as f:
+        assert 'exodus/bin/fizz-buzz-glibc-32' in f.getnames(), stderr
+    with open(script_filename, 'rb') as f:
+        script = f.read()
+    assert script.startswith(b'#! /bin/bash') and script.endswith(tarball), \
+        'The installation script should end with the tarball.'
+    lines = stdout.split('\n')
+    start = next(i for i, line in enumerate(lines) if line.startswith('base64 -d')) + 1
+    end = lines.index('END_OF_FILE')
+    assert base64.b64decode(''.join(lines[start:end])) == tarball, \
+        'The non-interactive script should embed the tarball.'
+
+    installation_directory = str(tmpdir.join('installation'))
+    process = subprocess.Popen(['bash', script_filename, installation_directory],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    assert process.returncode == 0, stderr
+
+
+@pytest.mark.parametrize('direct', [False, True])
+def test_writing_reproducible_bundle(direct, tmpdir):
+    contents = []
+    for i in range(2):
+        filename = str(tmpdir.join('bundle-%d.tgz' % i))
+        args = ['--chroot', chroot, '--reproducible', '--shell-launchers', '--tarball',
+                '--output', filename, fizz_buzz_glibc_32, fizz_buzz_musl_64]
+        if direct:
+            args.append('--direct')
+        returncode, stdout, stderr = run_exodus(args)
+        assert returncode == 0, "Exodus should have exited with a success status code, but didn't."
+        with open(filename, 'rb') as f:
+            contents.append(f.read())
+    assert contents[0] == contents[1], 'The bundles should be byte-identical.'
+
+    with tarfile.open(fileobj=io.BytesIO(contents[0]), mode='r:gz') as tar:
+        for member in tar.getmembers():
+            assert member.mtime == 0 and member.uid == member.gid == 0, \
+                'The metadata should have been normalized.'
+            assert member.uname == member.gname == '', 'The owner names should be omitted.'
+
+
 def test_writing_tarball_to_disk():
     f, filename = tempfile.mkstemp(suffix='.tgz')
     os.close(f)
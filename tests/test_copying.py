@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import os
+import stat
+
+import pytest
+
+from exodus_bundler import copying
+from exodus_bundler.copying import copy_file
+
+
+@pytest.mark.parametrize('name,strategy', copying.strategies)
+def test_copy_strategies(name, strategy, tmpdir):
+    source_path = str(tmpdir.join('source'))
+    destination_path = str(tmpdir.join('destination'))
+    content = os.urandom(3 * 1024 * 1024 + 17)
+    with open(source_path, 'wb') as f:
+        f.write(content)
+    os.chmod(source_path, 0o555)
+
+    if not strategy(source_path, destination_path):
+        assert not os.path.exists(destination_path), \
+            'A failed strategy should not leave a partial copy behind.'
+        pytest.skip('The "%s" strategy is not supported here.' % name)
+
+    with open(destination_path, 'rb') as f:
+        assert f.read() == content, 'The contents should have been copied.'
+    assert stat.S_IMODE(os.stat(destination_path).st_mode) == 0o555, \
+        'The permissions should have been copied.'
+
+
+def test_copy_file_never_hard_links_writable_files(tmpdir):
+    source_path = str(tmpdir.join('source'))
+    destination_path = str(tmpdir.join('destination'))
+    with open(source_path, 'w') as f:
+        f.write('writable')
+
+    strategy = copy_file(source_path, destination_path)
+    assert strategy != 'hardlink', 'Writable files should never be hard linked.'
+    assert not os.path.samefile(source_path, destination_path), \
+        'Modifying the copy should not modify the original.'
+
+
+@pytest.mark.parametrize('mode,writable', [
+    # Files without any write permissions are read-only, even when running as root.
+    (0o444, True),
+    # Files that the current user can't write to are also read-only.
+    (0o644, False),
+])
+def test_copy_file_hard_links_read_only_files(mode, writable, monkeypatch, tmpdir):
+    source_path = str(tmpdir.join('source'))
+    destination_path = str(tmpdir.join('destination'))
+    with open(source_path, 'w') as f:
+        f.write('read-only')
+    os.chmod(source_path, mode)
+    # The permission checks are skipped when running as root, so we'll simulate them.
+    monkeypatch.setattr(os, 'access', lambda path, access_mode: writable)
+    monkeypatch.setattr(copying, 'strategies', [
+        (name, strategy) for (name, strategy) in copying.strategies if name != 'reflink'
+    ])
+
+    assert copy_file(source_path, destination_path) == 'hardlink', \
+        'Read-only files on the same filesystem should be hard linked.'
+    assert os.path.samefile(source_path, destination_path), 'The files should be linked.'
+
+    private_path = str(tmpdir.join('private'))
+    assert copy_file(source_path, private_path, hardlink=False) != 'hardlink'
+    assert not os.path.samefile(source_path, private_path), 'The copy should be independent.'
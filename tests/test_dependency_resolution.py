@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import os
+import struct
+
+import pytest
+
+from exodus_bundler.bundling import Bundle
+from exodus_bundler.bundling import Elf
+from exodus_bundler.dependency_resolution import LddResolver
+from exodus_bundler.dependency_resolution import NativeResolver
+from exodus_bundler.dependency_resolution import parse_dependencies_from_ldd_output
+from exodus_bundler.dependency_resolution import parse_ld_so_cache
+from exodus_bundler.dependency_resolution import read_dynamic_info
+
+
+parent_directory = os.path.dirname(os.path.realpath(__file__))
+ldd_output_directory = os.path.join(parent_directory, 'data', 'ldd-output')
+chroot = os.path.join(parent_directory, 'data', 'binaries', 'chroot')
+fizz_buzz_glibc_32 = os.path.join(chroot, 'bin', 'fizz-buzz-glibc-32')
+fizz_buzz_glibc_32_exe = os.path.join(chroot, 'bin', 'fizz-buzz-glibc-32-exe')
+fizz_buzz_glibc_64 = os.path.join(chroot, 'bin', 'fizz-buzz-glibc-64')
+fizz_buzz_musl_64 = os.path.join(chroot, 'bin', 'fizz-buzz-musl-64')
+libc_glibc_64 = os.path.join(chroot, 'usr', 'lib', 'libc.so.6')
+
+
+@pytest.mark.parametrize('fizz_buzz', [
+    (fizz_buzz_glibc_32),
+    (fizz_buzz_glibc_32_exe),
+    (fizz_buzz_glibc_64),
+    (fizz_buzz_musl_64),
+])
+def test_native_resolver_matches_ldd_resolver(fizz_buzz):
+    elf = Elf(fizz_buzz, chroot=chroot)
+    ldd_dependencies = LddResolver().find_direct_dependencies(elf, elf.linker_file)
+    native_dependencies = NativeResolver().find_direct_dependencies(elf, elf.linker_file)
+    assert set(native_dependencies) == set(ldd_dependencies), \
+        'The native resolver should find the same dependencies as the linker.'
+
+
+@pytest.mark.parametrize('fizz_buzz,expected_file_count', [
+    (fizz_buzz_glibc_32, 3),
+    (fizz_buzz_glibc_64, 3),
+    (fizz_buzz_musl_64, 2),
+])
+def test_native_resolver_bundle_add_file(fizz_buzz, expected_file_count):
+    bundle = Bundle(chroot=chroot, resolver='native')
+    bundle.add_file(fizz_buzz)
+    assert len(bundle.files) == expected_file_count, \
+        'The bundle should include %d files.' % expected_file_count
+
+
+def test_native_resolver_uses_ld_so_cache(tmpdir):
+    # Construct a chroot where the library is only discoverable through the cache.
+    library_directory = tmpdir.mkdir('opt').mkdir('libc')
+    library_path = str(library_directory.join('libc.so.6'))
+    with open(libc_glibc_64, 'rb') as f_in, open(library_path, 'wb') as f_out:
+        f_out.write(f_in.read())
+    strings = b'libc.so.6\x00/opt/libc/libc.so.6\x00'
+    header = b'glibc-ld.so.cache1.1' + struct.pack('<IIB3sI12s', 1, len(strings), 2, b'', 0, b'')
+    entry = struct.pack('<iIIIQ', 0x0303, 72, 72 + len(b'libc.so.6\x00'), 0, 0)
+    tmpdir.mkdir('etc').join('ld.so.cache').write_binary(header + entry + strings)
+
+    elf = Elf(fizz_buzz_glibc_64, chroot=chroot)
+    elf.chroot = str(tmpdir)
+    dependencies = NativeResolver().find_direct_dependencies(elf, elf.linker_file)
+    assert library_path in dependencies, 'The library should be found via "ld.so.cache".'
+
+
+def test_parse_ld_so_cache():
+    strings = b'libfoo.so.1\x00/usr/lib/libfoo.so.1\x00'
+    header = b'glibc-ld.so.cache1.1' + struct.pack('<IIB3sI12s', 1, len(strings), 2, b'', 0, b'')
+    entry = struct.pack('<iIIIQ', 0x0303, 72, 84, 0, 0)
+    libraries = parse_ld_so_cache(header + entry + strings)
+    assert libraries == {'libfoo.so.1': ['/usr/lib/libfoo.so.1']}
+
+
+@pytest.mark.parametrize('filename_prefix', [
+    'htop-amazon-linux',
+    'htop-arch',
+    'htop-ubuntu-14.04',
+])
+def test_parse_dependencies_from_ldd_output(filename_prefix):
+    ldd_output_filename = filename_prefix + '.txt'
+    with open(os.path.join(ldd_output_directory, ldd_output_filename)) as f:
+        ldd_output = f.read()
+    dependencies = parse_dependencies_from_ldd_output(ldd_output)
+
+    ldd_results_filename = filename_prefix + '-dependencies.txt'
+    with open(os.path.join(ldd_output_directory, ldd_results_filename)) as f:
+        expected_dependencies = [line for line in f.read().split('\n') if len(line)]
+
+    assert set(dependencies) == set(expected_dependencies), \
+        'The dependencies were not parsed correctly from ldd output for "%s"' % filename_prefix
+
+
+@pytest.mark.parametrize('path,bits,needed,soname', [
+    (fizz_buzz_glibc_32, 32, ['libc.so.6'], None),
+    (fizz_buzz_glibc_64, 64, ['libc.so.6'], None),
+    (fizz_buzz_musl_64, 64, ['libc.so'], None),
+    (libc_glibc_64, 64, ['ld-linux-x86-64.so.2'], 'libc.so.6'),
+])
+def test_read_dynamic_info(path, bits, needed, soname):
+    info = read_dynamic_info(path)
+    assert info.bits == bits, 'The ELF class should be parsed from the header.'
+    assert info.needed == needed, 'The `DT_NEEDED` entries should be parsed.'
+    assert info.soname == soname, 'The `DT_SONAME` entry should be parsed.'
+    assert read_dynamic_info(os.path.join(ldd_output_directory, 'htop-arch.txt')) is None, \
+        'Non-ELF files should return `None`.'
+
+
+@pytest.mark.parametrize('resolver_class', [LddResolver, NativeResolver])
+def test_resolver_jobs(resolver_class):
+    serial_elf = Elf(fizz_buzz_glibc_64, chroot=chroot, resolver=resolver_class(jobs=1))
+    parallel_elf = Elf(fizz_buzz_glibc_64, chroot=chroot, resolver=resolver_class(jobs=4))
+    assert set(file.path for file in serial_elf.dependencies) == \
+        set(file.path for file in parallel_elf.dependencies), \
+        'Concurrent resolution should find the same dependencies.'
+    assert parallel_elf.resolver.map(lambda x: x * 2, range(10)) == list(range(0, 20, 2)), \
+        'The results should be returned in order.'
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import os
+import tarfile
+
+import pytest
+
+from exodus_bundler.archiving import index_filename
+from exodus_bundler.bundling import create_bundle
+from exodus_bundler.errors import InvalidBundleError
+from exodus_bundler.inspection import describe_index
+from exodus_bundler.inspection import read_index
+
+
+parent_directory = os.path.dirname(os.path.realpath(__file__))
+chroot = os.path.join(parent_directory, 'data', 'binaries', 'chroot')
+fizz_buzz_glibc_32 = os.path.join(chroot, 'bin', 'fizz-buzz-glibc-32')
+
+
+@pytest.mark.parametrize('filename,options', [
+    ('bundle.sh', {}),
+    ('bundle.sh', {'compression': 'xz'}),
+    ('bundle.sh', {'bundle_format': 'blobs'}),
+    ('bundle.tgz', {}),
+    ('bundle.tgz', {'direct': True}),
+    ('bundle.tar', {'compression': 'none', 'member_order': 'none'}),
+])
+def test_read_index(filename, options, tmpdir):
+    output = str(tmpdir.join(filename))
+    create_bundle([fizz_buzz_glibc_32], output, chroot=chroot, **options)
+    index = read_index(output)
+    assert list(index['entry_points']) == ['fizz-buzz-glibc-32'], 'The entry point is missing.'
+    assert len(index['launchers']) == 1, 'The launcher is missing.'
+    assert fizz_buzz_glibc_32 in [file['path'] for file in index['files']], 'A file is missing.'
+    assert 'fizz-buzz-glibc-32 -> bundles/' in describe_index(index)
+
+    if filename.endswith('.sh'):
+        return
+    with tarfile.open(output) as tar:
+        assert tar.getnames()[1] == os.path.join('exodus', index_filename), \
+            'The index should immediately follow the root directory.'
+
+
+def test_read_index_invalid_bundle(tmpdir):
+    not_a_bundle = tmpdir.join('bundle.sh')
+    not_a_bundle.write('#! /bin/bash\necho "Hello!"\n')
+    with pytest.raises(InvalidBundleError):
+        read_index(str(not_a_bundle))
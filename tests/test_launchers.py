@@ -14,6 +14,7 @@ from exodus_bundler.launchers import CompilerNotFoundError
 from exodus_bundler.launchers import compile_diet
 from exodus_bundler.launchers import compile_musl
 from exodus_bundler.launchers import construct_bash_launcher
+from exodus_bundler.launchers import construct_binary_launcher
 from exodus_bundler.launchers import find_executable
 
 
@@ -58,6 +59,25 @@ def test_compile(compiler):
     assert len(stderr.decode('utf-8')) == 0
 
 
+def test_construct_binary_launcher_cache(monkeypatch, tmpdir):
+    compiled_code = []
+
+    def compile(code):
+        compiled_code.append(code)
+        return b'launcher-%d' % len(compiled_code)
+    monkeypatch.setattr(launchers, 'compile', compile)
+
+    cache_directory = str(tmpdir.join('launchers'))
+    arguments = {'linker': './linker', 'library_path': '../lib', 'executable': './grep-x'}
+    first_content = construct_binary_launcher(cache_directory=cache_directory, **arguments)
+    second_content = construct_binary_launcher(cache_directory=cache_directory, **arguments)
+    assert first_content == second_content == b'launcher-1', \
+        'The cached launcher should have been reused.'
+    arguments['executable'] = './sed-x'
+    assert construct_binary_launcher(cache_directory=cache_directory, **arguments) == \
+        b'launcher-2', 'A launcher with different inputs should be compiled.'
+
+
 def test_find_executable():
     original_environment = os.environ.get('PATH')
     original_parent_directory = launchers.parent_directory
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import io
+import os
+
+import pytest
+
+from exodus_bundler.errors import InvalidProfileError
+from exodus_bundler.profiling import TargetProfile
+from exodus_bundler.profiling import create_host_profile
+from exodus_bundler.profiling import read_host_profile
+from exodus_bundler.profiling import write_host_profile
+
+
+parent_directory = os.path.dirname(os.path.realpath(__file__))
+chroot = os.path.join(parent_directory, 'data', 'binaries', 'chroot')
+libc_32 = os.path.join(chroot, 'usr', 'lib32', 'libc.so.6')
+
+
+def test_create_host_profile(tmpdir):
+    tmpdir.join('libc.so.6').mksymlinkto(libc_32)
+    tmpdir.join('fizz-buzz').mksymlinkto(os.path.join(chroot, 'bin', 'fizz-buzz-glibc-32'))
+    profile = create_host_profile([os.path.join(chroot, 'usr', 'lib32'), str(tmpdir)])
+    with open(libc_32, 'rb') as f:
+        libc_hash = hashlib.sha256(f.read()).hexdigest()
+    assert profile[libc_32] == libc_hash
+    assert profile[str(tmpdir.join('libc.so.6'))] == libc_hash, \
+        'Symlinks should be recorded with the hash of their targets.'
+    assert str(tmpdir.join('fizz-buzz')) not in profile, 'Only libraries should be included.'
+
+    with io.open(str(tmpdir.join('profile.json')), 'w') as f:
+        write_host_profile(f, profile)
+    assert read_host_profile(str(tmpdir.join('profile.json'))) == profile
+
+
+def test_target_profile(tmpdir):
+    profile = create_host_profile([os.path.join(chroot, 'usr')])
+    profile = dict((os.path.join('/', os.path.relpath(path, chroot)), file_hash)
+                   for path, file_hash in profile.items())
+    # The 64-bit library differs on the target, so it needs to be bundled.
+    profile['/usr/lib/libc.so.6'] = '0' * 64
+    filename = str(tmpdir.join('profile.json'))
+    with io.open(filename, 'w') as f:
+        write_host_profile(f, profile)
+
+    target_profile = TargetProfile(filename, chroot=chroot)
+    assert target_profile.provides(libc_32)
+    assert not target_profile.provides(os.path.join(chroot, 'usr', 'lib', 'libc.so.6'))
+    assert not target_profile.provides(os.path.join(chroot, 'lib', 'ld-linux.so.2'))
+
+
+def test_read_invalid_host_profile(tmpdir):
+    tmpdir.join('profile.json').write('{"members": {}}')
+    with pytest.raises(InvalidProfileError):
+        read_host_profile(str(tmpdir.join('profile.json')))
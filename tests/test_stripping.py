@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+
+import pytest
+
+from exodus_bundler.elf_parsing import read_build_id
+from exodus_bundler.elf_parsing import read_elf_header
+from exodus_bundler.launchers import find_executable
+from exodus_bundler.stripping import Stripper
+
+
+parent_directory = os.path.dirname(os.path.realpath(__file__))
+chroot = os.path.join(parent_directory, 'data', 'binaries', 'chroot')
+fizz_buzz_glibc_64 = os.path.join(chroot, 'bin', 'fizz-buzz-glibc-64')
+fizz_buzz_musl_64 = os.path.join(chroot, 'bin', 'fizz-buzz-musl-64')
+
+
+def read_file_build_id(path):
+    with open(path, 'rb') as f:
+        return read_build_id(f, read_elf_header(f, path))
+
+
+def test_read_build_id():
+    build_id = read_file_build_id(fizz_buzz_glibc_64)
+    assert len(build_id) == 40, 'The SHA-1 build ID should be read as hexadecimal.'
+    output = subprocess.check_output(['file', '-L', fizz_buzz_glibc_64]).decode('utf-8')
+    assert 'BuildID[sha1]=%s' % build_id in output
+    assert read_file_build_id(fizz_buzz_musl_64) is None, 'This binary has no build ID.'
+
+
+@pytest.mark.parametrize('mode', ['debug', 'all'])
+def test_stripper(mode, tmpdir):
+    if not find_executable('objcopy'):
+        pytest.skip('The "objcopy" command is not available.')
+    with open(fizz_buzz_glibc_64, 'rb') as f:
+        original_content = f.read()
+    stripper = Stripper(mode, str(tmpdir.join('stripped')), str(tmpdir.join('debug')))
+
+    stripped_path = stripper.strip(fizz_buzz_glibc_64)
+    assert stripped_path != fizz_buzz_glibc_64, 'A stripped copy should have been created.'
+    assert os.path.getsize(stripped_path) < len(original_content), 'Nothing was stripped.'
+    assert os.access(stripped_path, os.X_OK), 'The permissions should be preserved.'
+    with open(fizz_buzz_glibc_64, 'rb') as f:
+        assert f.read() == original_content, 'The original file should never be modified.'
+    assert stripper.strip(fizz_buzz_glibc_64) == stripped_path, 'The copy should be reused.'
+
+    build_id = read_file_build_id(fizz_buzz_glibc_64)
+    debug_path = tmpdir.join('debug', '.build-id', build_id[:2], build_id[2:] + '.debug')
+    assert debug_path.check(), 'The debugging information should be keyed by its build ID.'
+
+    # Binaries without build IDs are still stripped, their debugging information is just skipped.
+    assert stripper.strip(fizz_buzz_musl_64) != fizz_buzz_musl_64
+    assert len(tmpdir.join('debug', '.build-id').listdir()) == 1
+
+    # Only the copies that were used by a later stripper should survive pruning.
+    later_stripper = Stripper(mode, str(tmpdir.join('stripped')))
+    assert later_stripper.strip(fizz_buzz_glibc_64) == stripped_path
+    tmpdir.join('stripped', '.tmp-in-progress').write('')
+    later_stripper.prune()
+    assert os.path.exists(stripped_path), 'A used copy was pruned.'
+    key = os.path.basename(stripped_path)
+    assert sorted(path.basename for path in tmpdir.join('stripped').listdir()) == \
+        ['.tmp-in-progress', key, key + '.debug'], \
+        'The unused copies should be pruned, but copies that are being written should be kept.'